@@ -0,0 +1,431 @@
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+from urllib.parse import parse_qs, unquote, urlsplit
+from uuid import uuid4
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+BLOCK_SIZE = 64 * 1024
+# os.ModeDir of the Go filer
+FILER_MODE_DIR = 1 << 31
+# the filer lists 100 entries when the request does not say
+DEFAULT_LIST_LIMIT = 100
+
+
+class _Blob(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+    md5: bytes
+
+
+class _Link:
+    # One direction of a shared link of `bandwidth` bytes/s: every block waits for
+    # the blocks sent before it, whichever connection they belong to.
+    def __init__(self, bandwidth: float | None):
+        self._bandwidth = bandwidth
+        self._lock = threading.Lock()
+        self._free_at = 0.0
+
+    def send(self, size: int):
+        if not self._bandwidth:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._free_at = max(self._free_at, now) + size / self._bandwidth
+            delay = self._free_at - now
+        time.sleep(delay)
+
+
+def _format_time(t: float) -> str:
+    return datetime.fromtimestamp(t, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _parent(path: str) -> str:
+    return path.rsplit("/", 1)[0] or "/"
+
+
+class FakeFiler:
+    # An in-process stand-in for the SeaweedFS filer HTTP API, covering what
+    # SeaweedfsClient uses: paged JSON listings, metadata, downloads, multipart and
+    # raw uploads with appends, moves and (recursive) deletes. File contents are kept
+    # on disk so that they do not count towards the memory of the process under
+    # test. Every request waits `latency` seconds before it is answered, and requests
+    # and bodies go through an up and a down link of `bandwidth` bytes/s each.
+    def __init__(
+        self,
+        *,
+        latency: float = 0,
+        bandwidth: float | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.latency = latency
+        self._up = _Link(bandwidth)
+        self._down = _Link(bandwidth)
+        self._blob_path = tempfile.mkdtemp(prefix="fake-filer-")
+        # reentrant, as empty answers are sent while it is held
+        self._lock = threading.RLock()
+        self._files: dict[str, _Blob] = {}
+        self._dirs: dict[str, float] = {"/": time.time()}
+        self._children: dict[str, set[str]] = {"/": set()}
+        self._stats: Counter[str] = Counter()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-filer", daemon=True
+        )
+        self._thread.start()
+        return self.url
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        shutil.rmtree(self._blob_path, ignore_errors=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self) -> Counter[str]:
+        # requests per operation, plus 'bytes_up', 'bytes_down' and 'connections'
+        with self._lock:
+            return Counter(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    def files(self) -> dict[str, int]:
+        with self._lock:
+            return {path: blob.size for path, blob in self._files.items()}
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    # The tree is kept as a dict of files, a dict of directories and the children
+    # of every directory; callers hold self._lock.
+
+    def _add_dirs(self, path: str):
+        now = time.time()
+        while path not in self._dirs:
+            self._dirs[path] = now
+            self._children.setdefault(path, set())
+            self._children.setdefault(_parent(path), set()).add(path)
+            path = _parent(path)
+
+    def _add_file(self, path: str, blob: _Blob):
+        self._add_dirs(_parent(path))
+        if path in self._dirs:
+            raise IsADirectoryError(path)
+        old = self._files.get(path)
+        self._files[path] = blob
+        self._children[_parent(path)].add(path)
+        if old is not None and old.path != blob.path:
+            os.remove(old.path)
+
+    def _subtree(self, path: str) -> tuple[list[str], list[str]]:
+        if path in self._files:
+            return [path], []
+        files, dirs, pending = [], [], [path]
+        while pending:
+            d = pending.pop()
+            dirs.append(d)
+            for child in self._children[d]:
+                (pending if child in self._dirs else files).append(child)
+        return files, dirs
+
+    def _remove(self, path: str):
+        files, dirs = self._subtree(path)
+        for f in files:
+            os.remove(self._files.pop(f).path)
+        if path == "/":
+            dirs.remove("/")
+            self._children["/"].clear()
+        else:
+            self._children[_parent(path)].discard(path)
+        for d in dirs:
+            del self._dirs[d]
+            del self._children[d]
+
+    def _move(self, src: str, dst: str):
+        files, dirs = self._subtree(src)
+        if dst in self._files or dst in self._dirs:
+            self._remove(dst)
+        blobs = {f: self._files.pop(f) for f in files}
+        self._children[_parent(src)].discard(src)
+        for d in dirs:
+            del self._dirs[d]
+            del self._children[d]
+        for d in sorted(dirs):
+            self._add_dirs(dst + d[len(src) :])
+        for f, blob in blobs.items():
+            self._add_file(dst + f[len(src) :], blob)
+
+    def _entry(self, path: str) -> dict:
+        if path in self._dirs:
+            mtime = _format_time(self._dirs[path])
+            return {
+                "FullPath": path,
+                "Mtime": mtime,
+                "Crtime": mtime,
+                "Mode": FILER_MODE_DIR | 0o770,
+                "Mime": "",
+                "FileSize": 0,
+            }
+        blob = self._files[path]
+        mtime = _format_time(blob.mtime)
+        return {
+            "FullPath": path,
+            "Mtime": mtime,
+            "Crtime": mtime,
+            "Mode": 0o660,
+            "Mime": mimetypes.guess_type(path)[0] or "application/octet-stream",
+            "Md5": base64.b64encode(blob.md5).decode(),
+            "FileSize": blob.size,
+            "chunks": [
+                {
+                    "file_id": f"1,{os.path.basename(blob.path)}",
+                    "size": blob.size,
+                    "mtime": int(blob.mtime * 1e9),
+                    "e_tag": blob.md5.hex(),
+                }
+            ],
+        }
+
+    def _listing(self, path: str, limit: int, last_file_name: str | None) -> dict:
+        children = sorted(self._children[path])
+        if last_file_name:
+            prefix = path.rstrip("/") + "/"
+            children = [c for c in children if c[len(prefix) :] > last_file_name]
+        page = children[:limit]
+        return {
+            "Path": path,
+            "Entries": [self._entry(c) for c in page] or None,
+            "Limit": limit,
+            "LastFileName": page[-1].rsplit("/", 1)[1] if page else "",
+            "ShouldDisplayLoadMore": len(children) > limit,
+            "EmptyFolder": not children,
+        }
+
+    def _make_handler(self):
+        filer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                filer._count("connections")
+
+            def log_message(self, format, *args):
+                pass
+
+            def _parse(self) -> tuple[str, dict[str, str]]:
+                # the request itself queues behind the bodies sent before it
+                filer._up.send(len(self.requestline) + len(str(self.headers)))
+                time.sleep(filer.latency)
+                url = urlsplit(self.path)
+                path = unquote(url.path)
+                if len(path) > 1:
+                    path = path.rstrip("/")
+                return path, {k: v[0] for k, v in parse_qs(url.query).items()}
+
+            def _send(
+                self,
+                code: int,
+                body: bytes = b"",
+                content_type: str = "application/json",
+            ):
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self._write(body)
+
+            def _send_json(self, code: int, j: dict):
+                self._send(code, json.dumps(j).encode())
+
+            def _write(self, bs: bytes):
+                filer._down.send(len(bs))
+                filer._count("bytes_down", len(bs))
+                self.wfile.write(bs)
+
+            def _read_body(self, f):
+                # the body in blocks into `f`, whether it is sized or chunked
+                def read(size: int):
+                    while size > 0:
+                        bs = self.rfile.read(min(size, BLOCK_SIZE))
+                        if not bs:
+                            raise ConnectionError("Request body ended early")
+                        filer._up.send(len(bs))
+                        filer._count("bytes_up", len(bs))
+                        f.write(bs)
+                        size -= len(bs)
+
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    while size := int(self.rfile.readline().split(b";")[0], 16):
+                        read(size)
+                        self.rfile.readline()
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                else:
+                    read(int(self.headers.get("Content-Length") or 0))
+
+            def _store(self, path: str, append: bool):
+                blob_file = os.path.join(filer._blob_path, uuid4().hex)
+                with open(blob_file, "w+b") as f:
+                    self._read_body(f)
+                    content_type = self.headers.get("Content-Type", "")
+                    if content_type.startswith("multipart/form-data"):
+                        self._extract_part(f, content_type)
+                with filer._lock:
+                    old = filer._files.get(path)
+                if append and old is not None:
+                    # appending writes a new blob, so that readers of the old one
+                    # never see it change
+                    appended_file = os.path.join(filer._blob_path, uuid4().hex)
+                    shutil.copyfile(old.path, appended_file)
+                    with open(appended_file, "ab") as af, open(blob_file, "rb") as f:
+                        shutil.copyfileobj(f, af, BLOCK_SIZE)
+                    os.replace(appended_file, blob_file)
+                md5 = hashlib.md5()
+                with open(blob_file, "rb") as f:
+                    while bs := f.read(BLOCK_SIZE):
+                        md5.update(bs)
+                size = os.path.getsize(blob_file)
+                try:
+                    with filer._lock:
+                        filer._add_file(
+                            path, _Blob(blob_file, size, time.time(), md5.digest())
+                        )
+                except (IsADirectoryError, NotADirectoryError):
+                    os.remove(blob_file)
+                    return self._send_json(500, {"error": f"{path} is a directory"})
+                self._send_json(
+                    201,
+                    {
+                        "name": path.rsplit("/", 1)[1],
+                        "size": size,
+                        "eTag": md5.hexdigest(),
+                    },
+                )
+
+            def _extract_part(self, f, content_type: str):
+                # a single-file form: keep what is between the part headers and the
+                # closing boundary
+                boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+                f.seek(0)
+                head = f.read(BLOCK_SIZE)
+                start = head.index(b"\r\n\r\n") + 4
+                end = f.seek(0, os.SEEK_END) - len(b"\r\n--" + boundary + b"--\r\n")
+                with open(f.name + ".part", "wb") as part:
+                    f.seek(start)
+                    remaining = end - start
+                    while remaining > 0:
+                        bs = f.read(min(remaining, BLOCK_SIZE))
+                        part.write(bs)
+                        remaining -= len(bs)
+                os.replace(f.name + ".part", f.name)
+                f.seek(0)
+
+            def do_GET(self):
+                path, params = self._parse()
+                # answered once the lock is released, as sending may be throttled
+                with filer._lock:
+                    if params.get("metadata") == "true":
+                        filer._stats["metadata"] += 1
+                        if path not in filer._files and path not in filer._dirs:
+                            return self._send(404)
+                        j = filer._entry(path)
+                    elif path in filer._dirs:
+                        filer._stats["list"] += 1
+                        limit = int(params.get("limit") or DEFAULT_LIST_LIMIT)
+                        j = filer._listing(path, limit, params.get("lastFileName"))
+                    else:
+                        filer._stats["read"] += 1
+                        blob = filer._files.get(path)
+                        if blob is None:
+                            return self._send(404)
+                        # the blob of a replaced file is removed, which an open file
+                        # survives
+                        f = open(blob.path, "rb")
+                        j = None
+                if j is not None:
+                    return self._send_json(200, j)
+                with f:
+                    content_type = (
+                        mimetypes.guess_type(path)[0] or "application/octet-stream"
+                    )
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(blob.size))
+                    self.send_header("ETag", f'"{blob.md5.hex()}"')
+                    self.end_headers()
+                    while bs := f.read(BLOCK_SIZE):
+                        self._write(bs)
+
+            def do_POST(self):
+                path, params = self._parse()
+                if "mv.from" in params:
+                    src = params["mv.from"].rstrip("/") or "/"
+                    with open(os.devnull, "wb") as f:
+                        self._read_body(f)
+                    with filer._lock:
+                        filer._stats["move"] += 1
+                        found = src in filer._files or src in filer._dirs
+                        if found:
+                            filer._move(src, path)
+                    if not found:
+                        return self._send_json(500, {"error": f"{src} not found"})
+                    return self._send(200)
+                append = params.get("op") == "append"
+                filer._count("append" if append else "upload")
+                self._store(path, append)
+
+            def do_PUT(self):
+                path, params = self._parse()
+                append = params.get("op") == "append"
+                filer._count("append" if append else "upload")
+                self._store(path, append)
+
+            def do_DELETE(self):
+                path, params = self._parse()
+                with filer._lock:
+                    filer._stats["delete"] += 1
+                    recursive = params.get("recursive") == "true"
+                    not_empty = path in filer._dirs and bool(filer._children[path])
+                    if not_empty and not recursive:
+                        error = f"{path} is not empty"
+                    else:
+                        error = None
+                        if path in filer._files or path in filer._dirs:
+                            filer._remove(path)
+                if error:
+                    return self._send_json(500, {"error": error})
+                self._send(204)
+
+        return Handler
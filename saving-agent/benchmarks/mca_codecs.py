@@ -0,0 +1,76 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from migrater.codecs import MCA_CODECS  # noqa: E402
+from migrater.mca import MCA_CHUNKS, MCA_SECTOR, MCACompressor  # noqa: E402
+
+
+# chunk-like payloads: long runs of a few block ids with some noise, which compress
+# roughly like real chunk NBT does
+def make_region(path: str, chunks: int, seed: int):
+    rng = random.Random(seed)
+    locations = bytearray(MCA_SECTOR)
+    timestamps = bytearray(MCA_SECTOR)
+    body = bytearray()
+    for idx in sorted(rng.sample(range(MCA_CHUNKS), chunks)):
+        raw = bytearray()
+        while len(raw) < 40000:
+            raw.extend(bytes([rng.randrange(8)]) * rng.randint(1, 64))
+            raw.extend(rng.randbytes(rng.randint(0, 8)))
+        data = zlib.compress(raw)
+        payload = (len(data) + 1).to_bytes(4, "big") + b"\x02" + data
+        sectors = (len(payload) + MCA_SECTOR - 1) // MCA_SECTOR
+        offset = 2 + len(body) // MCA_SECTOR
+        body.extend(payload.ljust(sectors * MCA_SECTOR, b"\0"))
+        locations[idx * 4 : idx * 4 + 4] = offset.to_bytes(3, "big") + bytes([sectors])
+        timestamps[idx * 4 : idx * 4 + 4] = (1700000000 + idx).to_bytes(4, "big")
+    with open(path, "wb") as f:
+        f.write(locations)
+        f.write(timestamps)
+        f.write(body)
+
+
+def decode_all(path: str):
+    with open(path, "rb") as f:
+        compressor = MCACompressor(f)
+        for idx in compressor._read_header().indices():
+            compressor.read_chunk(idx)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark region chunk codecs")
+    parser.add_argument("region", nargs="?", help="Region file to convert (default: a synthetic one)")
+    parser.add_argument("--chunks", type=int, default=400, help="Chunks in the synthetic region")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        region = args.region
+        if region is None:
+            region = os.path.join(tmp, "r.0.0.mca")
+            make_region(region, args.chunks, args.seed)
+        print(f"{region}: {os.path.getsize(region)} bytes")
+        print(f"{'codec':>6} {'size':>10} {'encode s':>9} {'decode s':>9}")
+        for compression_type, codec in MCA_CODECS.items():
+            out_dir = os.path.join(tmp, codec.name)
+            os.makedirs(out_dir)
+            out = os.path.join(out_dir, os.path.basename(region))
+            start = time.perf_counter()
+            with open(region, "rb") as src_f, open(out, "wb") as dst_f:
+                MCACompressor(src_f).convert_to(compression_type, dst_f)
+            encode = time.perf_counter() - start
+            start = time.perf_counter()
+            decode_all(out)
+            decode = time.perf_counter() - start
+            print(f"{codec.name:>6} {os.path.getsize(out):>10} {encode:>9.3f} {decode:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
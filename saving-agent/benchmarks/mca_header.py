@@ -0,0 +1,83 @@
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from migrater.mca import (  # noqa: E402
+    MCA_CHUNK_LENGTH,
+    MCA_CHUNKS,
+    MCA_CHUNKS_4,
+    MCAHeader,
+    MCAHeaderEntry,
+    _get_chunk_xy,
+)
+
+
+# the per-entry parser `MCACompressor` used before `MCAHeader`, kept for comparison
+def legacy_parse_header(header_bs: bytes) -> dict:
+    header = {}
+    for idx, (loc_bs, time_bs) in enumerate(
+        (
+            header_bs[i : i + 4],
+            header_bs[MCA_CHUNKS_4 + i : MCA_CHUNKS_4 + i + 4],
+        )
+        for i in range(0, MCA_CHUNKS_4, 4)
+    ):
+        chunk_xy = (idx % MCA_CHUNK_LENGTH, idx // MCA_CHUNK_LENGTH)
+        offset = int.from_bytes(loc_bs[0:3], byteorder="big")
+        sectors = int.from_bytes(loc_bs[3:4], byteorder="big")
+        timestamp = int.from_bytes(time_bs, byteorder="big")
+        if all([offset, sectors, timestamp]):
+            header[chunk_xy] = MCAHeaderEntry(offset, sectors, timestamp)
+    return header
+
+
+def make_header(fill: float, seed: int) -> bytes:
+    rng = random.Random(seed)
+    locations = bytearray()
+    timestamps = bytearray()
+    offset = 2
+    for _ in range(MCA_CHUNKS):
+        if rng.random() < fill:
+            sectors = rng.randint(1, 8)
+            locations.extend(offset.to_bytes(3, "big") + sectors.to_bytes(1, "big"))
+            timestamps.extend(rng.randint(1, 2**31).to_bytes(4, "big"))
+            offset += sectors
+        else:
+            locations.extend(bytes(4))
+            timestamps.extend(bytes(4))
+    return bytes(locations + timestamps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MCA header parsing")
+    parser.add_argument("--fill", type=float, default=0.8, help="Share of present chunks")
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    header_bs = make_header(args.fill, args.seed)
+    legacy = legacy_parse_header(header_bs)
+    header = MCAHeader(header_bs)
+    current = {_get_chunk_xy(idx): header.entry(idx) for idx in header.indices()}
+    assert legacy == current, "parsers disagree"
+
+    cases = {
+        "legacy parse": lambda: legacy_parse_header(header_bs),
+        "MCAHeader parse": lambda: MCAHeader(header_bs),
+        "legacy scan": lambda: [e.chunk_sectors for e in legacy_parse_header(header_bs).values()],
+        "MCAHeader scan": lambda: [
+            h.sectors(idx) for h in (MCAHeader(header_bs),) for idx in h.indices()
+        ],
+    }
+    print(f"{len(current)} chunks present, {args.number} runs each")
+    for name, fn in cases.items():
+        seconds = min(timeit.repeat(fn, number=args.number, repeat=3)) / args.number
+        print(f"{name:>16}: {seconds * 1e6:9.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import filecmp
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from loguru import logger  # noqa: E402
+
+from fake_filer import FakeFiler  # noqa: E402
+from migrater.manifest import hash_file  # noqa: E402
+from migrater.seaweedfs.api import TRANSFER_BLOCK_SIZE, SeaweedfsClient  # noqa: E402
+from trivial_sync import read_peak_rss, reset_peak_rss  # noqa: E402
+
+MIB = 1024 * 1024
+
+
+def write_file(path: str, size: int):
+    # random blocks, so that nothing on the way can shrink the file
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining:
+            block = os.urandom(min(remaining, MIB))
+            f.write(block)
+            remaining -= len(block)
+
+
+def measure(fn) -> tuple[float, int, int]:
+    # seconds, and the peaks of Python allocations and of RSS above what was in use
+    # before, while `fn` runs
+    reset_peak_rss()
+    rss_before = read_peak_rss()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        fn()
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak, read_peak_rss() - rss_before
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that SeaweedfsClient streams uploads and downloads of a large file in bounded memory"
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=256,
+        help="MiB of the synthetic file (default: 256)",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=float,
+        default=16,
+        help="MiB of Python allocations a transfer may peak at (default: 16)",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="WARNING",
+        help="Log level of the client (default: WARNING)",
+    )
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    size = args.size * MIB
+    with tempfile.TemporaryDirectory() as tmp, FakeFiler() as filer:
+        local_path = os.path.join(tmp, "big.bin")
+        write_file(local_path, size)
+        sha256 = hash_file(local_path)
+        client = SeaweedfsClient(filer.url, pool_size=1)
+        cases = {
+            "upload (POST)": lambda: client.upload(local_path, "/big.bin", sha256=sha256),
+            "upload (PUT)": lambda: client.upload(
+                local_path, "/big.bin", use_put=True, sha256=sha256
+            ),
+            "download": lambda: client.download("/big.bin", os.path.join(tmp, "pulled.bin")),
+        }
+        print(
+            f"{args.size} MiB file, {TRANSFER_BLOCK_SIZE // 1024} KiB transfer blocks"
+        )
+        failed = []
+        for name, fn in cases.items():
+            seconds, peak, rss = measure(fn)
+            print(
+                f"{name:>14}: {seconds:6.2f}s, peak Python allocations {peak / MIB:6.1f} MiB,"
+                f" peak RSS growth {rss / MIB:6.1f} MiB"
+            )
+            if peak > args.max_memory * MIB:
+                failed.append(name)
+        client.close()
+        if filer.files().get("/big.bin") != size:
+            failed.append("remote size")
+        if not filecmp.cmp(local_path, os.path.join(tmp, "pulled.bin"), shallow=False):
+            failed.append("pulled content")
+
+    if failed:
+        print(f"FAILED: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"memory stayed under {args.max_memory:g} MiB")
+
+
+if __name__ == "__main__":
+    main()
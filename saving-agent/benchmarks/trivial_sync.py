@@ -0,0 +1,282 @@
+import argparse
+import filecmp
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from loguru import logger  # noqa: E402
+
+from fake_filer import FakeFiler  # noqa: E402
+from migrater.mca import (  # noqa: E402
+    MCA_HEADER_SIZE,
+    MCA_REGION_PATTERN,
+    MCACompressor,
+    MCAHeader,
+)
+from migrater.seaweedfs import TrivialMigrater  # noqa: E402
+from world import WorldGenerator  # noqa: E402
+
+REQUEST_KINDS = ("list", "metadata", "read", "upload", "append", "move", "delete")
+MIB = 1024 * 1024
+
+
+def reset_peak_rss() -> bool:
+    # Linux resets VmHWM when 5 is written to clear_refs, elsewhere the peak of the
+    # whole run is all there is
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def read_peak_rss() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def tree_size(path: str) -> tuple[int, int]:
+    files = size = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return files, size
+
+
+def same_region(a: str, b: str) -> bool:
+    # regions rebuilt from deltas or transcoded on the way may lay out and compress
+    # their chunks differently, so the chunks are compared decoded
+    with open(a, "rb") as fa, open(b, "rb") as fb:
+        header_a_bs, header_b_bs = fa.read(MCA_HEADER_SIZE), fb.read(MCA_HEADER_SIZE)
+        if len(header_a_bs) != MCA_HEADER_SIZE or len(header_b_bs) != MCA_HEADER_SIZE:
+            return False
+        header_a, header_b = MCAHeader(header_a_bs), MCAHeader(header_b_bs)
+        indices = list(header_a.indices())
+        if indices != list(header_b.indices()):
+            return False
+        region_a, region_b = MCACompressor(fa, lazy=True), MCACompressor(fb, lazy=True)
+        for idx in indices:
+            if header_a.timestamp(idx) != header_b.timestamp(idx):
+                return False
+            if region_a.read_chunk(idx) != region_b.read_chunk(idx):
+                return False
+    return True
+
+
+def count_differences(a: str, b: str) -> int:
+    cmp = filecmp.dircmp(a, b)
+    differences = len(cmp.left_only) + len(cmp.right_only) + len(cmp.funny_files)
+    _, mismatch, errors = filecmp.cmpfiles(a, b, cmp.common_files, shallow=False)
+    differences += len(errors)
+    differences += sum(
+        not (
+            MCA_REGION_PATTERN.match(name)
+            and same_region(os.path.join(a, name), os.path.join(b, name))
+        )
+        for name in mismatch
+    )
+    for sub in cmp.common_dirs:
+        differences += count_differences(os.path.join(a, sub), os.path.join(b, sub))
+    return differences
+
+
+class Bench:
+    def __init__(self, filer: FakeFiler):
+        self._filer = filer
+        self.rows: list[list[str]] = []
+
+    def run(self, name: str, fn):
+        self._filer.reset_stats()
+        reset_peak_rss()
+        start = time.perf_counter()
+        fn()
+        seconds = time.perf_counter() - start
+        stats = self._filer.stats()
+        requests = sum(stats[kind] for kind in REQUEST_KINDS)
+        self.rows.append(
+            [
+                name,
+                f"{seconds:.2f}",
+                str(requests),
+                *(str(stats[kind]) for kind in REQUEST_KINDS),
+                f"{stats['bytes_up'] / MIB:.1f}",
+                f"{stats['bytes_down'] / MIB:.1f}",
+                str(stats["connections"]),
+                f"{read_peak_rss() / MIB:.0f}",
+            ]
+        )
+
+    def print(self):
+        head = [
+            "phase",
+            "wall s",
+            "requests",
+            *REQUEST_KINDS,
+            "up MiB",
+            "down MiB",
+            "conns",
+            "peak RSS MiB",
+        ]
+        widths = [
+            max(len(row[i]) for row in [head] + self.rows) for i in range(len(head))
+        ]
+        for row in [head] + self.rows:
+            print(
+                f"{row[0]:<{widths[0]}}  "
+                + "  ".join(
+                    f"{cell:>{width}}" for cell, width in zip(row[1:], widths[1:])
+                )
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark pushes and pulls of TrivialMigrater against a local fake filer"
+    )
+    parser.add_argument(
+        "--world", help="Save to push instead of a synthetic one (default: none)"
+    )
+    parser.add_argument(
+        "--regions",
+        type=int,
+        default=32,
+        help="Regions of the synthetic save, over all dimensions (default: 32)",
+    )
+    parser.add_argument(
+        "--players",
+        type=int,
+        default=50,
+        help="Players of the synthetic save (default: 50)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the synthetic save (default: 0)"
+    )
+    parser.add_argument(
+        "--play-regions",
+        type=float,
+        default=0.1,
+        help="Share of the regions changed between pushes (default: 0.1)",
+    )
+    parser.add_argument(
+        "--play-chunks",
+        type=float,
+        default=0.05,
+        help="Share of the chunks changed in a changed region (default: 0.05)",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0,
+        help="Milliseconds the filer waits before answering each request (default: 0)",
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=0,
+        help="MiB/s of the link to the filer in each direction, 0 for no limit (default: 0)",
+    )
+    parser.add_argument(
+        "--incremental", action="store_true", help="Push incrementally (default: False)"
+    )
+    parser.add_argument(
+        "--region-delta",
+        action="store_true",
+        help="Push region deltas, implies --incremental (default: False)",
+    )
+    parser.add_argument(
+        "--region-lzma",
+        action="store_true",
+        help="Push regions as LZMA (default: False)",
+    )
+    parser.add_argument(
+        "--pack-small-files",
+        action="store_true",
+        help="Push small player and data files in packs (default: False)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Parallel transfers (default: 1)"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        help="MiB/s the migrater limits its transfers to (default: no limit)",
+    )
+    parser.add_argument(
+        "--adaptive-rate",
+        action="store_true",
+        help="Adapt the rate limit to the RTT to the filer (default: False)",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="WARNING",
+        help="Log level of the migrater (default: WARNING)",
+    )
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        local_path = os.path.join(tmp, "save")
+        pull_path = os.path.join(tmp, "pulled")
+        world = None
+        if args.world:
+            local_path = os.path.abspath(args.world)
+        else:
+            start = time.perf_counter()
+            world = WorldGenerator(local_path, seed=args.seed)
+            world.generate(regions=args.regions, players=args.players)
+            print(f"generated in {time.perf_counter() - start:.1f}s")
+        files, size = tree_size(local_path)
+        print(f"{local_path}: {files} files, {size / MIB:.1f} MiB")
+
+        bandwidth = args.bandwidth * MIB if args.bandwidth else None
+        with FakeFiler(latency=args.latency / 1000, bandwidth=bandwidth) as filer:
+            options = dict(
+                incremental=args.incremental or args.region_delta,
+                region_delta=args.region_delta,
+                region_lzma=args.region_lzma,
+                pack_small_files=args.pack_small_files,
+                workers=args.workers,
+                pool_size=max(args.workers, 1),
+                rate_limit=args.rate_limit * MIB if args.rate_limit else None,
+                adaptive_rate=args.adaptive_rate,
+            )
+            pusher = TrivialMigrater(local_path, "/save", filer.url, **options)
+            puller = TrivialMigrater(pull_path, "/save", filer.url, **options)
+            bench = Bench(filer)
+            bench.run("push (first)", pusher.push)
+            bench.run("push (unchanged)", pusher.push)
+            if world is not None:
+                changed = world.play(regions=args.play_regions, chunks=args.play_chunks)
+                bench.run(f"push ({changed} changed)", pusher.push)
+            bench.run("pull (empty)", puller.pull)
+            bench.run("pull (unchanged)", puller.pull)
+            bench.print()
+            remote_files = filer.files()
+            remote_size = sum(remote_files.values())
+            print(f"remote: {len(remote_files)} files, {remote_size / MIB:.1f} MiB")
+
+        differences = count_differences(local_path, pull_path)
+        if differences:
+            print(f"pulled save differs in {differences} files")
+        else:
+            print("pulled save matches")
+
+
+if __name__ == "__main__":
+    main()
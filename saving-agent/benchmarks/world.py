@@ -0,0 +1,310 @@
+import gzip
+import json
+import os
+import random
+import struct
+import sys
+import uuid
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from migrater.mca import (  # noqa: E402
+    MCA_CHUNKS,
+    MCA_HEADER_SIZE,
+    MCA_SECTOR,
+    MCAHeader,
+)
+
+# A Spigot world container: each dimension is a world directory of its own, with
+# player files kept by the overworld. Shares of the regions per dimension directory
+# and per region kind, and the size of a chunk of every kind before compression,
+# roughly follow those of a small survival server.
+DIMENSIONS = {"world": 0.8, "world_nether/DIM-1": 0.15, "world_the_end/DIM1": 0.05}
+REGION_KINDS = {
+    "region": (1.0, 8000, 48000),
+    "entities": (0.4, 100, 3000),
+    "poi": (0.3, 100, 1200),
+}
+DATA_FILES = ("idcounts.dat", "raids.dat", "random_sequences.dat", "scoreboard.dat")
+# regions within this many regions of the spawn are fully generated
+LOADED_RADIUS = 1
+BASE_TIMESTAMP = 1700000000
+SEGMENT_SIZE = 1024
+
+
+def _nbt_payload(value) -> tuple[int, bytes]:
+    if isinstance(value, bool):
+        return 1, struct.pack(">b", value)
+    if isinstance(value, int):
+        return 3, struct.pack(">i", value)
+    if isinstance(value, float):
+        return 6, struct.pack(">d", value)
+    if isinstance(value, str):
+        bs = value.encode()
+        return 8, struct.pack(">H", len(bs)) + bs
+    if isinstance(value, bytes):
+        return 7, struct.pack(">i", len(value)) + value
+    if isinstance(value, list):
+        items = [_nbt_payload(item) for item in value]
+        tag = items[0][0] if items else 0
+        return 9, struct.pack(">bi", tag, len(items)) + b"".join(bs for _, bs in items)
+    out = bytearray()
+    for name, item in value.items():
+        tag, bs = _nbt_payload(item)
+        name_bs = name.encode()
+        out += struct.pack(">bH", tag, len(name_bs)) + name_bs + bs
+    return 10, bytes(out) + b"\0"
+
+
+def _nbt_file(root: dict) -> bytes:
+    # gzipped, with an unnamed root compound, like level.dat and playerdata
+    _, payload = _nbt_payload(root)
+    return gzip.compress(b"\x0a\0\0" + payload)
+
+
+class WorldGenerator:
+    # Writes a synthetic save under `path` and changes it the way a running game
+    # would. Chunks are stitched from a pool of block-like segments plus some noise,
+    # so that they compress about as well as real chunk NBT does.
+    def __init__(self, path: str, *, seed: int = 0):
+        self.path = path
+        self._rng = random.Random(seed)
+        self._segments = [self._make_segment() for _ in range(256)]
+        self._players: list[str] = []
+        self._tick = 0
+
+    def _make_segment(self) -> bytes:
+        out = bytearray()
+        while len(out) < SEGMENT_SIZE:
+            out += bytes([self._rng.randrange(16)]) * self._rng.randint(1, 48)
+            out += self._rng.randbytes(self._rng.randint(0, 6))
+        return bytes(out[:SEGMENT_SIZE])
+
+    def _make_chunk(self, min_size: int, max_size: int) -> bytes:
+        size = int(
+            self._rng.triangular(
+                min_size, max_size, min_size + (max_size - min_size) / 4
+            )
+        )
+        segments = self._rng.choices(self._segments, k=max(size // SEGMENT_SIZE, 1))
+        raw = b"".join(segments) + self._rng.randbytes(size // 64)
+        return zlib.compress(raw)
+
+    def _write_file(self, rel: str, bs: bytes):
+        file_path = os.path.join(self.path, rel)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(bs)
+
+    def _region_coords(self, count: int) -> list[tuple[int, int]]:
+        # regions spread outwards from the spawn, with fewer of them far away
+        coords = [(0, 0)]
+        radius = 1
+        while len(coords) < count:
+            ring = [
+                (x, z)
+                for x in range(-radius, radius + 1)
+                for z in range(-radius, radius + 1)
+                if max(abs(x), abs(z)) == radius
+            ]
+            if radius > LOADED_RADIUS:
+                ring = self._rng.sample(ring, max(len(ring) // radius, 1))
+            coords.extend(ring)
+            radius += 1
+        return coords[:count]
+
+    def _write_region(
+        self, rel: str, distance: int, share: float, sizes: tuple[int, int]
+    ):
+        fill = (
+            1.0
+            if distance <= LOADED_RADIUS
+            else self._rng.uniform(0.05, 0.6) / distance
+        )
+        chunks = max(int(MCA_CHUNKS * fill * share), 1)
+        locations = bytearray(MCA_SECTOR)
+        timestamps = bytearray(MCA_SECTOR)
+        body = bytearray()
+        for idx in sorted(self._rng.sample(range(MCA_CHUNKS), chunks)):
+            data = self._make_chunk(*sizes)
+            payload = (len(data) + 1).to_bytes(4, "big") + b"\x02" + data
+            sectors = (len(payload) + MCA_SECTOR - 1) // MCA_SECTOR
+            offset = 2 + len(body) // MCA_SECTOR
+            body += payload.ljust(sectors * MCA_SECTOR, b"\0")
+            locations[idx * 4 : idx * 4 + 4] = offset.to_bytes(3, "big") + bytes(
+                [sectors]
+            )
+            timestamp = BASE_TIMESTAMP + self._rng.randrange(86400 * 30)
+            timestamps[idx * 4 : idx * 4 + 4] = timestamp.to_bytes(4, "big")
+        self._write_file(rel, bytes(locations + timestamps + body))
+
+    def _write_player(self, player: str):
+        inventory = [
+            {
+                "Slot": slot,
+                "id": f"minecraft:item_{self._rng.randrange(900)}",
+                "Count": 1,
+            }
+            for slot in range(self._rng.randint(5, 36))
+        ]
+        playerdata = {
+            "DataVersion": 3953,
+            "Pos": [self._rng.uniform(-5000, 5000) for _ in range(3)],
+            "Health": float(self._rng.randint(1, 20)),
+            "Inventory": inventory,
+            "EnderItems": inventory[: self._rng.randint(0, len(inventory))],
+            "recipeBook": {
+                "recipes": [
+                    f"minecraft:r{i}" for i in range(self._rng.randint(50, 700))
+                ]
+            },
+            "LastPlayed": BASE_TIMESTAMP + self._tick,
+        }
+        rel = f"world/playerdata/{player}.dat"
+        if os.path.exists(os.path.join(self.path, rel)):
+            os.replace(
+                os.path.join(self.path, rel), os.path.join(self.path, rel + "_old")
+            )
+        self._write_file(rel, _nbt_file(playerdata))
+        stats = {
+            "stats": {
+                kind: {
+                    f"minecraft:s{i}": self._rng.randrange(10**6)
+                    for i in range(self._rng.randint(20, 400))
+                }
+                for kind in (
+                    "minecraft:custom",
+                    "minecraft:mined",
+                    "minecraft:used",
+                    "minecraft:killed",
+                )
+            },
+            "DataVersion": 3953,
+        }
+        self._write_file(f"world/stats/{player}.json", json.dumps(stats).encode())
+        advancements = {
+            f"minecraft:story/a{i}": {
+                "criteria": {"c": "2024-01-01 00:00:00 +0000"},
+                "done": True,
+            }
+            for i in range(self._rng.randint(10, 120))
+        }
+        self._write_file(
+            f"world/advancements/{player}.json",
+            json.dumps(advancements, indent=2).encode(),
+        )
+
+    def _write_level(self, world: str):
+        level = {
+            "Data": {
+                "LevelName": world.split("/")[0],
+                "SpawnX": self._rng.randint(-256, 256),
+                "SpawnY": 64,
+                "SpawnZ": self._rng.randint(-256, 256),
+                "Time": self._tick,
+                "DataVersion": 3953,
+            }
+        }
+        self._write_file(f"{world}/level.dat", _nbt_file(level))
+
+    def generate(self, *, regions: int, players: int, maps: int = 20) -> int:
+        # the number of files written
+        for dimension, dimension_share in DIMENSIONS.items():
+            world = dimension.split("/")[0]
+            self._write_level(world)
+            self._write_file(
+                f"{world}/uid.dat", uuid.UUID(int=self._rng.getrandbits(128)).bytes
+            )
+            self._write_file(f"{world}/session.lock", "☃".encode())
+            coords = self._region_coords(max(int(regions * dimension_share), 1))
+            for kind, (share, min_size, max_size) in REGION_KINDS.items():
+                for x, z in coords:
+                    if (
+                        self._rng.random() < share
+                        or max(abs(x), abs(z)) <= LOADED_RADIUS
+                    ):
+                        self._write_region(
+                            f"{dimension}/{kind}/r.{x}.{z}.mca",
+                            max(abs(x), abs(z)),
+                            share,
+                            (min_size, max_size),
+                        )
+        self._players = [
+            str(uuid.UUID(int=self._rng.getrandbits(128))) for _ in range(players)
+        ]
+        for player in self._players:
+            self._write_player(player)
+        for name in DATA_FILES:
+            self._write_file(
+                f"world/data/{name}",
+                _nbt_file(
+                    {
+                        "data": {
+                            "entries": self._rng.randbytes(self._rng.randint(64, 4096))
+                        }
+                    }
+                ),
+            )
+        for n in range(maps):
+            self._write_file(
+                f"world/data/map_{n}.dat",
+                _nbt_file({"data": {"colors": self._rng.randbytes(16384)}}),
+            )
+        return sum(len(files) for _, _, files in os.walk(self.path))
+
+    def play(
+        self, *, regions: float = 0.1, chunks: float = 0.05, players: float = 0.3
+    ) -> int:
+        # Rewrites a share of the chunks of a share of the regions in place, the way
+        # the game does: new versions go to the end of the file and the header is
+        # updated, so most sectors stay as they were. The given share of players
+        # has their files saved again. Returns the number of files changed.
+        self._tick += 6000
+        changed = 0
+        region_files = sorted(
+            os.path.join(root, name)
+            for root, _, files in os.walk(self.path)
+            for name in files
+            if name.endswith(".mca")
+        )
+        for file_path in self._rng.sample(
+            region_files, int(len(region_files) * regions)
+        ):
+            self._rewrite_chunks(file_path, chunks)
+            changed += 1
+        for player in self._rng.sample(
+            self._players, int(len(self._players) * players)
+        ):
+            self._write_player(player)
+            changed += 3
+        for dimension in DIMENSIONS:
+            self._write_level(dimension.split("/")[0])
+            changed += 1
+        return changed
+
+    def _rewrite_chunks(self, file_path: str, share: float):
+        with open(file_path, "r+b") as f:
+            header_bs = bytearray(f.read(MCA_HEADER_SIZE))
+            header = MCAHeader(bytes(header_bs))
+            present = sorted(header.indices())
+            end = f.seek(0, os.SEEK_END)
+            _, min_size, max_size = REGION_KINDS[
+                os.path.basename(os.path.dirname(file_path))
+            ]
+            for idx in self._rng.sample(present, max(int(len(present) * share), 1)):
+                data = self._make_chunk(min_size, max_size)
+                payload = (len(data) + 1).to_bytes(4, "big") + b"\x02" + data
+                sectors = (len(payload) + MCA_SECTOR - 1) // MCA_SECTOR
+                f.write(payload.ljust(sectors * MCA_SECTOR, b"\0"))
+                offset = end // MCA_SECTOR
+                end += sectors * MCA_SECTOR
+                header_bs[idx * 4 : idx * 4 + 4] = offset.to_bytes(3, "big") + bytes(
+                    [sectors]
+                )
+                timestamp = BASE_TIMESTAMP + 86400 * 30 + self._tick
+                header_bs[MCA_SECTOR + idx * 4 : MCA_SECTOR + idx * 4 + 4] = (
+                    timestamp.to_bytes(4, "big")
+                )
+            f.seek(0)
+            f.write(header_bs)
@@ -0,0 +1,77 @@
+import asyncio
+from collections import OrderedDict
+from time import time
+from typing import Any, Awaitable, Callable
+from uuid import uuid4
+
+from loguru import logger
+
+
+class SaveJob:
+    def __init__(self):
+        self.id = uuid4().hex
+        self.state = "pending"
+        # number of /saving requests merged into this job
+        self.requests = 1
+        self.created_at = time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.error: str | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "requests": self.requests,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class SaveQueue:
+    # Saves run one at a time on a background task. At most one save waits behind the
+    # running one, and every request arriving meanwhile is merged into it. A running
+    # save is never joined, as it may have flushed the world before the request came.
+    def __init__(self, run: Callable[[], Awaitable[None]], *, history: int = 100):
+        self._run = run
+        self._history = history
+        self._jobs: OrderedDict[str, SaveJob] = OrderedDict()
+        self._pending: SaveJob | None = None
+        self._worker: asyncio.Task | None = None
+
+    def submit(self) -> SaveJob:
+        if self._pending is not None:
+            self._pending.requests += 1
+            logger.info(f"Save request merged into pending save job '{self._pending.id}'")
+            return self._pending
+        job = SaveJob()
+        self._pending = job
+        self._jobs[job.id] = job
+        while len(self._jobs) > self._history:
+            self._jobs.popitem(last=False)
+        logger.info(f"Save job '{job.id}' queued")
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._work())
+        return job
+
+    def get(self, job_id: str) -> SaveJob | None:
+        return self._jobs.get(job_id)
+
+    async def _work(self):
+        while self._pending is not None:
+            job, self._pending = self._pending, None
+            job.state = "running"
+            job.started_at = time()
+            logger.info(f"Save job '{job.id}' started")
+            try:
+                await self._run()
+                job.state = "succeeded"
+                logger.info(f"Save job '{job.id}' succeeded")
+            except Exception as e:
+                job.state = "failed"
+                job.error = str(e)
+                logger.error(f"Save job '{job.id}' failed with error: {e}")
+            finally:
+                job.finished_at = time()
@@ -1,104 +1,280 @@
 import argparse
+import asyncio
 from os import getenv
+import threading
 from time import time
 
 import uvicorn
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from loguru import logger
-from mcrcon import MCRcon
 
-from migrater.seaweedfs import TrivialMigrater
+from migrater.seaweedfs import SnapshotMigrater, TrivialMigrater
+from migrater.codecs import codec_names, get_codec_by_name, get_fastest_codec
+from migrater import metrics
+from migrater.freeze import build_frozen_path, freeze
+from migrater.watch import ChangeTracker
+from jobs import SaveQueue
+from rcon import RconClient
+from replicator import Replicator
 
 app = FastAPI()
 
 migrater_instance = None
+rcon: RconClient | None = None
+# local save path and the path it is frozen into before each push, see `--freeze`
+local_path = None
+freeze_path = None
+# set once the game can be started on the local save, see `--lazy-pull`
+ready = threading.Event()
+pull_thread: threading.Thread | None = None
+# a pull failing after the game started leaves regions missing from the local save
+pull_error: Exception | None = None
+# paths changed since the last push, see `--watch`
+tracker: ChangeTracker | None = None
+# pushes changes as they happen, see `--replicate`
+replicator: Replicator | None = None
 
 
-@app.post("/saving")
-async def saving():
+def pull(lazy: bool):
+    global pull_error
+    try:
+        logger.info("Pulling...")
+        migrater_instance.pull(on_ready=ready.set if lazy else None)
+        logger.info("Pulling...done")
+    except Exception as e:
+        if ready.is_set():
+            pull_error = e
+            logger.error(f"Pulling...failed after the game started with error: {e}")
+        else:
+            logger.warning(f"Pulling...failed with error: {e}")
+    finally:
+        ready.set()
+        # the pull replaced the watched directories, so watching only starts now
+        start_watching()
+
+
+def start_watching():
+    if tracker is not None:
+        tracker.start()
+    if replicator is not None:
+        replicator.start()
+
+
+async def save():
+    if pull_thread is not None and pull_thread.is_alive():
+        logger.info("Saving: waiting for the pull to complete")
+        await asyncio.to_thread(pull_thread.join)
+    if pull_error is not None:
+        # pushing would delete the regions that were never pulled from the remote
+        raise Exception(f"Not pushing an incompletely pulled save: {pull_error}")
     time0 = time()
     logger.info("Saving: save-all from game")
-    with MCRcon(host="mc-server", port=25575, password="rcon123") as client:
-        try:
-            client.command("say Saving the game...")
-            response = client.command("save-all flush")
+    rcon.broadcast("Saving the game...")
+    changes = None
+    try:
+        if freeze_path:
+            # the game only stops writing for as long as the local copy takes, the push
+            # then runs from the copy with saving turned back on
+            await rcon.acommand("save-off")
+            try:
+                with metrics.RCON_FLUSH_SECONDS.time():
+                    response = await rcon.acommand("save-all flush")
+                logger.debug(f"RCON response: {response}")
+                changes = tracker.take() if tracker else None
+                await asyncio.to_thread(freeze, local_path, freeze_path, changes)
+            finally:
+                await rcon.acommand("save-on")
+        else:
+            with metrics.RCON_FLUSH_SECONDS.time():
+                response = await rcon.acommand("save-all flush")
             logger.debug(f"RCON response: {response}")
-            time1 = time()
-            client.command(f"say Saving the game...flushed in {time1 - time0:.3f}s")
-            logger.info("Saving: push to the remote")
-            if migrater_instance:
-                migrater_instance.push()
-                time2 = time()
-                client.command(f"say Saving the game...pushed in {time2 - time1:.3f}s")
-                client.command("say Saving the game...done")
-                return
-            else:
-                raise HTTPException(status_code=500, detail="Migrater not initialized")
-        except Exception:
-            client.command("say Saving the game...failed")
+            if tracker is not None and replicator is None:
+                changes = tracker.take()
+        time1 = time()
+        rcon.broadcast(f"Saving the game...flushed in {time1 - time0:.3f}s")
+        logger.info("Saving: push to the remote")
+        # the push blocks for as long as the upload takes, keep it off the event loop
+        if replicator is not None:
+            # most changes are replicated already, the checkpoint pushes the rest
+            await asyncio.to_thread(replicator.checkpoint)
+        else:
+            await asyncio.to_thread(migrater_instance.push, freeze_path, changes)
+        time2 = time()
+        metrics.SAVE_SECONDS.observe(time2 - time0)
+        metrics.LAST_SUCCESS.set_to_current_time(operation="save")
+        rcon.broadcast(f"Saving the game...pushed in {time2 - time1:.3f}s")
+        rcon.broadcast("Saving the game...done")
+    except Exception:
+        # the changes taken may not have been pushed, the next save checks everything
+        if tracker is not None:
+            tracker.invalidate()
+        rcon.broadcast("Saving the game...failed")
+        raise
+
+
+save_queue = SaveQueue(save)
+
+
+@app.post("/saving", status_code=202)
+async def saving():
+    if not migrater_instance:
+        raise HTTPException(status_code=500, detail="Migrater not initialized")
+    return save_queue.submit().to_dict()
+
+
+@app.get("/ready")
+async def readiness():
+    if not ready.is_set():
+        raise HTTPException(status_code=503, detail="Pulling the save")
+    return {"pulling": pull_thread is not None and pull_thread.is_alive()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/saving/{job_id}")
+async def saving_status(job_id: str):
+    job = save_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Save job not found")
+    return job.to_dict()
 
 
 def start_server(host: str, port: int):
     uvicorn.run(app, host=host, port=port)
 
 
+def get_region_codec(name: str | None) -> int | None:
+    if name is None:
+        return None
+    if name == "fastest":
+        return get_fastest_codec().compression_type
+    return get_codec_by_name(name).compression_type
+
+
 def main():
     parser = argparse.ArgumentParser(description="Saving Agent")
 
-    subparsers = parser.add_subparsers(dest="operation", required=True)
-
-    # push
-    push_parser = subparsers.add_parser("push", help="Push data to SeaweedFS")
-    push_parser.add_argument(
+    # arguments shared by all operations
+    migrater_parser = argparse.ArgumentParser(add_help=False)
+    migrater_parser.add_argument(
         "--local-path",
         default=getenv("MIGRATER_LOCAL_PATH"),
         help="Local path for migration (default: value from MIGRATER_LOCAL_PATH)",
     )
-    push_parser.add_argument(
+    migrater_parser.add_argument(
         "--remote-path",
         default=getenv("MIGRATER_REMOTE_PATH"),
         help="Remote path for migration (default: value from MIGRATER_REMOTE_PATH)",
     )
-    push_parser.add_argument(
+    migrater_parser.add_argument(
         "--filer-url",
         default=getenv("SEAWEEDFS_FILER_URL"),
         help="SeaweedFS Filer URL (default: value from SEAWEEDFS_FILER_URL)",
     )
-
-    # pull
-    pull_parser = subparsers.add_parser("pull", help="Pull data from SeaweedFS")
-    pull_parser.add_argument(
-        "--local-path",
-        default=getenv("MIGRATER_LOCAL_PATH"),
-        help="Local path for migration (default: value from MIGRATER_LOCAL_PATH)",
+    migrater_parser.add_argument(
+        "--mode",
+        choices=["trivial", "snapshot", "dedup"],
+        default="trivial",
+        help="Remote layout: a mirror of the save, content-addressed snapshots, or snapshots of deduplicated content-defined chunks (default: trivial)",
     )
-    pull_parser.add_argument(
-        "--remote-path",
-        default=getenv("MIGRATER_REMOTE_PATH"),
-        help="Remote path for migration (default: value from MIGRATER_REMOTE_PATH)",
+    migrater_parser.add_argument(
+        "--keep-snapshots",
+        type=int,
+        default=5,
+        help="In snapshot and dedup modes, number of snapshots kept before garbage collection (default: 5)",
     )
-    pull_parser.add_argument(
-        "--filer-url",
-        default=getenv("SEAWEEDFS_FILER_URL"),
-        help="SeaweedFS Filer URL (default: value from SEAWEEDFS_FILER_URL)",
+    migrater_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Push only files changed since the last push, tracked by a sync manifest (default: false)",
+    )
+    migrater_parser.add_argument(
+        "--region-delta",
+        action="store_true",
+        help="With --incremental, push changed .mca region files as chunk-level deltas (default: false)",
+    )
+    migrater_parser.add_argument(
+        "--region-lzma",
+        action="store_true",
+        help="With --region-delta, store region keyframes and deltas as LZMA-compressed decompressed regions; each keyframe and delta is compressed on its own with a 1 MiB dictionary, not across versions (default: false)",
+    )
+    migrater_parser.add_argument(
+        "--keyframe-interval",
+        type=int,
+        default=17,
+        help="With --region-delta, upload a region in full every this many pushes of it, and deltas in between (default: 17)",
+    )
+    migrater_parser.add_argument(
+        "--region-codec",
+        choices=codec_names(),
+        help="In trivial mode, store region files transcoded to this chunk compression, converting them back to zlib on pull unless --pull-codec is given (default: as written by the game)",
+    )
+    migrater_parser.add_argument(
+        "--pull-codec",
+        choices=codec_names() + ["fastest"],
+        help="In trivial mode, re-encode pulled region files with this chunk compression; 'fastest' picks the quickest to decode available (default: zlib when stored transcoded, else as stored)",
+    )
+    migrater_parser.add_argument(
+        "--pack-small-files",
+        action="store_true",
+        help="In trivial mode, push the small files of playerdata, stats, advancements and data directories bundled into a few compressed packs per directory, which pulls unpack (default: false)",
+    )
+    migrater_parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of uploads/downloads kept in flight (default: 4)",
+    )
+    migrater_parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=16,
+        help="Maximum number of keep-alive connections to the filer (default: 16)",
+    )
+    migrater_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60,
+        help="Read timeout in seconds for filer requests (default: 60)",
+    )
+    migrater_parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="Retries with backoff on connection errors and 5xx responses (default: 3)",
+    )
+    migrater_parser.add_argument(
+        "--rate-limit",
+        type=float,
+        help="Limit on the MiB/s moved to and from the filer by all transfers together (default: no limit)",
+    )
+    migrater_parser.add_argument(
+        "--adaptive-rate",
+        action="store_true",
+        help="With --rate-limit, lower the rate while the RTT to the filer shows transfers queueing on the link, and raise it back up to the limit after (default: false)",
     )
 
-    # server
-    server_parser = subparsers.add_parser("server", help="Start migration server")
-    server_parser.add_argument(
-        "--local-path",
-        default=getenv("MIGRATER_LOCAL_PATH"),
-        help="Local path for migration (default: value from MIGRATER_LOCAL_PATH)",
+    subparsers = parser.add_subparsers(dest="operation", required=True)
+
+    # push
+    subparsers.add_parser(
+        "push", parents=[migrater_parser], help="Push data to SeaweedFS"
     )
-    server_parser.add_argument(
-        "--remote-path",
-        default=getenv("MIGRATER_REMOTE_PATH"),
-        help="Remote path for migration (default: value from MIGRATER_REMOTE_PATH)",
+
+    # pull
+    subparsers.add_parser(
+        "pull", parents=[migrater_parser], help="Pull data from SeaweedFS"
     )
-    server_parser.add_argument(
-        "--filer-url",
-        default=getenv("SEAWEEDFS_FILER_URL"),
-        help="SeaweedFS Filer URL (default: value from SEAWEEDFS_FILER_URL)",
+
+    # server
+    server_parser = subparsers.add_parser(
+        "server", parents=[migrater_parser], help="Start migration server"
     )
     server_parser.add_argument(
         "--host",
@@ -116,25 +292,168 @@ def main():
         action="store_true",
         help="Try to pull before serving (default: true)",
     )
+    server_parser.add_argument(
+        "--lazy-pull",
+        action="store_true",
+        help="With --pull-first, report ready on /ready once all but the region files away from the spawn are pulled, and pull those in the background (default: false)",
+    )
+    server_parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Track changed files with inotify, so that incremental and snapshot pushes only look at those instead of the whole save (default: false)",
+    )
+    server_parser.add_argument(
+        "--replicate",
+        action="store_true",
+        help="With --incremental in trivial mode, keep pushing changed files shortly after the game writes them, which turns /saving into a flush and a checkpoint of what is left; implies --watch (default: false)",
+    )
+    server_parser.add_argument(
+        "--replicate-interval",
+        type=float,
+        default=5,
+        help="With --replicate, seconds between two replication pushes (default: 5)",
+    )
+    server_parser.add_argument(
+        "--replicate-debounce",
+        type=float,
+        default=2,
+        help="With --replicate, seconds a file has to stay unwritten before it is replicated (default: 2)",
+    )
+    server_parser.add_argument(
+        "--replicate-batch",
+        type=int,
+        default=256,
+        help="With --replicate, maximum number of changed paths per replication push (default: 256)",
+    )
+    server_parser.add_argument(
+        "--rcon-host",
+        default=getenv("RCON_HOST", "mc-server"),
+        help="RCON host of the game server (default: value from RCON_HOST or mc-server)",
+    )
+    server_parser.add_argument(
+        "--rcon-port",
+        type=int,
+        default=int(getenv("RCON_PORT", "25575")),
+        help="RCON port of the game server (default: value from RCON_PORT or 25575)",
+    )
+    server_parser.add_argument(
+        "--rcon-password",
+        default=getenv("RCON_PASSWORD", "rcon123"),
+        help="RCON password of the game server (default: value from RCON_PASSWORD or rcon123)",
+    )
+    server_parser.add_argument(
+        "--rcon-timeout",
+        type=float,
+        default=30,
+        help="Seconds to wait for an RCON response, including 'save-all flush' (default: 30)",
+    )
+    server_parser.add_argument(
+        "--freeze",
+        action="store_true",
+        help="Turn autosave off while the save is copied to '<local path>.frozen', or '<local path>/.frozen/save' when it is a mount point, and push from that copy (default: false)",
+    )
 
     args = parser.parse_args()
+    if args.region_delta and not args.incremental:
+        parser.error("--region-delta requires --incremental")
+    if args.region_lzma and not args.region_delta:
+        parser.error("--region-lzma requires --region-delta")
+    if args.keyframe_interval < 1:
+        parser.error("--keyframe-interval must be at least 1")
+    if args.region_codec and args.region_delta:
+        parser.error("--region-codec cannot be combined with --region-delta")
+    if args.operation == "server" and args.lazy_pull and not args.pull_first:
+        parser.error("--lazy-pull requires --pull-first")
+    if args.operation == "server" and args.replicate:
+        if args.mode != "trivial" or not args.incremental:
+            parser.error("--replicate requires --incremental in trivial mode")
+        if args.freeze:
+            parser.error("--replicate cannot be combined with --freeze")
+        if args.replicate_batch < 1:
+            parser.error("--replicate-batch must be at least 1")
+    if args.rate_limit is not None and args.rate_limit <= 0:
+        parser.error("--rate-limit must be positive")
+    if args.adaptive_rate and args.rate_limit is None:
+        parser.error("--adaptive-rate requires --rate-limit")
+    if (args.region_codec or args.pull_codec) and args.mode != "trivial":
+        parser.error("--region-codec and --pull-codec are only supported in trivial mode")
+    if args.pack_small_files and args.mode != "trivial":
+        parser.error("--pack-small-files is only supported in trivial mode")
+    try:
+        region_codec = get_region_codec(args.region_codec)
+        pull_codec = get_region_codec(args.pull_codec)
+    except Exception as e:
+        parser.error(str(e))
 
-    migrater = TrivialMigrater(
-        local_path=args.local_path,
-        remote_path=args.remote_path,
-        filer_url=args.filer_url,
-    )
+    rate_limit = args.rate_limit * 1024 * 1024 if args.rate_limit else None
+    if args.mode in ("snapshot", "dedup"):
+        migrater = SnapshotMigrater(
+            local_path=args.local_path,
+            remote_path=args.remote_path,
+            filer_url=args.filer_url,
+            keep=args.keep_snapshots,
+            chunking=args.mode == "dedup",
+            workers=args.workers,
+            pool_size=args.pool_size,
+            read_timeout=args.timeout,
+            retries=args.retries,
+            rate_limit=rate_limit,
+            adaptive_rate=args.adaptive_rate,
+        )
+    else:
+        migrater = TrivialMigrater(
+            local_path=args.local_path,
+            remote_path=args.remote_path,
+            filer_url=args.filer_url,
+            incremental=args.incremental,
+            region_delta=args.region_delta,
+            keyframe_interval=args.keyframe_interval,
+            region_lzma=args.region_lzma,
+            region_codec=region_codec,
+            pull_codec=pull_codec,
+            pack_small_files=args.pack_small_files,
+            workers=args.workers,
+            pool_size=args.pool_size,
+            read_timeout=args.timeout,
+            retries=args.retries,
+            rate_limit=rate_limit,
+            adaptive_rate=args.adaptive_rate,
+        )
 
-    global migrater_instance
+    global migrater_instance, rcon, local_path, freeze_path, pull_thread, tracker
+    global replicator
 
     if args.operation == "server":
-        if args.pull_first:
-            try:
-                logger.info("Pulling...")
-                migrater.pull()
-            except Exception as e:
-                logger.warning(f"Pulling...failed with error: {e}")
         migrater_instance = migrater
+        if args.watch or args.replicate:
+            tracker = ChangeTracker(args.local_path)
+        if args.replicate:
+            replicator = Replicator(
+                migrater,
+                tracker,
+                args.local_path,
+                interval=args.replicate_interval,
+                debounce=args.replicate_debounce,
+                batch=args.replicate_batch,
+            )
+        if args.pull_first:
+            # pulled while serving, the game container waits for /ready
+            pull_thread = threading.Thread(
+                target=pull, args=(args.lazy_pull,), name="pull", daemon=True
+            )
+            pull_thread.start()
+        else:
+            ready.set()
+            start_watching()
+        rcon = RconClient(
+            args.rcon_host,
+            args.rcon_port,
+            args.rcon_password,
+            timeout=args.rcon_timeout,
+        )
+        local_path = args.local_path
+        if args.freeze:
+            freeze_path = build_frozen_path(args.local_path)
         logger.info("Starting server...")
         start_server(args.host, args.port)
     elif args.operation == "push":
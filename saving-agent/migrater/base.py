@@ -1,11 +1,18 @@
 from abc import ABC, abstractmethod
+from typing import Callable
 
 class Migrater(ABC):
 
+    # `local_path` pushes another copy of the local save, such as a frozen one, and
+    # `changes` are the paths changed since the last push, None when unknown
     @abstractmethod
-    def push(self):
+    def push(
+        self, local_path: str | None = None, changes: set[str] | None = None
+    ):
         raise NotImplementedError()
     
+    # `on_ready` is called once the game can be started on the local save, which may
+    # be before the pull has completed
     @abstractmethod
-    def pull(self):
+    def pull(self, on_ready: Callable[[], None] | None = None):
         raise NotImplementedError()
\ No newline at end of file
@@ -0,0 +1,90 @@
+import hashlib
+import zlib
+
+from migrater.mca import MCA_HEADER_SIZE, MCA_SECTOR, MCAHeader
+
+type Piece = tuple[str, int]
+
+# Gear-hash content-defined chunking for arbitrary files. A boundary is cut once the
+# top bits of the rolling hash are all zero, which only depends on the last 64 bytes,
+# so an insertion only moves the boundaries next to it.
+GEAR = [
+    int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256)
+]
+GEAR_MASK = 0xFFFF << 48  # ~64 KiB average piece
+MIN_PIECE_SIZE = 16 * 1024
+MAX_PIECE_SIZE = 256 * 1024
+
+# Region files are cut between chunk payloads instead: a boundary follows every chunk
+# whose payload checksum has its low bits zero, so a rewritten chunk only changes the
+# piece holding it, no matter where the game relocated it in the file.
+MCA_PIECE_MASK = 0xF  # ~16 chunks per piece
+MCA_MAX_PIECE_CHUNKS = 64
+
+
+def _gear_boundaries(view: memoryview) -> list[int]:
+    size = len(view)
+    cuts = []
+    start = 0
+    while size - start > MAX_PIECE_SIZE:
+        h = 0
+        end = min(start + MAX_PIECE_SIZE, size)
+        i = start + MIN_PIECE_SIZE
+        while i < end:
+            h = ((h << 1) + GEAR[view[i]]) & 0xFFFFFFFFFFFFFFFF
+            i += 1
+            if not h & GEAR_MASK:
+                break
+        cuts.append(i)
+        start = i
+    cuts.append(size)
+    return cuts
+
+
+def _mca_boundaries(view: memoryview) -> list[int]:
+    size = len(view)
+    if size < MCA_HEADER_SIZE:
+        return _gear_boundaries(view)
+    header = MCAHeader(view[:MCA_HEADER_SIZE])
+    spans = sorted(
+        (
+            header.offset(idx) * MCA_SECTOR,
+            min((header.offset(idx) + header.sectors(idx)) * MCA_SECTOR, size),
+        )
+        for idx in header.indices()
+    )
+    cuts = [MCA_HEADER_SIZE]
+    pos = MCA_HEADER_SIZE
+    chunks = 0
+    for start, end in spans:
+        if start < pos or end <= start:
+            # overlapping or out of file, leave it to the surrounding piece
+            continue
+        chunks += 1
+        if (
+            not zlib.crc32(view[start:end]) & MCA_PIECE_MASK
+            or chunks >= MCA_MAX_PIECE_CHUNKS
+        ):
+            cuts.append(end)
+            chunks = 0
+        pos = end
+    if cuts[-1] != size:
+        cuts.append(size)
+    return cuts
+
+
+def split_file(path: str) -> list[Piece]:
+    # read rather than mmap: the world may be written to while it is being pushed, and
+    # a file shrinking under a mapping would fault the process
+    with open(path, "rb") as f:
+        view = memoryview(f.read())
+    if path.endswith(".mca"):
+        cuts = _mca_boundaries(view)
+    else:
+        cuts = _gear_boundaries(view)
+    pieces = []
+    start = 0
+    for end in cuts:
+        pieces.append((hashlib.sha256(view[start:end]).hexdigest(), end - start))
+        start = end
+    return pieces
@@ -0,0 +1,210 @@
+from functools import partial
+from typing import Callable, NamedTuple
+import gzip
+import struct
+import zlib
+
+from loguru import logger
+
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+type ChunkCompressionType = int
+
+
+# Chunk compression schemes of the region format, by the compression type byte that
+# precedes every chunk payload. Payloads may be any bytes-like object.
+class ChunkCodec(NamedTuple):
+    compression_type: ChunkCompressionType
+    name: str
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+MCA_CODECS: dict[ChunkCompressionType, ChunkCodec] = {}
+# codecs whose package is not installed, as (name, package) by compression type
+UNAVAILABLE_CODECS: dict[ChunkCompressionType, tuple[str, str]] = {}
+
+
+def register_codec(codec: ChunkCodec):
+    MCA_CODECS[codec.compression_type] = codec
+
+
+def codec_names() -> list[str]:
+    names = [codec.name for codec in MCA_CODECS.values()]
+    return names + [name for name, _ in UNAVAILABLE_CODECS.values()]
+
+
+def _unavailable(compression_type: ChunkCompressionType) -> Exception:
+    name, package = UNAVAILABLE_CODECS[compression_type]
+    return Exception(
+        f"chunk codec '{name}' needs the {package} package, which is not installed"
+    )
+
+
+def get_codec(compression_type: ChunkCompressionType) -> ChunkCodec:
+    codec = MCA_CODECS.get(compression_type)
+    if codec is None:
+        if compression_type in UNAVAILABLE_CODECS:
+            raise _unavailable(compression_type)
+        raise Exception(f"unsupported chunk compression type: {compression_type}")
+    return codec
+
+
+def get_codec_by_name(name: str) -> ChunkCodec:
+    for codec in MCA_CODECS.values():
+        if codec.name == name:
+            return codec
+    for compression_type, (unavailable_name, _) in UNAVAILABLE_CODECS.items():
+        if unavailable_name == name:
+            raise _unavailable(compression_type)
+    raise Exception(f"unsupported chunk codec: {name}")
+
+
+def get_fastest_codec() -> ChunkCodec:
+    # the cheapest to decode of the compressing codecs; uncompressed chunks decode
+    # faster still but multiply the size of the world on disk
+    if 4 in MCA_CODECS:
+        return MCA_CODECS[4]
+    logger.warning("The lz4 package is not installed, falling back to zlib as the fastest codec")
+    return MCA_CODECS[2]
+
+
+# The game writes LZ4 chunks with lz4-java's LZ4BlockOutputStream: blocks of at most
+# 64 KiB, each behind a header of the magic, a token holding the method and the block
+# size, the compressed and original lengths and a masked xxHash32 of the block, and a
+# final empty block. The checksum is verified by the game on read.
+LZ4_BLOCK_MAGIC = b"LZ4Block"
+LZ4_BLOCK_HEADER = struct.Struct("<8sBiii")
+LZ4_BLOCK_SIZE = 1 << 16
+LZ4_BLOCK_LEVEL = 6  # log2(LZ4_BLOCK_SIZE) - 10
+LZ4_METHOD_RAW = 0x10
+LZ4_METHOD_LZ4 = 0x20
+LZ4_CHECKSUM_SEED = 0x9747B28C
+
+_XXH_PRIME1 = 2654435761
+_XXH_PRIME2 = 2246822519
+_XXH_PRIME3 = 3266489917
+_XXH_PRIME4 = 668265263
+_XXH_PRIME5 = 374761393
+_U32_MASK = 0xFFFFFFFF
+
+
+def _rotl32(x: int, r: int) -> int:
+    return ((x << r) | (x >> (32 - r))) & _U32_MASK
+
+
+def _xxh32(data: bytes, seed: int) -> int:
+    # reference xxHash32, only used when the xxhash package is not installed
+    data = bytes(data)
+    length = len(data)
+    pos = 0
+    if length >= 16:
+        v1 = (seed + _XXH_PRIME1 + _XXH_PRIME2) & _U32_MASK
+        v2 = (seed + _XXH_PRIME2) & _U32_MASK
+        v3 = seed
+        v4 = (seed - _XXH_PRIME1) & _U32_MASK
+        stripes = length // 16 * 16
+        for l1, l2, l3, l4 in struct.iter_unpack("<4I", data[:stripes]):
+            v1 = _rotl32((v1 + l1 * _XXH_PRIME2) & _U32_MASK, 13) * _XXH_PRIME1 & _U32_MASK
+            v2 = _rotl32((v2 + l2 * _XXH_PRIME2) & _U32_MASK, 13) * _XXH_PRIME1 & _U32_MASK
+            v3 = _rotl32((v3 + l3 * _XXH_PRIME2) & _U32_MASK, 13) * _XXH_PRIME1 & _U32_MASK
+            v4 = _rotl32((v4 + l4 * _XXH_PRIME2) & _U32_MASK, 13) * _XXH_PRIME1 & _U32_MASK
+        h = (_rotl32(v1, 1) + _rotl32(v2, 7) + _rotl32(v3, 12) + _rotl32(v4, 18)) & _U32_MASK
+        pos = stripes
+    else:
+        h = (seed + _XXH_PRIME5) & _U32_MASK
+    h = (h + length) & _U32_MASK
+    while pos + 4 <= length:
+        (word,) = struct.unpack_from("<I", data, pos)
+        h = _rotl32((h + word * _XXH_PRIME3) & _U32_MASK, 17) * _XXH_PRIME4 & _U32_MASK
+        pos += 4
+    while pos < length:
+        h = _rotl32((h + data[pos] * _XXH_PRIME5) & _U32_MASK, 11) * _XXH_PRIME1 & _U32_MASK
+        pos += 1
+    h ^= h >> 15
+    h = h * _XXH_PRIME2 & _U32_MASK
+    h ^= h >> 13
+    h = h * _XXH_PRIME3 & _U32_MASK
+    h ^= h >> 16
+    return h
+
+
+def _lz4_block_checksum(data: bytes) -> int:
+    if xxhash is not None:
+        h = xxhash.xxh32_intdigest(data, seed=LZ4_CHECKSUM_SEED)
+    else:
+        h = _xxh32(data, LZ4_CHECKSUM_SEED)
+    return h & 0x0FFFFFFF
+
+
+def _lz4_compress(data: bytes) -> bytes:
+    view = memoryview(data)
+    out = bytearray()
+    for start in range(0, len(view), LZ4_BLOCK_SIZE):
+        block = view[start : start + LZ4_BLOCK_SIZE]
+        compressed = lz4_block.compress(block, store_size=False)
+        if len(compressed) >= len(block):
+            method, compressed = LZ4_METHOD_RAW, block
+        else:
+            method = LZ4_METHOD_LZ4
+        out.extend(
+            LZ4_BLOCK_HEADER.pack(
+                LZ4_BLOCK_MAGIC,
+                method | LZ4_BLOCK_LEVEL,
+                len(compressed),
+                len(block),
+                _lz4_block_checksum(block),
+            )
+        )
+        out.extend(compressed)
+    out.extend(
+        LZ4_BLOCK_HEADER.pack(LZ4_BLOCK_MAGIC, LZ4_METHOD_RAW | LZ4_BLOCK_LEVEL, 0, 0, 0)
+    )
+    return bytes(out)
+
+
+def _lz4_decompress(data: bytes) -> bytes:
+    view = memoryview(data)
+    out = bytearray()
+    pos = 0
+    while pos < len(view):
+        magic, token, compressed_length, original_length, _ = LZ4_BLOCK_HEADER.unpack_from(
+            view, pos
+        )
+        if magic != LZ4_BLOCK_MAGIC:
+            raise Exception("corrupted LZ4 chunk")
+        pos += LZ4_BLOCK_HEADER.size
+        if original_length == 0:
+            break
+        block = view[pos : pos + compressed_length]
+        pos += compressed_length
+        if token & 0xF0 == LZ4_METHOD_RAW:
+            out.extend(block)
+        else:
+            out.extend(lz4_block.decompress(block, uncompressed_size=original_length))
+    return bytes(out)
+
+
+def _identity(data: bytes) -> bytes:
+    return data
+
+
+# the game compresses with the default deflate level; gzip gets a fixed mtime so that
+# equal chunks always encode to equal bytes
+register_codec(
+    ChunkCodec(1, "gzip", partial(gzip.compress, compresslevel=6, mtime=0), gzip.decompress)
+)
+register_codec(ChunkCodec(2, "zlib", zlib.compress, zlib.decompress))
+register_codec(ChunkCodec(3, "none", _identity, _identity))
+if lz4_block is not None:
+    register_codec(ChunkCodec(4, "lz4", _lz4_compress, _lz4_decompress))
+else:
+    UNAVAILABLE_CODECS[4] = ("lz4", "lz4")
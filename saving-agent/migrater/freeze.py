@@ -0,0 +1,163 @@
+import errno
+import os
+import shutil
+
+from loguru import logger
+
+from migrater.workdirs import build_work_path, prune_work_dirs
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl of Linux filesystems with copy-on-write extents (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# The game replaces these files through a temporary file and a rename, so the copy can
+# share their inode: the next save swaps in a new file instead of writing into ours.
+# Everything else, region files and data/*.dat included, is written in place and is
+# always copied.
+HARDLINK_NAMES = ("level.dat",)
+HARDLINK_DIRS = ("playerdata",)
+
+
+def build_frozen_path(local_path: str) -> str:
+    # The copy has to be on the filesystem of the save for files to be linked or
+    # reflinked into it. Pushes keep their manifest and caches next to the path they
+    # push, so when the save is a mount point and holds the copy itself, the copy is
+    # one level down in its work directory, which then holds those files as well.
+    work_path = build_work_path(local_path, "frozen")
+    if os.path.ismount(local_path):
+        return os.path.join(work_path, "save")
+    return work_path
+
+
+def clone_file(src: str, dst: str):
+    # reflink where the filesystem supports it, a plain copy otherwise
+    with open(src, "rb") as src_f, open(dst, "wb") as dst_f:
+        cloned = False
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+                cloned = True
+            except OSError as e:
+                if e.errno not in (
+                    errno.EOPNOTSUPP,
+                    errno.ENOTTY,
+                    errno.EXDEV,
+                    errno.EINVAL,
+                    errno.ENOSYS,
+                ):
+                    raise
+        if not cloned:
+            shutil.copyfileobj(src_f, dst_f, 1024 * 1024)
+    shutil.copystat(src, dst)
+
+
+def _is_replaced_file(path: str) -> bool:
+    name = os.path.basename(path)
+    if name in HARDLINK_NAMES:
+        return True
+    return name.endswith(".dat") and os.path.basename(os.path.dirname(path)) in HARDLINK_DIRS
+
+
+def _try_link(src: str, dst: str) -> bool:
+    try:
+        os.link(src, dst)
+        return True
+    except OSError as e:
+        # across filesystems, or on one without hardlinks
+        logger.debug(f"Cannot hardlink '{src}', copying it instead: {e}")
+        return False
+
+
+def _is_unchanged(src_st: os.stat_result, dst: str) -> bool:
+    try:
+        dst_st = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    return (src_st.st_size, src_st.st_mtime_ns) == (dst_st.st_size, dst_st.st_mtime_ns)
+
+
+def _freeze_file(src: str, dst: str, counts: dict[str, int]):
+    try:
+        st = os.stat(src)
+    except FileNotFoundError:
+        return
+    if _is_unchanged(st, dst):
+        return
+    tmp = f"{dst}.freezing"
+    if _is_replaced_file(src) and _try_link(src, tmp):
+        counts["linked"] += 1
+    else:
+        clone_file(src, tmp)
+        counts["copied"] += 1
+    os.replace(tmp, dst)
+
+
+def _remove(path: str, counts: dict[str, int]):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+    else:
+        return
+    counts["removed"] += 1
+
+
+def _freeze_tree(local_path: str, frozen_path: str, counts: dict[str, int]):
+    seen = set()
+    for root, dirs, names in os.walk(local_path):
+        prune_work_dirs(root, local_path, dirs)
+        rel_root = os.path.relpath(root, local_path)
+        frozen_root = os.path.normpath(os.path.join(frozen_path, rel_root))
+        if os.path.lexists(frozen_root) and not os.path.isdir(frozen_root):
+            os.remove(frozen_root)
+        os.makedirs(frozen_root, exist_ok=True)
+        seen.add(os.path.normpath(rel_root))
+        for name in names:
+            seen.add(os.path.normpath(os.path.join(rel_root, name)))
+            dst = os.path.join(frozen_root, name)
+            if os.path.isdir(dst) and not os.path.islink(dst):
+                shutil.rmtree(dst)
+            _freeze_file(os.path.join(root, name), dst, counts)
+
+    for root, dirs, names in os.walk(frozen_path, topdown=False):
+        rel_root = os.path.relpath(root, frozen_path)
+        for name in names:
+            if os.path.normpath(os.path.join(rel_root, name)) not in seen:
+                os.remove(os.path.join(root, name))
+                counts["removed"] += 1
+        if os.path.normpath(rel_root) not in seen:
+            os.rmdir(root)
+
+
+def freeze(local_path: str, frozen_path: str, changes: set[str] | None = None):
+    # Make `frozen_path` an exact copy of `local_path`. Files whose size and mtime match
+    # the previous copy are kept, so the time taken follows what the game wrote since.
+    # With `changes`, the paths changed since the previous copy, only those are synced.
+    counts = {"copied": 0, "linked": 0, "removed": 0}
+    if changes is None or not os.path.isdir(frozen_path):
+        logger.info(f"Freezing local path '{local_path}' into '{frozen_path}'")
+        _freeze_tree(local_path, frozen_path, counts)
+    else:
+        logger.info(
+            f"Freezing {len(changes)} changed paths of '{local_path}' into '{frozen_path}'"
+        )
+        for rel in sorted(changes):
+            src = os.path.join(local_path, rel)
+            dst = os.path.join(frozen_path, rel)
+            if os.path.isdir(src):
+                _freeze_tree(src, dst, counts)
+            elif os.path.exists(src):
+                if os.path.isdir(dst) and not os.path.islink(dst):
+                    shutil.rmtree(dst)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                _freeze_file(src, dst, counts)
+            else:
+                _remove(dst, counts)
+    logger.info(
+        f"Froze {counts['copied']} copied and {counts['linked']} linked files, "
+        f"removed {counts['removed']}"
+    )
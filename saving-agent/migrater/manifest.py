@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+from typing import NamedTuple
+
+from loguru import logger
+
+from migrater.metrics import SCAN_SECONDS
+from migrater.workdirs import prune_work_dirs
+
+MANIFEST_VERSION = 1
+PULL_INDEX_VERSION = 1
+
+type RelPath = str
+
+
+class FileEntry(NamedTuple):
+    size: int
+    mtime_ns: int
+    sha256: str
+    # number of region deltas stacked on the remote copy, see `migrater.mca.make_delta`
+    deltas: int = 0
+    # (sha256, size) of the content-defined pieces the file is stored as, see
+    # `migrater.chunking.split_file`; None when it is stored as a single object
+    chunks: list[tuple[str, int]] | None = None
+    # path of the pack the file is pushed in, relative to the save, see
+    # `migrater.pack`; None when it is pushed as a file of its own
+    pack: str | None = None
+
+    def pieces(self) -> list[tuple[str, int]]:
+        return self.chunks or [(self.sha256, self.size)]
+
+
+class ManifestDiff(NamedTuple):
+    added: list[RelPath]
+    changed: list[RelPath]
+    removed: list[RelPath]
+
+    def is_empty(self):
+        return not (self.added or self.changed or self.removed)
+
+
+def hash_file(path: str, algorithm: str = "sha256") -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, algorithm).hexdigest()
+
+
+class Manifest:
+    def __init__(self, files: dict[RelPath, FileEntry] | None = None):
+        self.files: dict[RelPath, FileEntry] = files or {}
+
+    @classmethod
+    def scan(
+        cls,
+        local_path: str,
+        cache: "Manifest | None" = None,
+        changes: set[RelPath] | None = None,
+    ) -> "Manifest":
+        # hashes of files whose size and mtime are unchanged since `cache` was taken
+        # are reused instead of recomputed; with `changes`, the paths changed since,
+        # only those are looked at and the rest of `cache` is taken as it is
+        if changes is not None and cache is not None:
+            with SCAN_SECONDS.time(kind="changes"):
+                return cls._rescan(local_path, cache, changes)
+        with SCAN_SECONDS.time(kind="full"):
+            return cls._scan(local_path, cache)
+
+    @classmethod
+    def _scan(cls, local_path: str, cache: "Manifest | None") -> "Manifest":
+        logger.info(f"Scanning local path '{local_path}' for manifest")
+        files: dict[RelPath, FileEntry] = {}
+        hashed = 0
+        for root, dirs, names in os.walk(local_path):
+            prune_work_dirs(root, local_path, dirs)
+            for name in names:
+                file_path = os.path.join(root, name)
+                rel = os.path.relpath(file_path, local_path).replace(os.sep, "/")
+                cached = cache.files.get(rel) if cache else None
+                entry = cls._scan_file(file_path, cached)
+                if entry is None:
+                    continue
+                if entry is not cached:
+                    hashed += 1
+                files[rel] = entry
+        logger.info(f"Scanned {len(files)} files, hashed {hashed} of them")
+        return cls(files)
+
+    @classmethod
+    def _rescan(
+        cls, local_path: str, cache: "Manifest", changes: set[RelPath]
+    ) -> "Manifest":
+        logger.info(f"Scanning {len(changes)} changed paths of '{local_path}' for manifest")
+        files = dict(cache.files)
+        for changed in changes:
+            # a changed directory may have been removed or replaced as a whole
+            prefix = f"{changed}/"
+            for rel in [rel for rel in files if rel == changed or rel.startswith(prefix)]:
+                del files[rel]
+            changed_path = os.path.join(local_path, changed)
+            if os.path.isdir(changed_path):
+                for rel, entry in cls._scan(changed_path, cache.subtree(changed)).files.items():
+                    files[f"{prefix}{rel}"] = entry
+            else:
+                entry = cls._scan_file(changed_path, cache.files.get(changed))
+                if entry is not None:
+                    files[changed] = entry
+        return cls(files)
+
+    @staticmethod
+    def _scan_file(file_path: str, cached: FileEntry | None) -> FileEntry | None:
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        if cached and cached.size == st.st_size and cached.mtime_ns == st.st_mtime_ns:
+            return cached
+        return FileEntry(st.st_size, st.st_mtime_ns, hash_file(file_path))
+
+    def subtree(self, rel_dir: RelPath) -> "Manifest":
+        prefix = f"{rel_dir}/"
+        return Manifest(
+            {
+                rel[len(prefix) :]: entry
+                for rel, entry in self.files.items()
+                if rel.startswith(prefix)
+            }
+        )
+
+    def diff(self, new: "Manifest") -> ManifestDiff:
+        added = [rel for rel in new.files if rel not in self.files]
+        changed = [
+            rel
+            for rel, entry in new.files.items()
+            if rel in self.files
+            and (self.files[rel].sha256, self.files[rel].size)
+            != (entry.sha256, entry.size)
+        ]
+        removed = [rel for rel in self.files if rel not in new.files]
+        return ManifestDiff(sorted(added), sorted(changed), sorted(removed))
+
+    def dumps(self) -> str:
+        return json.dumps(
+            {
+                "version": MANIFEST_VERSION,
+                "files": {rel: entry._asdict() for rel, entry in self.files.items()},
+            }
+        )
+
+    @classmethod
+    def loads(cls, s: str | bytes) -> "Manifest":
+        j = json.loads(s)
+        if j.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported manifest version: {j.get('version')}")
+        return cls({rel: FileEntry(**entry) for rel, entry in j["files"].items()})
+
+    @classmethod
+    def load(cls, path: str) -> "Manifest | None":
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return cls.loads(f.read())
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable manifest '{path}': {e}")
+            return None
+
+    def dump(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.dumps())
+        os.replace(tmp_path, path)
+
+
+class PulledFile(NamedTuple):
+    inode: int
+    size: int
+    mtime_ns: int
+    # the remote entries the file was made from, as (path, size, etag) sorted by path;
+    # the mtime stands in for the etag when the filer has none
+    remote: list[tuple[str, int, str]]
+
+
+class PullIndex:
+    # Local files as the last pull left them. A file whose inode, size and mtime are
+    # unchanged since holds what its remote entries did then, without hashing it.
+    def __init__(self, files: dict[RelPath, PulledFile] | None = None):
+        self.files: dict[RelPath, PulledFile] = files or {}
+
+    def dumps(self) -> str:
+        return json.dumps(
+            {
+                "version": PULL_INDEX_VERSION,
+                "files": {rel: pulled._asdict() for rel, pulled in self.files.items()},
+            }
+        )
+
+    @classmethod
+    def loads(cls, s: str | bytes) -> "PullIndex":
+        j = json.loads(s)
+        if j.get("version") != PULL_INDEX_VERSION:
+            raise ValueError(f"Unsupported pull index version: {j.get('version')}")
+        files = {}
+        for rel, pulled in j["files"].items():
+            remote = [tuple(item) for item in pulled.pop("remote")]
+            files[rel] = PulledFile(**pulled, remote=remote)
+        return cls(files)
+
+    @classmethod
+    def load(cls, path: str) -> "PullIndex | None":
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return cls.loads(f.read())
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable pull index '{path}': {e}")
+            return None
+
+    def dump(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.dumps())
+        os.replace(tmp_path, path)
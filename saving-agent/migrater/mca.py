@@ -1,21 +1,38 @@
-from io import BufferedReader, BufferedWriter
-import itertools
+from array import array
+from io import BufferedReader, BufferedWriter, UnsupportedOperation
+import hashlib
 from lzma import LZMACompressor
-from typing import NamedTuple
-import zlib
-from itertools import islice, chain, repeat
+import mmap
+import os
+import re
+import sys
+from typing import Iterator, NamedTuple
+from itertools import compress
+
+from migrater.codecs import ChunkCompressionType, get_codec
 
 MCA_CHUNK_LENGTH = 32
 MCA_CHUNKS = MCA_CHUNK_LENGTH**2
 MCA_CHUNKS_4 = MCA_CHUNKS * 4
 MCA_SECTOR = 4096
+MCA_HEADER_SIZE = MCA_CHUNKS_4 * 2
+# a chunk entry counts its sectors in one byte
+MCA_MAX_CHUNK_SIZE = 0xFF * MCA_SECTOR
+# set on the compression type of chunks stored in an external `.mcc` file
+MCA_EXTERNAL = 0x80
+MCA_REGION_PATTERN = re.compile(r"^r\.(-?\d+)\.(-?\d+)\.mca$")
+MCA_DELTA_MAGIC = b"MCAD"
+MCA_DELTA_VERSION = 1
+MCA_DELTA_HEADER_OFFSET = len(MCA_DELTA_MAGIC) + 1 + 32
+_U32 = "I" if array("I").itemsize == 4 else "L"
+ZERO_SECTOR = bytes(MCA_SECTOR)
+ZERO_HEADER = bytes(MCA_HEADER_SIZE)
 
 type ChunkXY = tuple[int, int]
 type ChunkOffset = int
 type ChunkSectors = int
 type ChunkSize = int
 type ChunkTimestamp = int
-type ChunkCompressionType = int
 type ChunkCompressedData = bytes
 MCAHeaderEntry = NamedTuple(
     "MCAHeaderEntry",
@@ -27,127 +44,176 @@ MCAHeaderEntry = NamedTuple(
 )
 
 
+def _get_chunk_xy(idx: int) -> ChunkXY:
+    return (idx % MCA_CHUNK_LENGTH, idx // MCA_CHUNK_LENGTH)
+
+
+# Both 4 KiB header tables decoded in one pass each: `array.frombytes` copies the
+# big-endian u32s into a compact buffer and a single `byteswap` fixes the byte order, so
+# there are no per-entry slices, ints or tuples until an entry is actually looked at.
+# Chunks are addressed by index `z * 32 + x`; a chunk is present when its location is
+# non-zero.
+class MCAHeader:
+    __slots__ = ("locations", "timestamps")
+
+    def __init__(self, header_bs: bytes | memoryview):
+        view = memoryview(header_bs)
+        if len(view) < MCA_HEADER_SIZE:
+            view = memoryview(bytes(view).ljust(MCA_HEADER_SIZE, b"\0"))
+        self.locations = array(_U32)
+        self.locations.frombytes(view[:MCA_CHUNKS_4])
+        self.timestamps = array(_U32)
+        self.timestamps.frombytes(view[MCA_CHUNKS_4:MCA_HEADER_SIZE])
+        if sys.byteorder == "little":
+            self.locations.byteswap()
+            self.timestamps.byteswap()
+
+    def offset(self, idx: int) -> ChunkOffset:
+        return self.locations[idx] >> 8
+
+    def sectors(self, idx: int) -> ChunkSectors:
+        return self.locations[idx] & 0xFF
+
+    def timestamp(self, idx: int) -> ChunkTimestamp:
+        return self.timestamps[idx]
+
+    def entry(self, idx: int) -> MCAHeaderEntry:
+        loc = self.locations[idx]
+        return MCAHeaderEntry(loc >> 8, loc & 0xFF, self.timestamps[idx])
+
+    def indices(self) -> Iterator[int]:
+        return compress(range(MCA_CHUNKS), self.locations)
+
+    def newest_timestamp(self) -> ChunkTimestamp:
+        return max(compress(self.timestamps, self.locations), default=0)
+
+    def __contains__(self, idx: int) -> bool:
+        return self.locations[idx] != 0
+
+    def __len__(self):
+        return MCA_CHUNKS - self.locations.count(0)
+
+
 class MCACompressor:
+    # Chunks are read straight out of a read-only mapping of the input region, or with
+    # `readinto` into one reusable buffer when `lazy` or when the file cannot be mapped.
+    # A mapped file must not shrink while it is being converted, so only map regions
+    # the game is not writing to.
     def __init__(self, mca_f: BufferedReader, *, lazy=False):
         self._mca_f = mca_f
-        self._mca_data: bytes | None = None
-        self._header: dict[ChunkXY, MCAHeaderEntry] | None = None
+        self._mca_data: mmap.mmap | None = None
+        self._header: MCAHeader | None = None
         self._buffer = bytearray()
         if not lazy:
-            self._mca_data = mca_f.read()
+            try:
+                self._mca_data = mmap.mmap(mca_f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError, UnsupportedOperation):
+                # empty files and in-memory streams cannot be mapped
+                self._mca_data = None
 
-    def _read_bytes(self, offset: int, size: int) -> bytes:
-        if self._mca_data:
-            return self._mca_data[offset : offset + size]
+    def _read_bytes(self, offset: int, size: int) -> memoryview:
+        if self._mca_data is not None:
+            return memoryview(self._mca_data)[offset : offset + size]
         else:
+            # the returned view is only valid until the next read
+            if len(self._buffer) < size:
+                self._buffer = bytearray(size)
+            view = memoryview(self._buffer)[:size]
             self._mca_f.seek(offset)
-            bs = self._mca_f.read(size)
-            return bs
+            read = self._mca_f.readinto(view)
+            return view[:read]
 
     def _read_header(self):
-        if not self._header:
-
-            def get_x_y(idx: int) -> ChunkXY:
-                return (idx % MCA_CHUNK_LENGTH, idx // MCA_CHUNK_LENGTH)
+        if self._header is None:
+            header_bs = self._read_bytes(0, MCA_HEADER_SIZE)
+            self._header = MCAHeader(header_bs)
+        return self._header
 
-            def get_offset_sectors(bs: bytes) -> tuple[ChunkOffset, ChunkSectors]:
-                return (
-                    int.from_bytes(bs[0:3], byteorder="big"),
-                    int.from_bytes(bs[3:4], byteorder="big"),
-                )
+    def _get_chunk(
+        self, header: MCAHeader, idx: int
+    ) -> tuple[ChunkSize, ChunkCompressionType, memoryview]:
+        bs = self._read_bytes(header.offset(idx) * MCA_SECTOR, header.sectors(idx) * MCA_SECTOR)
+        size = int.from_bytes(bs[0:4], byteorder="big")
+        compression_type = bs[4]
+        compressed_data = bs[5 : 4 + size]
+        return (size, compression_type, compressed_data)
 
-            def get_timestamp(bs: bytes) -> ChunkTimestamp:
-                return int.from_bytes(bs, byteorder="big")
+    def _build_external_path(self, idx: int) -> str:
+        # oversized chunks live next to the region in `c.<chunk x>.<chunk z>.mcc`,
+        # with absolute chunk coordinates
+        region_path = self._mca_f.name
+        m = MCA_REGION_PATTERN.match(os.path.basename(region_path))
+        if m is None:
+            raise Exception(f"cannot locate external chunks of region '{region_path}'")
+        x, z = _get_chunk_xy(idx)
+        chunk_x = int(m[1]) * MCA_CHUNK_LENGTH + x
+        chunk_z = int(m[2]) * MCA_CHUNK_LENGTH + z
+        return os.path.join(os.path.dirname(region_path), f"c.{chunk_x}.{chunk_z}.mcc")
 
-            header_bs = self._read_bytes(0, MCA_CHUNKS_4 * 2)
-            self._header = {}
-            for idx, (loc_bs, time_bs) in enumerate(
-                (
-                    header_bs[i : i + 4],
-                    header_bs[MCA_CHUNKS_4 + i : MCA_CHUNKS_4 + i + 4],
-                )
-                for i in range(0, MCA_CHUNKS_4, 4)
-            ):
-                chunk_xy = get_x_y(idx)
-                offset, sectors = get_offset_sectors(loc_bs)
-                timestamp = get_timestamp(time_bs)
-                if all([offset, sectors, timestamp]):
-                    self._header[chunk_xy] = MCAHeaderEntry(offset, sectors, timestamp)
-                else:
-                    assert not any([offset, sectors, timestamp]), (
-                        f"{chunk_xy=}; {offset, sectors, timestamp=}"
-                    )
-        return self._header
+    def read_chunk(self, idx: int) -> bytes | None:
+        header = self._read_header()
+        if idx not in header:
+            return None
+        _, compression_type, data = self._get_chunk(header, idx)
+        if compression_type & MCA_EXTERNAL:
+            with open(self._build_external_path(idx), "rb") as f:
+                data = f.read()
+        return bytes(get_codec(compression_type & ~MCA_EXTERNAL).decompress(data))
 
     def _convert_to(self, target_compression_type: int, mca_f: BufferedWriter):
-        def get_chunk(
-            offset: ChunkOffset, sectors: ChunkSectors
-        ) -> tuple[ChunkSize, ChunkCompressionType, ChunkCompressedData]:
-            bs = self._read_bytes(offset * MCA_SECTOR, sectors * MCA_SECTOR)
-            size = int.from_bytes(bs[0:4], byteorder="big")
-            compression_type = int.from_bytes(bs[4:5], byteorder="big")
-            compressed_data = bs[5 : 4 + size]
-            return (size, compression_type, compressed_data)
-
+        target_codec = get_codec(target_compression_type)
         header = self._read_header()
-        new_header_loc_buffer = bytearray()
-        new_header_time_buffer = bytearray()
-        new_chunks_buffer = bytearray()
-        for z, x in itertools.product(range(MCA_CHUNK_LENGTH), range(MCA_CHUNK_LENGTH)):
-            chunk_xy = x, z
-            header_entry = header.get(chunk_xy, MCAHeaderEntry(0, 0, 0))
-            is_chunk_exists = all(header_entry)
-
-            # recard the head location of current chunk data
-            head_loc = len(new_chunks_buffer)
-            assert head_loc % MCA_SECTOR == 0
-
-            if is_chunk_exists:
-                # prepare converted data
-                _, compression_type, original_data = get_chunk(
-                    header_entry.chunk_offset, header_entry.chunk_sectors
-                )
-                if compression_type == target_compression_type:
-                    converted_data = original_data
-                else:
-                    if compression_type == 2 and target_compression_type == 3:
-                        converted_data = zlib.decompress(original_data)
-                    elif compression_type == 3 and target_compression_type == 2:
-                        converted_data = zlib.compress(original_data)
-                    else:
-                        raise Exception(f"unaccepted converting compose: {compression_type=} and {target_compression_type=}")
-                converted_length = len(converted_data)
-
-                # filling chunk length and compression type
-                # `+1` here for:
-                # > The following byte indicates the compression scheme used for chunk data, and
-                # > the remaining (length-1) bytes are the compressed chunk data.
-                new_chunks_buffer.extend((converted_length + 1).to_bytes(4, "big"))
-                new_chunks_buffer.extend(target_compression_type.to_bytes(1, "big"))
-
-                # filling decompressed chunk data
-                sector_aligned_length = (converted_length + MCA_SECTOR - 1) & ~(
-                    MCA_SECTOR - 1
-                )
-                target_length = sector_aligned_length - 5
-                new_chunks_buffer.extend(
-                    bytes(islice(chain(converted_data, repeat(0)), target_length))
-                )
+        new_locations = array(_U32, bytes(MCA_CHUNKS_4))
+        new_timestamps = array(_U32, bytes(MCA_CHUNKS_4))
+
+        # the header is only known once every chunk is written, so its space is reserved
+        # up front and filled in last
+        start = mca_f.tell()
+        mca_f.write(ZERO_HEADER)
+        head_sectors_loc = MCA_HEADER_SIZE // MCA_SECTOR
+        for idx in header.indices():
+            # prepare converted data
+            _, compression_type, original_data = self._get_chunk(header, idx)
+            converted_type = target_compression_type
+            if compression_type == target_compression_type:
+                converted_data = original_data
+            elif compression_type & MCA_EXTERNAL:
+                # the payload lives in its `.mcc` file, which is left as it is
+                converted_type, converted_data = compression_type, original_data
             else:
-                sector_aligned_length = 0
+                converted_data = target_codec.compress(
+                    get_codec(compression_type).decompress(original_data)
+                )
+            if len(converted_data) + 5 > MCA_MAX_CHUNK_SIZE:
+                # too large for a region entry, keep the chunk as the game wrote it
+                converted_type, converted_data = compression_type, original_data
+            converted_length = len(converted_data)
 
-            # filling header
-            head_sectors_loc = (head_loc + MCA_CHUNKS_4 * 2) // MCA_SECTOR
-            sectors = sector_aligned_length // MCA_SECTOR
-            new_header_loc_buffer.extend(head_sectors_loc.to_bytes(3, "big"))
-            new_header_loc_buffer.extend(sectors.to_bytes(1, "big"))
-            new_header_time_buffer.extend(
-                header_entry.chunk_timestamp.to_bytes(4, "big")
-            )
+            # `+1` here for:
+            # > The following byte indicates the compression scheme used for chunk data, and
+            # > the remaining (length-1) bytes are the compressed chunk data.
+            sectors = (converted_length + 5 + MCA_SECTOR - 1) // MCA_SECTOR
+            mca_f.write((converted_length + 1).to_bytes(4, "big"))
+            mca_f.write(converted_type.to_bytes(1, "big"))
+            mca_f.write(converted_data)
+            # pad the chunk with zeros up to the next sector boundary
+            mca_f.write(ZERO_SECTOR[: sectors * MCA_SECTOR - converted_length - 5])
 
-        mca_f.write(new_header_loc_buffer)
-        mca_f.write(new_header_time_buffer)
-        mca_f.write(new_chunks_buffer)
+            new_locations[idx] = head_sectors_loc << 8 | sectors
+            new_timestamps[idx] = header.timestamp(idx)
+            head_sectors_loc += sectors
+
+        if sys.byteorder == "little":
+            new_locations.byteswap()
+            new_timestamps.byteswap()
+        end = mca_f.tell()
+        mca_f.seek(start)
+        mca_f.write(new_locations)
+        mca_f.write(new_timestamps)
+        mca_f.seek(end)
+
+    def convert_to(self, compression_type: int, mca_f: BufferedWriter):
+        self._convert_to(compression_type, mca_f)
 
     def decompress_to(self, mca_f: BufferedWriter):
         self._convert_to(3, mca_f)
@@ -155,6 +221,97 @@ class MCACompressor:
     def compress_to(self, mca_f: BufferedWriter):
         self._convert_to(2, mca_f)
 
+class MCADeltaError(Exception):
+    pass
+
+
+# A region delta turns the region whose header was `parent_header_bs` into the region
+# in `mca_f`. Chunks are compared by their header timestamps, so only the sectors of
+# chunks saved since the parent version are carried. Layout: magic, version, sha256 of
+# the parent header, the new header, the number of carried chunks, then for each chunk
+# its index followed by its sectors.
+def make_delta(parent_header_bs: bytes, mca_f: BufferedReader) -> bytes:
+    mca_f.seek(0)
+    header_bs = mca_f.read(MCA_HEADER_SIZE).ljust(MCA_HEADER_SIZE, b"\0")
+    parent_header = MCAHeader(parent_header_bs)
+    header = MCAHeader(header_bs)
+    # timestamps have a one second resolution, so chunks saved in the same second as
+    # the newest parent chunk may have been rewritten after the parent was taken
+    parent_newest = parent_header.newest_timestamp()
+    changed = [
+        idx
+        for idx in header.indices()
+        if idx not in parent_header
+        or parent_header.timestamp(idx) != header.timestamp(idx)
+        or parent_header.sectors(idx) != header.sectors(idx)
+        or header.timestamp(idx) >= parent_newest
+    ]
+
+    delta = bytearray(MCA_DELTA_MAGIC)
+    delta.extend(MCA_DELTA_VERSION.to_bytes(1, "big"))
+    delta.extend(hashlib.sha256(parent_header_bs).digest())
+    delta.extend(header_bs)
+    delta.extend(len(changed).to_bytes(2, "big"))
+    for idx in changed:
+        length = header.sectors(idx) * MCA_SECTOR
+        mca_f.seek(header.offset(idx) * MCA_SECTOR)
+        delta.extend(idx.to_bytes(2, "big"))
+        delta.extend(mca_f.read(length).ljust(length, b"\0"))
+    return bytes(delta)
+
+
+def get_delta_header(delta: bytes) -> bytes:
+    return delta[MCA_DELTA_HEADER_OFFSET : MCA_DELTA_HEADER_OFFSET + MCA_HEADER_SIZE]
+
+
+def apply_delta(base_f: BufferedReader, delta: bytes, mca_f: BufferedWriter):
+    view = memoryview(delta)
+    if view[: len(MCA_DELTA_MAGIC)] != MCA_DELTA_MAGIC:
+        raise MCADeltaError("not a region delta")
+    version = view[len(MCA_DELTA_MAGIC)]
+    if version != MCA_DELTA_VERSION:
+        raise MCADeltaError(f"unsupported region delta version: {version}")
+
+    base_f.seek(0)
+    base_header_bs = base_f.read(MCA_HEADER_SIZE).ljust(MCA_HEADER_SIZE, b"\0")
+    parent_digest = view[len(MCA_DELTA_MAGIC) + 1 : MCA_DELTA_HEADER_OFFSET]
+    if hashlib.sha256(base_header_bs).digest() != parent_digest:
+        raise MCADeltaError("region delta does not apply to this base")
+
+    pos = MCA_DELTA_HEADER_OFFSET
+    header_bs = view[pos : pos + MCA_HEADER_SIZE]
+    pos += MCA_HEADER_SIZE
+    header = MCAHeader(header_bs)
+    base_header = MCAHeader(base_header_bs)
+    count = int.from_bytes(view[pos : pos + 2], "big")
+    pos += 2
+    payloads: dict[int, memoryview] = {}
+    for _ in range(count):
+        idx = int.from_bytes(view[pos : pos + 2], "big")
+        pos += 2
+        length = header.sectors(idx) * MCA_SECTOR
+        payloads[idx] = view[pos : pos + length]
+        pos += length
+
+    mca_f.write(header_bs)
+    end = MCA_HEADER_SIZE
+    for idx in header.indices():
+        offset, sectors = header.offset(idx), header.sectors(idx)
+        payload = payloads.get(idx)
+        if payload is None:
+            if idx not in base_header or base_header.sectors(idx) != sectors:
+                raise MCADeltaError(
+                    f"chunk {_get_chunk_xy(idx)} is missing from both base and delta"
+                )
+            base_f.seek(base_header.offset(idx) * MCA_SECTOR)
+            payload = base_f.read(sectors * MCA_SECTOR)
+        mca_f.seek(offset * MCA_SECTOR)
+        mca_f.write(payload)
+        end = max(end, (offset + sectors) * MCA_SECTOR)
+    # unused sectors between chunks are left as zero-filled holes
+    mca_f.truncate(end)
+
+
 if __name__ == "__main__":
     mca1_path = "/Users/authing/Desktop/ha-mc-server/migrater/r.-1.0.1-21-4.mca.decompressed"
     mca2_path = "/Users/authing/Desktop/ha-mc-server/migrater/r.-1.0.1-21-4.new.mca.decompressed"
@@ -0,0 +1,212 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter, time
+import threading
+
+# A minimal Prometheus registry, rendered in the text exposition format by the
+# agent's /metrics endpoint. Label values are given as keyword arguments.
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300
+)
+
+_registry: list["_Metric"] = []
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self._labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple[tuple[str, str], ...], object] = {}
+        # without labels the single series is there from the start
+        if not labelnames:
+            self._values[()] = self._zero()
+        _registry.append(self)
+
+    def _zero(self) -> object:
+        return 0
+
+    def _key(self, labels: dict[str, str]) -> tuple[tuple[str, str], ...]:
+        if set(labels) != set(self._labelnames):
+            raise ValueError(
+                f"Metric '{self.name}' takes labels {self._labelnames}, not {tuple(labels)}"
+            )
+        return tuple((name, str(labels[name])) for name in self._labelnames)
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        with self._lock:
+            samples = self._samples()
+        return "\n".join(
+            [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+            + samples
+        )
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_to_current_time(self, **labels: str):
+        self.set(time(), **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels: str):
+        self.inc(1, **labels)
+        try:
+            yield
+        finally:
+            self.inc(-1, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self._buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(name, help, labelnames)
+
+    def _zero(self) -> object:
+        return ([0] * len(self._buckets), 0.0)
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or self._zero()
+            counts[bisect_left(self._buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def _samples(self) -> list[str]:
+        samples = []
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self._buckets, counts):
+                cumulative += count
+                labels = _format_labels(key + (("le", _format_value(bound)),))
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            samples.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            samples.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return samples
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+RCON_FLUSH_SECONDS = Histogram(
+    "saving_agent_rcon_flush_seconds", "Time the game took to answer 'save-all flush'"
+)
+SAVE_SECONDS = Histogram(
+    "saving_agent_save_seconds", "Time taken by a whole save, from flush to push"
+)
+SYNC_SECONDS = Histogram(
+    "saving_agent_sync_seconds", "Time taken by a push or a pull", ("direction",)
+)
+SCAN_SECONDS = Histogram(
+    "saving_agent_scan_seconds",
+    "Time taken to build the manifest of a local save, in full or from changed paths",
+    ("kind",),
+)
+BACKUP_SECONDS = Histogram(
+    "saving_agent_backup_seconds",
+    "Time taken to move, restore or delete the backup kept during a push or a pull",
+    ("location", "op"),
+)
+TRANSFER_SECONDS = Histogram(
+    "saving_agent_transfer_seconds", "Time taken by one filer transfer", ("op",)
+)
+TRANSFER_BYTES = Counter(
+    "saving_agent_transfer_bytes_total", "Bytes moved to or from the filer", ("op",)
+)
+TRANSFER_FILES = Counter(
+    "saving_agent_transfer_files_total", "Files moved to or from the filer", ("op",)
+)
+TRANSFER_FAILURES = Counter(
+    "saving_agent_transfer_failures_total", "Filer transfers that failed", ("op",)
+)
+TRANSFERS_IN_FLIGHT = Gauge(
+    "saving_agent_transfers_in_flight", "Filer transfers currently running", ("op",)
+)
+RATE_LIMIT = Gauge(
+    "saving_agent_rate_limit_bytes_per_second",
+    "Current limit on the bytes moved to and from the filer per second, 0 for none",
+)
+FILER_RTT_SECONDS = Histogram(
+    "saving_agent_filer_rtt_seconds",
+    "RTT of the probes made to the filer while transfers are rate limited",
+)
+FILES_SKIPPED = Counter(
+    "saving_agent_files_skipped_total",
+    "Files left out of a push or a pull because they were unchanged",
+    ("direction",),
+)
+LAST_SUCCESS = Gauge(
+    "saving_agent_last_success_timestamp_seconds",
+    "Unix time of the last successful operation",
+    ("operation",),
+)
+
+
+@contextmanager
+def track_transfer(op: str):
+    with TRANSFERS_IN_FLIGHT.track_inprogress(op=op), TRANSFER_SECONDS.time(op=op):
+        try:
+            yield
+        except BaseException:
+            TRANSFER_FAILURES.inc(op=op)
+            raise
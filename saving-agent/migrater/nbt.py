@@ -0,0 +1,90 @@
+from typing import Any, BinaryIO
+import gzip
+import struct
+
+TAG_END = 0
+TAG_BYTE = 1
+TAG_SHORT = 2
+TAG_INT = 3
+TAG_LONG = 4
+TAG_FLOAT = 5
+TAG_DOUBLE = 6
+TAG_BYTE_ARRAY = 7
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_INT_ARRAY = 11
+TAG_LONG_ARRAY = 12
+
+_SCALARS = {
+    TAG_BYTE: struct.Struct(">b"),
+    TAG_SHORT: struct.Struct(">h"),
+    TAG_INT: struct.Struct(">i"),
+    TAG_LONG: struct.Struct(">q"),
+    TAG_FLOAT: struct.Struct(">f"),
+    TAG_DOUBLE: struct.Struct(">d"),
+}
+_ARRAYS = {TAG_BYTE_ARRAY: "b", TAG_INT_ARRAY: "i", TAG_LONG_ARRAY: "q"}
+_U16 = struct.Struct(">H")
+_I32 = struct.Struct(">i")
+
+
+class _Reader:
+    # Just enough of the NBT format to look values up in small files such as
+    # level.dat: compounds become dicts, lists and arrays become lists.
+    def __init__(self, bs: bytes):
+        self._view = memoryview(bs)
+        self._pos = 0
+
+    def _take(self, size: int) -> memoryview:
+        if self._pos + size > len(self._view):
+            raise ValueError("Truncated NBT data")
+        view = self._view[self._pos : self._pos + size]
+        self._pos += size
+        return view
+
+    def _unpack(self, s: struct.Struct):
+        return s.unpack(self._take(s.size))[0]
+
+    def _string(self) -> str:
+        return bytes(self._take(self._unpack(_U16))).decode(errors="replace")
+
+    def payload(self, tag: int) -> Any:
+        if tag in _SCALARS:
+            return self._unpack(_SCALARS[tag])
+        if tag in _ARRAYS:
+            length = self._unpack(_I32)
+            s = struct.Struct(f">{length}{_ARRAYS[tag]}")
+            return list(s.unpack(self._take(s.size)))
+        if tag == TAG_STRING:
+            return self._string()
+        if tag == TAG_LIST:
+            item_tag = self._unpack(_SCALARS[TAG_BYTE])
+            length = self._unpack(_I32)
+            return [self.payload(item_tag) for _ in range(length)]
+        if tag == TAG_COMPOUND:
+            compound = {}
+            while (item_tag := self._unpack(_SCALARS[TAG_BYTE])) != TAG_END:
+                name = self._string()
+                compound[name] = self.payload(item_tag)
+            return compound
+        raise ValueError(f"Unknown NBT tag {tag}")
+
+    def root(self) -> dict[str, Any]:
+        tag = self._unpack(_SCALARS[TAG_BYTE])
+        if tag != TAG_COMPOUND:
+            raise ValueError(f"NBT root is tag {tag}, not a compound")
+        self._string()
+        return self.payload(TAG_COMPOUND)
+
+
+def loads(bs: bytes) -> dict[str, Any]:
+    return _Reader(bs).root()
+
+
+def load(f: BinaryIO) -> dict[str, Any]:
+    # files such as level.dat and playerdata are gzipped, chunks are not
+    bs = f.read()
+    if bs[:2] == b"\x1f\x8b":
+        bs = gzip.decompress(bs)
+    return loads(bs)
@@ -0,0 +1,107 @@
+import json
+import lzma
+import os
+import posixpath
+import re
+import struct
+import zlib
+
+# Small files of the directories below are pushed bundled into packs, a few objects
+# per directory instead of one per file. A pack is an LZMA stream holding a JSON
+# index of its files, preceded by its length, then the contents of the files in
+# the order of the index.
+#
+# The files of a directory are spread over a power of two of packs by a hash of
+# their names, enough to keep each under PACK_TARGET_SIZE, so that a changed file
+# only rewrites its own pack. Packs are named after the number of packs of their
+# directory and their number, so that packs of another spread never collide.
+PACK_DIRS = ("playerdata", "stats", "advancements", "data")
+PACK_MAX_FILE_SIZE = 256 * 1024
+PACK_TARGET_SIZE = 1024 * 1024
+PACK_PATTERN = re.compile(r"^\.pack\.(\d+)\.(\d+)$")
+PACK_VERSION = 1
+PACK_BLOCK_SIZE = 256 * 1024
+# LZMA streams written during a push, packs and region keyframes and deltas, are
+# compressed once per transfer worker at a time. The default preset reserves up to
+# 94 MiB per compressor for an 8 MiB dictionary; a pack holds about PACK_TARGET_SIZE
+# bytes, which is all a dictionary needs to see, and regions repeat within chunks.
+LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 1, "dict_size": PACK_TARGET_SIZE}]
+
+
+def is_pack_file(rel: str) -> bool:
+    return bool(PACK_PATTERN.match(posixpath.basename(rel)))
+
+
+def is_packable(rel: str, size: int) -> bool:
+    parts = rel.split("/")
+    return len(parts) > 1 and parts[-2] in PACK_DIRS and size <= PACK_MAX_FILE_SIZE
+
+
+def assign_packs(sizes: dict[str, int]) -> dict[str, str]:
+    # the pack of every packable file, by their "/" separated paths and sizes
+    by_dir: dict[str, list[str]] = {}
+    for rel, size in sizes.items():
+        if is_packable(rel, size):
+            by_dir.setdefault(posixpath.dirname(rel), []).append(rel)
+    packs = {}
+    for dir_rel, rels in by_dir.items():
+        total = sum(sizes[rel] for rel in rels)
+        count = 1
+        while total > count * PACK_TARGET_SIZE:
+            count *= 2
+        for rel in rels:
+            n = zlib.crc32(posixpath.basename(rel).encode()) % count
+            packs[rel] = posixpath.join(dir_rel, f".pack.{count}.{n}")
+    return packs
+
+
+def build_pack(dir_path: str, names: list[str]) -> bytes:
+    contents = []
+    for name in sorted(names):
+        with open(os.path.join(dir_path, name), "rb") as f:
+            contents.append((name, f.read()))
+    index = json.dumps(
+        {
+            "version": PACK_VERSION,
+            "files": [{"name": name, "size": len(bs)} for name, bs in contents],
+        }
+    ).encode()
+    compressor = lzma.LZMACompressor(filters=LZMA_FILTERS)
+    out = [compressor.compress(struct.pack(">I", len(index)) + index)]
+    out += [compressor.compress(bs) for _, bs in contents]
+    out.append(compressor.flush())
+    return b"".join(out)
+
+
+def _read_exactly(f, size: int) -> bytes:
+    bs = f.read(size)
+    if len(bs) != size:
+        raise Exception(f"truncated pack: expected {size} bytes, got {len(bs)}")
+    return bs
+
+
+def extract_pack(pack_path: str, dir_path: str) -> list[str]:
+    # Writes the files of the pack into `dir_path` and returns their names. Each one
+    # is written beside and renamed into place, as a file already there may be a
+    # hardlink to one that must be left as it is.
+    names = []
+    with lzma.open(pack_path, "rb") as f:
+        (index_size,) = struct.unpack(">I", _read_exactly(f, 4))
+        j = json.loads(_read_exactly(f, index_size))
+        if j.get("version") != PACK_VERSION:
+            raise Exception(f"unsupported pack version: {j.get('version')}")
+        for item in j["files"]:
+            name = item["name"]
+            if name != os.path.basename(name) or name in ("", ".", ".."):
+                raise Exception(f"invalid file name in pack: {name!r}")
+            file_path = os.path.join(dir_path, name)
+            part_path = f"{file_path}.part"
+            remaining = item["size"]
+            with open(part_path, "wb") as out_f:
+                while remaining:
+                    block = _read_exactly(f, min(remaining, PACK_BLOCK_SIZE))
+                    out_f.write(block)
+                    remaining -= len(block)
+            os.replace(part_path, file_path)
+            names.append(name)
+    return names
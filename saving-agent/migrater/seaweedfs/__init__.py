@@ -1,3 +1,4 @@
+from .snapshot import SnapshotMigrater
 from .trivial import TrivialMigrater
 
-__all__ = ["TrivialMigrater"]
\ No newline at end of file
+__all__ = ["SnapshotMigrater", "TrivialMigrater"]
\ No newline at end of file
@@ -1,9 +1,258 @@
+from base64 import b64decode
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from functools import partial
+from itertools import chain
 from pathlib import PurePath
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, NamedTuple
+from uuid import uuid4
+import hashlib
+import lzma
 import os
+import re
 import shutil
 
 import requests
 from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from migrater import nbt
+from migrater.metrics import (
+    BACKUP_SECONDS,
+    FILES_SKIPPED,
+    LAST_SUCCESS,
+    SYNC_SECONDS,
+    TRANSFER_BYTES,
+    TRANSFER_FILES,
+    track_transfer,
+)
+from migrater.manifest import FileEntry, Manifest, PulledFile, PullIndex, hash_file
+from migrater.mca import (
+    MCA_HEADER_SIZE,
+    MCA_REGION_PATTERN,
+    apply_delta,
+    get_delta_header,
+    make_delta,
+)
+from migrater.pack import (
+    LZMA_FILTERS,
+    assign_packs,
+    build_pack,
+    extract_pack,
+    is_pack_file,
+)
+from migrater.throttle import RttAdapter, TokenBucket
+from migrater.transcode import (
+    BatchTranscoder,
+    TranscodeResult,
+    is_region_file,
+    transcode_file,
+    transcode_in_place,
+)
+from migrater.workdirs import WORK_DIRS, build_work_path, prune_work_dirs
+
+REGION_DELTA_PATTERN = re.compile(r"^(.+\.mca)\.delta\.(\d+)$")
+REGION_COORDS_PATTERN = re.compile(MCA_REGION_PATTERN)
+MD5_PATTERN = re.compile(r"[0-9a-f]{32}")
+# regions around the world spawn pulled before the game is started, in regions
+SPAWN_REGION_RADIUS = 1
+# regions pulled, rebuilt and handed to the game at a time after it is started, per worker
+LAZY_PULL_BATCH_SIZE = 8
+LZMA_MAGIC = b"\xfd7zXZ\x00"
+TRANSFER_BLOCK_SIZE = 256 * 1024
+LIST_PAGE_SIZE = 1000
+# directories of the per-player files, pushed right after level.dat
+UPLOAD_FIRST_DIRS = ("playerdata", "stats", "advancements")
+# read timeout of the probes timing the RTT to the filer, in seconds
+PROBE_TIMEOUT = 5
+# os.ModeDir of the Go filer
+FILER_MODE_DIR = 1 << 31
+
+
+class RemoteEntry(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+    etag: str
+
+
+def _is_dir_entry(entry: dict[str, Any]) -> bool:
+    if "Mode" in entry:
+        return bool(entry["Mode"] & FILER_MODE_DIR)
+    return "chunks" not in entry
+
+
+def _to_remote_entry(entry: dict[str, Any]) -> RemoteEntry:
+    try:
+        mtime = datetime.fromisoformat(entry["Mtime"]).timestamp()
+    except (KeyError, ValueError):
+        mtime = 0.0
+    chunks = entry.get("chunks") or []
+    if entry.get("Md5"):
+        etag = b64decode(entry["Md5"]).hex()
+    else:
+        etag = ",".join(chunk.get("e_tag", "") for chunk in chunks)
+    size = entry.get("FileSize") or sum(chunk.get("size", 0) for chunk in chunks)
+    return RemoteEntry(entry["FullPath"], size, mtime, etag)
+
+
+def _is_lzma_file(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(LZMA_MAGIC)) == LZMA_MAGIC
+
+
+def run_transfers(tasks: Iterable[Callable[[], None]], workers: int = 1):
+    # Keep up to `workers` transfers in flight while `tasks` is still being produced.
+    # The first failure cancels everything not yet started and waits for the running
+    # transfers to finish before re-raising, so the caller can safely roll back.
+    if workers <= 1:
+        for task in tasks:
+            task()
+        return
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="transfer")
+    pending: set[Future] = set()
+    try:
+        for task in tasks:
+            pending.add(executor.submit(task))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _ThrottledFile:
+    # An open file passed to `throttle` by the size of every read, which requests sends
+    # with a Content-Length like the file itself.
+    def __init__(self, f: BinaryIO, throttle: Callable[[int], None]):
+        self._f = f
+        self._throttle = throttle
+        self._length = os.fstat(f.fileno()).st_size
+
+    def __len__(self):
+        return self._length
+
+    def tell(self):
+        return self._f.tell()
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET):
+        return self._f.seek(offset, whence)
+
+    def read(self, size: int = -1) -> bytes:
+        bs = self._f.read(size)
+        self._throttle(len(bs))
+        return bs
+
+
+class _HashingFile:
+    # An open file hashing what is read from it front to back. Rewinding it to the
+    # start, as a retried request does, starts the hash over; the hash of a file read
+    # in any other order covers only part of it and matches nothing.
+    def __init__(self, f: BinaryIO, algorithm: str = "sha256"):
+        self._f = f
+        self._algorithm = algorithm
+        self._pos = f.tell()
+        self._restart()
+
+    def _restart(self):
+        self._hash = hashlib.new(self._algorithm)
+        self._hashed = 0
+
+    @property
+    def mode(self) -> str:
+        return self._f.mode
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET):
+        self._pos = self._f.seek(offset, whence)
+        if self._pos == 0:
+            self._restart()
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        bs = self._f.read(size)
+        if self._pos == self._hashed:
+            self._hash.update(bs)
+            self._hashed += len(bs)
+        self._pos += len(bs)
+        return bs
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class _MultipartFile:
+    # A multipart/form-data body read lazily from an open file, so that uploads never
+    # hold the whole file in memory. It reports its length and is seekable, so requests
+    # sends it with a Content-Length and urllib3 can rewind it when retrying.
+    def __init__(
+        self,
+        f: BinaryIO,
+        filename: str,
+        throttle: Callable[[int], None] | None = None,
+    ):
+        boundary = uuid4().hex
+        filename = filename.replace('"', "%22")
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            "\r\n"
+        ).encode()
+        self._tail = f"\r\n--{boundary}--\r\n".encode()
+        self._f = f
+        self._throttle = throttle
+        self._file_size = os.fstat(f.fileno()).st_size
+        self._length = len(self._head) + self._file_size + len(self._tail)
+        self._pos = 0
+
+    def __len__(self):
+        return self._length
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._length
+        self._pos = max(0, min(offset, self._length))
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            size = self._length - self._pos
+        out = bytearray()
+        while len(out) < size and self._pos < self._length:
+            want = size - len(out)
+            file_start = len(self._head)
+            file_end = file_start + self._file_size
+            if self._pos < file_start:
+                bs = self._head[self._pos : self._pos + want]
+            elif self._pos < file_end:
+                self._f.seek(self._pos - file_start)
+                bs = self._f.read(min(want, file_end - self._pos))
+                if not bs:
+                    raise SeaweedfsClientError("File shrank while uploading")
+            else:
+                bs = self._tail[self._pos - file_end : self._pos - file_end + want]
+            out.extend(bs)
+            self._pos += len(bs)
+        if self._throttle is not None:
+            self._throttle(len(out))
+        return bytes(out)
 
 
 class SeaweedfsClientError(Exception):
@@ -14,15 +263,113 @@ class NotFound(SeaweedfsClientError):
     pass
 
 
+class PullConflictError(Exception):
+    # regions the game created before they were pulled; pushing the save would replace
+    # their remote copies, which are set aside instead
+    def __init__(self, rels: list[str], conflicts_path: str):
+        self.rels = rels
+        self.conflicts_path = conflicts_path
+        super().__init__(
+            f"{len(rels)} regions were created by the game before they were pulled, "
+            f"their remote copies are kept in '{conflicts_path}'"
+        )
+
+
 class SeaweedfsClient:
-    def __init__(self, base_url: str):
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        pool_size: int = 16,
+        connect_timeout: float = 5,
+        read_timeout: float = 60,
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        rate_limit: float | None = None,
+        adaptive_rate: bool = False,
+    ):
         self._base_url = base_url
+        self._timeout = (connect_timeout, read_timeout)
+
+        # One keep-alive session is shared by all transfers; urllib3 pools are thread
+        # safe and `pool_block` caps the number of open connections at `pool_size`.
+        # Its requests, uploads overwriting a file included, are idempotent and are
+        # retried on any error. Appends and moves are not: they go through a session
+        # of their own that only retries connections failed before anything was sent.
+        self._session = self._make_session(
+            Retry.DEFAULT_ALLOWED_METHODS | {"PUT", "DELETE", "POST"},
+            pool_size,
+            retries,
+            backoff_factor,
+        )
+        self._once_session = self._make_session(
+            Retry.DEFAULT_ALLOWED_METHODS, 1, retries, backoff_factor
+        )
 
         # Test base_url
         self.list("/")
 
+        # All transfers share a single limit, in bytes per second. Probes get their own
+        # session, so that they never wait for a connection of the pool.
+        self._bucket = TokenBucket(rate_limit) if rate_limit else None
+        self._rtt_adapter = None
+        if self._bucket is not None and adaptive_rate:
+            self._probe_session = requests.Session()
+            self._rtt_adapter = RttAdapter(self._bucket, self._probe, max_rate=rate_limit)
+            self._rtt_adapter.start()
+
         logger.info(f"SeaweedfsClient initialized with base URL: {base_url}")
 
+    def close(self):
+        if self._rtt_adapter is not None:
+            self._rtt_adapter.close()
+            self._probe_session.close()
+        self._session.close()
+        self._once_session.close()
+
+    @staticmethod
+    def _make_session(
+        allowed_methods: frozenset[str],
+        pool_size: int,
+        retries: int,
+        backoff_factor: float,
+    ) -> requests.Session:
+        # failed connections are retried for every method, read errors and error
+        # statuses only for `allowed_methods`
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=allowed_methods,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _throttle(self, size: int):
+        if self._bucket is not None:
+            self._bucket.consume(size)
+
+    def _probe(self):
+        # a timed out probe is as long as its timeout, which is what the RTT is taken as
+        try:
+            self._probe_session.get(
+                self._build_url("/"),
+                headers={"Accept": "application/json"},
+                params={"limit": 1},
+                timeout=(self._timeout[0], PROBE_TIMEOUT),
+            )
+        except requests.RequestException as e:
+            logger.debug(f"Probe failed: {e}")
+
     def _build_url(self, remote_path: str):
         return self._base_url + remote_path
 
@@ -41,7 +388,10 @@ class SeaweedfsClient:
         *,
         append: bool = False,
         use_put: bool = False,
+        sha256: str | None = None,
     ):
+        # With `sha256`, the bytes sent are checked against it, and the remote file is
+        # deleted again if they do not match, as when the file changed meanwhile.
         logger.info(
             f"Uploading file from '{local_path}' to remote path '{remote_path}'"
         )
@@ -50,14 +400,83 @@ class SeaweedfsClient:
         if append:
             params["op"] = "append"
 
-        with open(local_path, "rb") as f:
-            files = {"file": f}
+        session = self._once_session if append else self._session
+
+        # both forms stream the file from disk instead of building the body in memory
+        with track_transfer("upload"), open(local_path, "rb") as raw_f:
+            f = _HashingFile(raw_f) if sha256 else raw_f
+            size = os.fstat(f.fileno()).st_size
             if use_put:
-                response = requests.put(url, data=f, params=params)
+                body = _ThrottledFile(f, self._throttle) if self._bucket else f
+                response = session.put(
+                    url, data=body, params=params, timeout=self._timeout
+                )
             else:
-                response = requests.post(url, files=files, params=params)
-        logger.debug(f"Upload response: {response.json()}")
-        return response.json()
+                body = _MultipartFile(
+                    f, os.path.basename(local_path), self._throttle if self._bucket else None
+                )
+                response = session.post(
+                    url,
+                    data=body,
+                    params=params,
+                    headers={"Content-Type": body.content_type},
+                    timeout=self._timeout,
+                )
+            j = response.json()
+            logger.debug(f"Upload response: {j}")
+            if "error" in j:
+                logger.error(f"Error in response: {j['error']}")
+                raise SeaweedfsClientError(j["error"])
+            if sha256 and f.hexdigest() != sha256:
+                logger.error(f"Local file '{local_path}' changed while being uploaded")
+                self.delete(remote_path)
+                raise SeaweedfsClientError(
+                    f"Local file '{local_path}' changed while being uploaded"
+                )
+        TRANSFER_BYTES.inc(size, op="upload")
+        TRANSFER_FILES.inc(op="upload")
+        return j
+
+    def write(
+        self,
+        data: bytes,
+        remote_path: str,
+    ):
+        logger.info(f"Writing {len(data)} bytes to remote path '{remote_path}'")
+        url = self._build_url(remote_path)
+        files = {"file": (PurePath(remote_path).name, data)}
+        with track_transfer("write"):
+            self._throttle(len(data))
+            response = self._session.post(url, files=files, timeout=self._timeout)
+            j = response.json()
+            logger.debug(f"Write response: {j}")
+            if "error" in j:
+                logger.error(f"Error in response: {j['error']}")
+                raise SeaweedfsClientError(j["error"])
+        TRANSFER_BYTES.inc(len(data), op="write")
+        TRANSFER_FILES.inc(op="write")
+        return j
+
+    def read(
+        self,
+        remote_path: str,
+    ):
+        logger.info(f"Reading remote path '{remote_path}'")
+        url = self._build_url(remote_path)
+        with track_transfer("read"):
+            response = self._session.get(url, timeout=self._timeout)
+            self._throttle(len(response.content))
+        if response.status_code == 404:
+            logger.warning(f"Remote path '{remote_path}' not found")
+            raise NotFound()
+        if not response.ok:
+            logger.error(f"Read failed with status {response.status_code}")
+            raise SeaweedfsClientError(
+                f"Read of '{remote_path}' failed with status {response.status_code}"
+            )
+        TRANSFER_BYTES.inc(len(response.content), op="read")
+        TRANSFER_FILES.inc(op="read")
+        return response.content
 
     def delete(
         self,
@@ -70,7 +489,7 @@ class SeaweedfsClient:
             "recursive": "true" if recursive else "false",
         }
         url = self._build_url(remote_path)
-        response = requests.delete(url, params=params)
+        response = self._session.delete(url, params=params, timeout=self._timeout)
         self._raise_error_from_response(response)
 
     def download(
@@ -82,9 +501,35 @@ class SeaweedfsClient:
             f"Downloading file from remote path '{remote_path}' to '{local_path}'"
         )
         url = self._build_url(remote_path)
-        response = requests.get(url)
-        with open(local_path, "wb") as f:
-            f.write(response.content)
+        # stream into a sibling file and rename it into place, so that memory use does
+        # not depend on the file size and `local_path` is never left half-written
+        part_path = f"{local_path}.part"
+        size = 0
+        with (
+            track_transfer("download"),
+            self._session.get(url, stream=True, timeout=self._timeout) as response,
+        ):
+            if response.status_code == 404:
+                logger.warning(f"Remote path '{remote_path}' not found")
+                raise NotFound()
+            if not response.ok:
+                logger.error(f"Download failed with status {response.status_code}")
+                raise SeaweedfsClientError(
+                    f"Download of '{remote_path}' failed with status {response.status_code}"
+                )
+            try:
+                with open(part_path, "wb") as f:
+                    for block in response.iter_content(chunk_size=TRANSFER_BLOCK_SIZE):
+                        self._throttle(len(block))
+                        f.write(block)
+                        size += len(block)
+                os.replace(part_path, local_path)
+            except BaseException:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise
+        TRANSFER_BYTES.inc(size, op="download")
+        TRANSFER_FILES.inc(op="download")
 
     def move(
         self,
@@ -96,25 +541,36 @@ class SeaweedfsClient:
         params = {
             "mv.from": src_path,
         }
-        response = requests.post(url, params=params)
+        response = self._once_session.post(url, params=params, timeout=self._timeout)
         self._raise_error_from_response(response)
 
     def list(
         self,
         remote_path: str,
+        *,
+        limit: int | None = None,
+        last_file_name: str | None = None,
     ):
         logger.info(f"Listing remote path '{remote_path}'")
         url = self._build_url(remote_path)
         headers = {
             "Accept": "application/json",
         }
-        response = requests.get(url, headers=headers)
+        params = {}
+        if limit:
+            params["limit"] = limit
+        if last_file_name:
+            params["lastFileName"] = last_file_name
+        response = self._session.get(
+            url, headers=headers, params=params, timeout=self._timeout
+        )
         if response.status_code == 404:
             logger.warning(f"Remote path '{remote_path}' not found")
             raise NotFound()
         elif response.headers["Content-Type"] == "application/json":
-            logger.debug(f"List response: {response.json()}")
-            return response.json()
+            j = response.json()
+            logger.debug(f"List response: {len(j.get('Entries') or [])} entries")
+            return j
         elif "text/plain" in response.headers["Content-Type"]:
             parent_path = str(PurePath(remote_path).parent)
             logger.debug(
@@ -126,6 +582,44 @@ class SeaweedfsClient:
             logger.error(f"Unknown response content: {response.content}")
             raise Exception("Unknown error")
 
+    def iter_entries(self, remote_path: str) -> Iterator[dict[str, Any]]:
+        # the filer caps every listing at `limit` entries, continue after the last one
+        # until it reports that there is nothing more to load
+        last_file_name = None
+        while True:
+            list_result = self.list(
+                remote_path, limit=LIST_PAGE_SIZE, last_file_name=last_file_name
+            )
+            entries = list_result.get("Entries") or []
+            yield from entries
+            if not entries or not list_result.get("ShouldDisplayLoadMore"):
+                return
+            last_file_name = list_result["LastFileName"]
+
+    def _list_all(self, remote_path: str):
+        return [*self.iter_entries(remote_path)]
+
+    def walk(self, remote_path: str, *, workers: int = 1):
+        logger.info(f"Walking remote path '{remote_path}' with {workers} workers")
+        files = []
+        executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="list")
+        try:
+            pending = {executor.submit(self._list_all, remote_path)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for entry in future.result():
+                        if _is_dir_entry(entry):
+                            pending.add(
+                                executor.submit(self._list_all, entry["FullPath"])
+                            )
+                        else:
+                            files.append(_to_remote_entry(entry))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        logger.info(f"Found {len(files)} remote files under '{remote_path}'")
+        return files
+
     def exists(
         self,
         remote_path: str,
@@ -148,39 +642,451 @@ class SeaweedfsClient:
         params = {
             "metadata": "true",
         }
-        response = requests.get(url, params=params)
+        response = self._session.get(url, params=params, timeout=self._timeout)
         logger.debug(f"Metadata response: {response.json()}")
         return response.json()
 
 
+def fetch_manifest(client: SeaweedfsClient, manifest_path: str) -> Manifest | None:
+    try:
+        return Manifest.loads(client.read(manifest_path))
+    except NotFound:
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Ignoring unreadable manifest '{manifest_path}': {e}")
+        return None
+
+
 class _SeaweedfsSyncerL2R:
-    def __init__(self, client: SeaweedfsClient):
+    def __init__(
+        self,
+        client: SeaweedfsClient,
+        *,
+        incremental: bool = False,
+        region_delta: bool = False,
+        max_region_deltas: int = 16,
+        region_lzma: bool = False,
+        region_codec: int | None = None,
+        pack_small_files: bool = False,
+        workers: int = 1,
+    ):
+        if region_delta and region_codec is not None:
+            raise ValueError("region deltas are made from the local region files, not transcoded ones")
         self._client = client
+        self._incremental = incremental
+        self._region_delta = region_delta
+        self._max_region_deltas = max_region_deltas
+        self._region_lzma = region_lzma
+        self._region_codec = region_codec
+        self._pack_small_files = pack_small_files
+        self._workers = workers
         logger.info("SeaweedfsSyncerL2R initialized with client")
 
-    def sync(self, local_path: str, remote_path: str):
+    def sync(
+        self, local_path: str, remote_path: str, changes: set[str] | None = None
+    ):
         logger.info(
             f"Starting sync from local path '{local_path}' to remote path '{remote_path}'"
         )
+        with SYNC_SECONDS.time(direction="push"):
+            if self._incremental:
+                self._sync_incremental(local_path, remote_path, changes)
+            else:
+                self._sync_full(local_path, remote_path)
+                # a full push leaves any previous manifest stale
+                self._client.delete(self._build_manifest_path(remote_path))
+        LAST_SUCCESS.set_to_current_time(operation="push")
+
+    def _sync_full(self, local_path: str, remote_path: str):
         self._backup(remote_path)
         try:
-            for local_file_path in self._get_local_files(local_path):
-                local_file_relpath = os.path.relpath(local_file_path, local_path)
-                remote_file_path = os.path.join(remote_path, local_file_relpath)
-                logger.debug(
-                    f"Uploading local file '{local_file_path}' to remote path '{remote_file_path}'"
-                )
-                self._client.upload(
-                    local_path=local_file_path, remote_path=remote_file_path
+            sizes = {
+                os.path.relpath(local_file_path, local_path).replace(os.sep, "/"): (
+                    os.path.getsize(local_file_path)
                 )
+                for local_file_path in self._get_local_files(local_path)
+            }
+            packs = self._assign_packs(sizes)
+            self._run_uploads(
+                local_path,
+                remote_path,
+                [rel for rel in sizes if rel not in packs],
+                lambda rel: self._upload_file(
+                    os.path.join(local_path, rel), os.path.join(remote_path, rel)
+                ),
+                packs=self._group_packs(packs),
+            )
             backup_path = self._build_backup_path(remote_path)
-            self._client.delete(backup_path, recursive=True)
+            with BACKUP_SECONDS.time(location="remote", op="delete"):
+                self._client.delete(backup_path, recursive=True)
             logger.info("Sync completed successfully")
         except Exception as e:
             logger.error(f"Sync failed with exception: {e}")
             self._restore(remote_path)
             raise
 
+    def _sync_incremental(
+        self, local_path: str, remote_path: str, changes: set[str] | None = None
+    ):
+        local_manifest_path = self._build_manifest_path(local_path)
+        remote_manifest = self._fetch_remote_manifest(remote_path)
+        manifest = Manifest.scan(
+            local_path, cache=Manifest.load(local_manifest_path), changes=changes
+        )
+        packs = self._assign_packs(
+            {rel: entry.size for rel, entry in manifest.files.items()}
+        )
+        for rel, entry in manifest.files.items():
+            manifest.files[rel] = entry._replace(pack=packs.get(rel))
+        if remote_manifest is None:
+            logger.warning("No remote manifest found, falling back to a full push")
+            self._sync_full(local_path, remote_path)
+            # the full push stored regions as they are, an LZMA chain needs a keyframe first
+            if self._region_delta and not self._region_lzma:
+                for rel in manifest.files:
+                    if rel.endswith(".mca"):
+                        self._cache_region_header(
+                            local_path, manifest.files[rel], os.path.join(local_path, rel)
+                        )
+        else:
+            diff = remote_manifest.diff(manifest)
+            logger.info(
+                f"Manifest diff: {len(diff.added)} added, {len(diff.changed)} changed, "
+                f"{len(diff.removed)} removed"
+            )
+            for rel, entry in manifest.files.items():
+                if rel in remote_manifest.files:
+                    manifest.files[rel] = entry._replace(
+                        deltas=remote_manifest.files[rel].deltas
+                    )
+            # A pack is rewritten as a whole when any of its files is added, changed
+            # or removed, and so are both packs of a file that moved between them.
+            # Files that moved in or out of packs are deleted or uploaded on their own.
+            remote_packs = {
+                rel: entry.pack
+                for rel, entry in remote_manifest.files.items()
+                if entry.pack
+            }
+            moved = [
+                rel
+                for rel in manifest.files.keys() & remote_manifest.files.keys()
+                if packs.get(rel) != remote_packs.get(rel)
+            ]
+            dirty_packs = {
+                pack
+                for rel in chain(diff.added, diff.changed, diff.removed, moved)
+                for pack in (packs.get(rel), remote_packs.get(rel))
+                if pack
+            }
+            pack_members = self._group_packs(packs)
+            FILES_SKIPPED.inc(
+                len(manifest.files) - len(diff.added) - len(diff.changed),
+                direction="push",
+            )
+            if diff.is_empty() and not moved:
+                manifest.dump(local_manifest_path)
+                logger.info("Sync completed successfully, nothing changed")
+                return
+            # Drop the remote manifest while the remote tree is being modified, so
+            # that an interrupted push is followed by a full push instead of a diff
+            # against a manifest that no longer describes the remote.
+            self._client.delete(self._build_manifest_path(remote_path))
+
+            def upload(rel: str):
+                if self._region_delta and rel.endswith(".mca"):
+                    manifest.files[rel] = self._upload_region(
+                        local_path,
+                        remote_path,
+                        rel,
+                        manifest.files[rel],
+                        remote_manifest.files.get(rel),
+                    )
+                else:
+                    self._upload_file(
+                        os.path.join(local_path, rel), os.path.join(remote_path, rel)
+                    )
+
+            def delete(rel: str):
+                remote_file_path = os.path.join(remote_path, rel)
+                logger.debug(f"Deleting removed file at remote path '{remote_file_path}'")
+                self._client.delete(remote_file_path)
+                if rel in remote_manifest.files:
+                    self._delete_region_deltas(
+                        remote_file_path, remote_manifest.files[rel]
+                    )
+
+            uploads = sorted({*diff.added, *diff.changed, *moved} - packs.keys())
+            # removed and newly packed files, then packs left without files
+            deletes = [
+                rel
+                for rel in chain(diff.removed, sorted(moved))
+                if rel not in remote_packs
+            ]
+            deletes += sorted(pack for pack in dirty_packs if pack not in pack_members)
+            self._run_uploads(
+                local_path,
+                remote_path,
+                uploads,
+                upload,
+                (partial(delete, rel) for rel in deletes),
+                packs={
+                    pack: members
+                    for pack, members in pack_members.items()
+                    if pack in dirty_packs
+                },
+            )
+            logger.info("Sync completed successfully")
+        self._publish_manifest(manifest, local_path, remote_path)
+        if self._region_delta:
+            self._prune_region_headers(local_path, manifest)
+
+    def _run_uploads(
+        self,
+        local_path: str,
+        remote_path: str,
+        rels: list[str],
+        upload: Callable[[str], None],
+        extra_tasks: Iterable[Callable[[], None]] = (),
+        packs: dict[str, list[str]] | None = None,
+    ):
+        # With a region codec, region files are transcoded on a process pool while the
+        # other files are being uploaded, and each one is uploaded as soon as it is done.
+        # `packs` are built from their files and uploaded in turn with the others.
+        packs = packs or {}
+        rels = sorted(
+            chain(rels, packs), key=partial(self._get_upload_priority, local_path)
+        )
+        if self._region_codec is None:
+            region_rels = []
+        else:
+            region_rels = [rel for rel in rels if is_region_file(rel.replace(os.sep, "/"))]
+        transcoded = set(region_rels)
+        plain_rels = [rel for rel in rels if rel not in transcoded]
+        transcode_path = self._build_transcode_path(local_path)
+        try:
+            with BatchTranscoder(
+                local_path, transcode_path, region_rels, self._region_codec
+            ) as transcoder:
+                run_transfers(
+                    chain(
+                        (
+                            partial(
+                                self._upload_pack, local_path, remote_path, rel, packs[rel]
+                            )
+                            if rel in packs
+                            else partial(upload, rel)
+                            for rel in plain_rels
+                        ),
+                        extra_tasks,
+                        (
+                            partial(
+                                self._upload_transcoded,
+                                result,
+                                os.path.join(remote_path, result.rel),
+                            )
+                            for result in transcoder.results()
+                        ),
+                    ),
+                    self._workers,
+                )
+        finally:
+            shutil.rmtree(transcode_path, ignore_errors=True)
+
+    def _get_upload_priority(self, local_path: str, rel: str) -> tuple[int, int]:
+        # level.dat goes first, then the files of the players, which are the most
+        # noticed when lost, then the other small files; regions go last, the largest
+        # after all others, so that they never hold the small files back
+        parts = rel.replace(os.sep, "/").split("/")
+        if parts[-1] == "level.dat":
+            rank = 0
+        elif len(parts) > 1 and parts[-2] in UPLOAD_FIRST_DIRS:
+            rank = 1
+        elif is_region_file("/".join(parts)):
+            rank = 3
+        else:
+            rank = 2
+        try:
+            size = os.path.getsize(os.path.join(local_path, rel))
+        except OSError:
+            size = 0
+        return (rank, size)
+
+    def _build_transcode_path(self, local_path: str):
+        return f"{local_path}.transcoded"
+
+    def _assign_packs(self, sizes: dict[str, int]) -> dict[str, str]:
+        if not self._pack_small_files:
+            return {}
+        return assign_packs(sizes)
+
+    def _group_packs(self, packs: dict[str, str]) -> dict[str, list[str]]:
+        members: dict[str, list[str]] = {}
+        for rel, pack in packs.items():
+            members.setdefault(pack, []).append(rel)
+        return members
+
+    def _upload_pack(
+        self, local_path: str, remote_path: str, pack: str, members: list[str]
+    ):
+        data = build_pack(
+            os.path.join(local_path, os.path.dirname(pack)),
+            [os.path.basename(rel) for rel in members],
+        )
+        remote_pack_path = os.path.join(remote_path, pack)
+        logger.debug(
+            f"Uploading {len(members)} files packed in {len(data)} bytes "
+            f"to remote path '{remote_pack_path}'"
+        )
+        self._client.write(data, remote_pack_path)
+
+    def _upload_transcoded(self, result: TranscodeResult, remote_file_path: str):
+        self._upload_file(result.path, remote_file_path)
+        os.remove(result.path)
+
+    def _upload_file(self, local_file_path: str, remote_file_path: str):
+        logger.debug(
+            f"Uploading local file '{local_file_path}' to remote path '{remote_file_path}'"
+        )
+        self._client.upload(local_path=local_file_path, remote_path=remote_file_path)
+
+    def _upload_region(
+        self,
+        local_path: str,
+        remote_path: str,
+        rel: str,
+        entry: FileEntry,
+        parent_entry: FileEntry | None,
+    ) -> FileEntry:
+        local_file_path = os.path.join(local_path, rel)
+        remote_file_path = os.path.join(remote_path, rel)
+        if self._region_lzma:
+            # deltas and keyframes are taken from the decompressed region, which LZMA
+            # compresses far better than zlib chunks
+            source_path = os.path.join(self._build_transcode_path(local_path), rel)
+            transcode_file(local_file_path, source_path, 3)
+        else:
+            source_path = local_file_path
+        try:
+            return self._upload_region_from(
+                source_path, local_path, remote_file_path, entry, parent_entry
+            )
+        finally:
+            if self._region_lzma:
+                os.remove(source_path)
+
+    def _upload_region_from(
+        self,
+        source_path: str,
+        local_path: str,
+        remote_file_path: str,
+        entry: FileEntry,
+        parent_entry: FileEntry | None,
+    ) -> FileEntry:
+        parent_header_bs = (
+            self._load_region_header(local_path, parent_entry)
+            if parent_entry and parent_entry.deltas < self._max_region_deltas
+            else None
+        )
+        if parent_header_bs:
+            with open(source_path, "rb") as f:
+                delta = make_delta(parent_header_bs, f)
+            header_bs = get_delta_header(delta)
+            if self._region_lzma:
+                delta = lzma.compress(delta, filters=LZMA_FILTERS)
+            # a delta carrying most of the region is not worth stacking
+            if len(delta) < entry.size // 2:
+                entry = entry._replace(deltas=parent_entry.deltas + 1)
+                delta_remote_path = f"{remote_file_path}.delta.{entry.deltas}"
+                logger.debug(
+                    f"Uploading {len(delta)} bytes region delta of '{source_path}' "
+                    f"to remote path '{delta_remote_path}'"
+                )
+                self._client.write(delta, delta_remote_path)
+                self._write_region_header(local_path, entry, header_bs)
+                return entry
+
+        # deltas are dropped before the new base is uploaded, so that they can never be
+        # applied on top of it
+        if parent_entry:
+            self._delete_region_deltas(remote_file_path, parent_entry)
+        entry = entry._replace(deltas=0)
+        self._cache_region_header(local_path, entry, source_path)
+        if self._region_lzma:
+            keyframe_path = f"{source_path}.xz"
+            with (
+                open(source_path, "rb") as src_f,
+                lzma.open(keyframe_path, "wb", filters=LZMA_FILTERS) as dst_f,
+            ):
+                shutil.copyfileobj(src_f, dst_f, TRANSFER_BLOCK_SIZE)
+            upload_path = keyframe_path
+        else:
+            upload_path = source_path
+        logger.debug(
+            f"Uploading local file '{upload_path}' to remote path '{remote_file_path}'"
+        )
+        try:
+            self._client.upload(local_path=upload_path, remote_path=remote_file_path)
+        finally:
+            if self._region_lzma:
+                os.remove(upload_path)
+        return entry
+
+    def _delete_region_deltas(self, remote_file_path: str, entry: FileEntry):
+        for n in range(1, entry.deltas + 1):
+            self._client.delete(f"{remote_file_path}.delta.{n}")
+
+    # Headers of pushed regions are cached locally, keyed by the hash the manifest
+    # recorded for them, so that the next push can diff chunk timestamps against the
+    # exact version the remote holds.
+    def _build_region_cache_path(self, local_path: str):
+        # decompressed headers are kept apart, so that switching formats starts every
+        # region over from a full upload
+        if self._region_lzma:
+            return f"{local_path}.regions-lzma"
+        return f"{local_path}.regions"
+
+    def _load_region_header(self, local_path: str, entry: FileEntry) -> bytes | None:
+        cache_file = os.path.join(self._build_region_cache_path(local_path), entry.sha256)
+        if not os.path.exists(cache_file):
+            return None
+        with open(cache_file, "rb") as f:
+            return f.read()
+
+    def _write_region_header(self, local_path: str, entry: FileEntry, header_bs: bytes):
+        cache_path = self._build_region_cache_path(local_path)
+        os.makedirs(cache_path, exist_ok=True)
+        with open(os.path.join(cache_path, entry.sha256), "wb") as f:
+            f.write(header_bs)
+
+    def _cache_region_header(self, local_path: str, entry: FileEntry, local_file_path: str):
+        with open(local_file_path, "rb") as f:
+            header_bs = f.read(MCA_HEADER_SIZE).ljust(MCA_HEADER_SIZE, b"\0")
+        self._write_region_header(local_path, entry, header_bs)
+
+    def _prune_region_headers(self, local_path: str, manifest: Manifest):
+        cache_path = self._build_region_cache_path(local_path)
+        if not os.path.exists(cache_path):
+            return
+        referenced = {entry.sha256 for entry in manifest.files.values()}
+        for name in os.listdir(cache_path):
+            if name not in referenced:
+                os.remove(os.path.join(cache_path, name))
+
+    def _build_manifest_path(self, path: str):
+        return f"{path}.manifest.json"
+
+    def _fetch_remote_manifest(self, remote_path: str) -> Manifest | None:
+        return fetch_manifest(self._client, self._build_manifest_path(remote_path))
+
+    def _publish_manifest(self, manifest: Manifest, local_path: str, remote_path: str):
+        local_manifest_path = self._build_manifest_path(local_path)
+        logger.info(f"Publishing manifest with {len(manifest.files)} files")
+        manifest.dump(local_manifest_path)
+        self._client.upload(
+            local_path=local_manifest_path,
+            remote_path=self._build_manifest_path(remote_path),
+        )
+
     def _build_backup_path(self, origin_path: str):
         backup_path = origin_path + ".backup"
         logger.debug(f"Backup path constructed: {backup_path}")
@@ -195,7 +1101,8 @@ class _SeaweedfsSyncerL2R:
                 logger.error(f"Backup directory already exists at '{backup_path}'")
                 raise Exception("A backup dir exists")
             else:
-                self._client.move(origin_path, backup_path)
+                with BACKUP_SECONDS.time(location="remote", op="move"):
+                    self._client.move(origin_path, backup_path)
                 logger.info("Backup created successfully")
         else:
             logger.warning(
@@ -209,7 +1116,8 @@ class _SeaweedfsSyncerL2R:
             f"Restoring remote path '{origin_path}' from backup '{backup_path}'"
         )
         if self._client.exists(backup_path):
-            self._client.move(backup_path, origin_path)
+            with BACKUP_SECONDS.time(location="remote", op="restore"):
+                self._client.move(backup_path, origin_path)
             logger.info("Restore completed successfully")
         else:
             logger.error(f"No backup directory found at '{backup_path}'")
@@ -218,6 +1126,7 @@ class _SeaweedfsSyncerL2R:
     def _get_local_files(self, local_path: str):
         logger.info(f"Fetching local files from path '{local_path}'")
         for root, dirs, files in os.walk(local_path):
+            prune_work_dirs(root, local_path, dirs)
             for file in files:
                 file_path = os.path.join(root, file)
                 logger.debug(f"Found local file: {file_path}")
@@ -225,118 +1134,679 @@ class _SeaweedfsSyncerL2R:
 
 
 class _SeaweedfsSyncerR2L:
-    def __init__(self, client: SeaweedfsClient):
+    def __init__(
+        self,
+        client: SeaweedfsClient,
+        *,
+        region_codec: int | None = None,
+        pull_codec: int | None = None,
+        workers: int = 1,
+    ):
         self._client = client
+        self._region_codec = region_codec
+        self._pull_codec = pull_codec
+        self._workers = workers
         logger.info("SeaweedfsSyncerR2L initialized with client")
 
-    def sync(self, remote_path: str, local_path: str):
+    def sync(
+        self,
+        remote_path: str,
+        local_path: str,
+        on_ready: Callable[[], None] | None = None,
+    ):
         logger.info(
             f"Starting sync from remote path '{remote_path}' to local path '{local_path}'"
         )
-        self._backup_local(local_path)
+        with SYNC_SECONDS.time(direction="pull"):
+            if on_ready is not None:
+                self._sync_lazy(remote_path, local_path, on_ready)
+            else:
+                self._sync_staged(remote_path, local_path)
+        LAST_SUCCESS.set_to_current_time(operation="pull")
+
+    def _sync_staged(self, remote_path: str, local_path: str):
+        staging_path = self._prepare_local_staging(local_path)
+        index = PullIndex()
         try:
-            os.makedirs(local_path, exist_ok=True)
-            logger.info(f"Created local directory '{local_path}'")
-            for remote_file in self._get_remote_files(remote_path):
-                remote_rel = PurePath(remote_file).relative_to(remote_path)
-                local_file = PurePath(local_path) / remote_rel
-                local_dir = local_file.parent
-                os.makedirs(str(local_dir), exist_ok=True)
-                logger.debug(
-                    f"Downloading remote file '{remote_file}' to local file '{local_file}'"
-                )
-                self._client.download(remote_file, str(local_file))
-            self._delete_local_backup(local_path)
-            logger.info("Sync completed successfully")
+            groups = self._group_remote_files(
+                remote_path, self._get_remote_files(remote_path)
+            )
+            entries = self._link_unchanged_files(
+                remote_path, local_path, staging_path, groups
+            )
+            self._expand_packs(
+                groups, self._pull_files(entries, remote_path, staging_path)
+            )
+            self._index_pulled_files(index, staging_path, groups, groups)
         except Exception as e:
             logger.error(f"Sync failed with exception: {e}")
-            self._restore_local(local_path)
+            shutil.rmtree(staging_path, ignore_errors=True)
             raise
+        self._swap_local(local_path, staging_path)
+        index.dump(self._build_pull_index_path(local_path))
+        logger.info("Sync completed successfully")
 
-    def _get_remote_files(self, remote_path: str):
-        logger.info(f"Fetching remote files from path '{remote_path}'")
+    def _sync_lazy(
+        self, remote_path: str, local_path: str, on_ready: Callable[[], None]
+    ):
+        # Everything but the region files, and the regions around the spawn of each
+        # world, is pulled first. `on_ready` is then called so that the game can start,
+        # while the other regions keep streaming in, most recently pushed first. Once
+        # the game runs the previous local files cannot be restored anymore.
+        staging_path = self._prepare_local_staging(local_path)
+        index = PullIndex()
         try:
-            list_result = self._client.list(remote_path)
-            for entry in list_result.get("Entries", []):
-                child_path = entry["FullPath"]
-                is_file = "chunks" in entry
-                if is_file:
-                    logger.debug(f"Found remote file: {child_path}")
-                    yield child_path
+            groups = self._group_remote_files(
+                remote_path, self._get_remote_files(remote_path)
+            )
+            entries = self._link_unchanged_files(
+                remote_path, local_path, staging_path, groups
+            )
+            regions: dict[str, list[RemoteEntry]] = {}
+            critical = []
+            for entry in entries:
+                rel = self._get_local_rel(entry, remote_path)
+                if is_region_file(rel.replace(os.sep, "/")):
+                    regions.setdefault(rel, []).append(entry)
                 else:
-                    logger.debug(f"Found remote directory: {child_path}")
-                    yield from self._get_remote_files(child_path)
-        except NotFound:
-            if self._client.exists(remote_path):
-                logger.warning(
-                    f"Remote path '{remote_path}' exists but is not a directory"
+                    critical.append(entry)
+            logger.info(
+                f"Pulling {len(critical)} files before the game starts, "
+                f"{len(regions)} regions are deferred"
+            )
+            self._expand_packs(
+                groups, self._pull_files(critical, remote_path, staging_path)
+            )
+            spawns = self._read_spawns(staging_path)
+            spawn_entries = []
+            deferred = []
+            for region_rel, region_entries in regions.items():
+                distance = self._get_spawn_distance(region_rel, spawns)
+                if distance <= SPAWN_REGION_RADIUS:
+                    spawn_entries.extend(region_entries)
+                else:
+                    deferred.append((region_rel, distance, region_entries))
+            logger.info(f"Pulling {len(regions) - len(deferred)} regions around the spawn")
+            self._pull_files(spawn_entries, remote_path, staging_path)
+            deferred_rels = {region_rel.replace(os.sep, "/") for region_rel, _, _ in deferred}
+            self._index_pulled_files(
+                index,
+                staging_path,
+                groups,
+                [rel for rel in groups if rel not in deferred_rels],
+            )
+        except Exception as e:
+            logger.error(f"Sync failed with exception: {e}")
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+        self._swap_local(local_path, staging_path)
+        index_path = self._build_pull_index_path(local_path)
+        index.dump(index_path)
+        logger.info(f"Local path '{local_path}' is ready, streaming the other regions")
+        on_ready()
+
+        # Regions written in a push land within the same minute, those are then
+        # ordered by their distance to the spawn.
+        deferred.sort(
+            key=lambda item: (
+                -max(int(entry.mtime) // 60 for entry in item[2]),
+                item[1],
+            )
+        )
+        staging_path = self._prepare_local_staging(local_path)
+        conflicts_path = self._build_local_conflicts_path(local_path)
+        conflicts = []
+        batch_size = LAZY_PULL_BATCH_SIZE * max(self._workers, 1)
+        try:
+            for start in range(0, len(deferred), batch_size):
+                batch = deferred[start : start + batch_size]
+                self._pull_files(
+                    [entry for _, _, region_entries in batch for entry in region_entries],
+                    remote_path,
+                    staging_path,
+                )
+                for region_rel, _, _ in batch:
+                    # indexed before the game can write to it
+                    rel = region_rel.replace(os.sep, "/")
+                    self._index_pulled_files(index, staging_path, groups, [rel])
+                    if not self._place_file(
+                        os.path.join(staging_path, region_rel),
+                        os.path.join(local_path, region_rel),
+                        os.path.join(conflicts_path, region_rel),
+                    ):
+                        index.files.pop(rel, None)
+                        conflicts.append(rel)
+                logger.info(
+                    f"Pulled {min(start + batch_size, len(deferred))}/{len(deferred)} "
+                    "deferred regions"
                 )
-                yield remote_path
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            index.dump(index_path)
+        if conflicts:
+            raise PullConflictError(conflicts, conflicts_path)
+        logger.info("Sync completed successfully")
+
+    def _pull_files(
+        self, entries: list[RemoteEntry], remote_path: str, local_path: str
+    ) -> dict[str, list[str]]:
+        # returns the files unpacked from every pack pulled
+        run_transfers(
+            (
+                partial(self._download_file, entry.path, remote_path, local_path)
+                for entry in entries
+            ),
+            self._workers,
+        )
+        keyframes = self._apply_region_deltas(local_path)
+        rels = [self._get_local_rel(entry, remote_path) for entry in entries]
+        region_rels = {rel for rel in rels if is_region_file(rel.replace(os.sep, "/"))}
+        self._encode_regions(local_path, sorted(region_rels), keyframes)
+        return {
+            rel.replace(os.sep, "/"): self._extract_pack(local_path, rel)
+            for rel in rels
+            if is_pack_file(rel)
+        }
+
+    def _extract_pack(self, local_path: str, rel: str) -> list[str]:
+        pack_file = os.path.join(local_path, rel)
+        names = extract_pack(pack_file, os.path.dirname(pack_file))
+        os.remove(pack_file)
+        logger.debug(f"Unpacked {len(names)} files from '{pack_file}'")
+        rel_dir = os.path.dirname(rel).replace(os.sep, "/")
+        return [f"{rel_dir}/{name}" if rel_dir else name for name in names]
+
+    def _expand_packs(
+        self, groups: dict[str, list[RemoteEntry]], members: dict[str, list[str]]
+    ):
+        # the files of a pack are made from its remote entry, in place of the pack
+        for pack, rels in members.items():
+            group = groups.pop(pack)
+            for rel in rels:
+                groups[rel] = group
+
+    def _get_local_rel(self, entry: RemoteEntry, remote_path: str) -> str:
+        # the local file a remote entry is pulled into, the region for its deltas
+        rel = str(PurePath(entry.path).relative_to(remote_path))
+        m = REGION_DELTA_PATTERN.match(rel)
+        return m[1] if m else rel
+
+    def _group_remote_files(
+        self, remote_path: str, entries: list[RemoteEntry]
+    ) -> dict[str, list[RemoteEntry]]:
+        # remote entries by the local file they are pulled into, a region with its deltas
+        groups: dict[str, list[RemoteEntry]] = {}
+        for entry in entries:
+            rel = self._get_local_rel(entry, remote_path).replace(os.sep, "/")
+            groups.setdefault(rel, []).append(entry)
+        return groups
+
+    def _get_remote_signature(self, group: list[RemoteEntry]) -> list[tuple[str, int, str]]:
+        return sorted(
+            (entry.path, entry.size, entry.etag or repr(entry.mtime)) for entry in group
+        )
+
+    def _link_unchanged_files(
+        self,
+        remote_path: str,
+        local_path: str,
+        staging_path: str,
+        groups: dict[str, list[RemoteEntry]],
+    ) -> list[RemoteEntry]:
+        # Local files that still hold what the remote does are hardlinked into the
+        # staging directory, and only the entries of the others are left to download.
+        index = PullIndex.load(self._build_pull_index_path(local_path))
+        remote_manifest = fetch_manifest(self._client, self._build_manifest_path(remote_path))
+        cache = Manifest.load(self._build_manifest_path(local_path))
+        entries = []
+        linked = 0
+        linked_packs = {}
+        unpacked = self._get_unpacked_files(index)
+        for rel, group in groups.items():
+            local_file = os.path.join(local_path, rel)
+            if is_pack_file(rel):
+                # the files of a pack are reused together or pulled again together
+                members = self._get_unchanged_pack_files(local_path, group, unpacked)
+                if members and all(
+                    self._link_local_file(
+                        os.path.join(local_path, member), staging_path, member
+                    )
+                    for member in members
+                ):
+                    linked_packs[rel] = members
+                    linked += len(members)
+                else:
+                    entries.extend(group)
+            elif self._is_unchanged_file(
+                local_file, rel, group, index, remote_manifest, cache
+            ) and self._link_local_file(local_file, staging_path, rel):
+                linked += 1
             else:
-                logger.error(f"Remote path '{remote_path}' not found")
-                raise FileNotFoundError(f"Remote path '{remote_path}' not found")
+                entries.extend(group)
+        self._expand_packs(groups, linked_packs)
+        logger.info(
+            f"Reusing {linked} unchanged local files, pulling {len(entries)} remote files"
+        )
+        FILES_SKIPPED.inc(linked, direction="pull")
+        return entries
+
+    def _get_unpacked_files(
+        self, index: PullIndex | None
+    ) -> dict[tuple[tuple[str, int, str], ...], dict[str, PulledFile]]:
+        # files the last pull unpacked, by the remote entry of their pack
+        unpacked: dict[tuple[tuple[str, int, str], ...], dict[str, PulledFile]] = {}
+        for rel, pulled in index.files.items() if index else ():
+            if len(pulled.remote) == 1 and is_pack_file(pulled.remote[0][0]):
+                unpacked.setdefault(tuple(pulled.remote), {})[rel] = pulled
+        return unpacked
+
+    def _get_unchanged_pack_files(
+        self,
+        local_path: str,
+        group: list[RemoteEntry],
+        unpacked: dict[tuple[tuple[str, int, str], ...], dict[str, PulledFile]],
+    ) -> list[str] | None:
+        # the files the last pull unpacked from the same pack, if all are left as they
+        # were since
+        members = unpacked.get(tuple(self._get_remote_signature(group)))
+        if not members:
+            return None
+        for rel, pulled in members.items():
+            try:
+                st = os.stat(os.path.join(local_path, rel))
+            except FileNotFoundError:
+                return None
+            if (pulled.inode, pulled.size, pulled.mtime_ns) != (
+                st.st_ino,
+                st.st_size,
+                st.st_mtime_ns,
+            ):
+                return None
+        return list(members)
+
+    def _link_unchanged_file(
+        self,
+        local_path: str,
+        staging_path: str,
+        rel: str,
+        entry: FileEntry,
+        cache: Manifest | None,
+    ) -> bool:
+        local_file = os.path.join(local_path, rel)
+        try:
+            st = os.stat(local_file)
+        except FileNotFoundError:
+            return False
+        if not self._is_pushed_file(local_file, st, rel, entry, cache):
+            return False
+        return self._link_local_file(local_file, staging_path, rel)
+
+    def _link_local_file(self, local_file: str, staging_path: str, rel: str) -> bool:
+        staged_file = os.path.join(staging_path, rel)
+        os.makedirs(os.path.dirname(staged_file), exist_ok=True)
+        try:
+            os.link(local_file, staged_file)
+        except OSError as e:
+            logger.debug(f"Cannot hardlink '{local_file}', downloading it instead: {e}")
+            return False
+        return True
+
+    def _is_pushed_file(
+        self,
+        local_file: str,
+        st: os.stat_result,
+        rel: str,
+        entry: FileEntry,
+        cache: Manifest | None,
+    ) -> bool:
+        # holds what was pushed as `entry`, going by the hash of the manifest cache
+        # when the file is unchanged since it was taken
+        if st.st_size != entry.size:
+            return False
+        cached = cache.files.get(rel) if cache else None
+        if cached and (cached.size, cached.mtime_ns) == (st.st_size, st.st_mtime_ns):
+            return cached.sha256 == entry.sha256
+        return hash_file(local_file) == entry.sha256
+
+    def _is_unchanged_file(
+        self,
+        local_file: str,
+        rel: str,
+        group: list[RemoteEntry],
+        index: PullIndex | None,
+        remote_manifest: Manifest | None,
+        cache: Manifest | None,
+    ) -> bool:
+        try:
+            st = os.stat(local_file)
+        except FileNotFoundError:
+            return False
+        # left as it was by a pull of the same remote entries, which also covers the
+        # regions rebuilt from deltas or re-encoded on pull
+        pulled = index.files.get(rel) if index else None
+        if (
+            pulled
+            and (pulled.inode, pulled.size, pulled.mtime_ns)
+            == (st.st_ino, st.st_size, st.st_mtime_ns)
+            and pulled.remote == self._get_remote_signature(group)
+        ):
+            return True
+        # the remote manifest has the hash of every file as it was pushed
+        entry = remote_manifest.files.get(rel) if remote_manifest else None
+        if entry is not None:
+            return self._is_pushed_file(local_file, st, rel, entry, cache)
+        # without one, a file pulled as it is stored is compared with its filer md5
+        if len(group) != 1 or not self._is_pulled_as_stored(rel):
+            return False
+        remote = group[0]
+        if st.st_size != remote.size or not MD5_PATTERN.fullmatch(remote.etag):
+            return False
+        return hash_file(local_file, "md5") == remote.etag
+
+    def _is_pulled_as_stored(self, rel: str) -> bool:
+        if not is_region_file(rel):
+            return True
+        return self._pull_codec is None and self._region_codec in (None, 2)
+
+    def _index_pulled_files(
+        self,
+        index: PullIndex,
+        path: str,
+        groups: dict[str, list[RemoteEntry]],
+        rels: Iterable[str],
+    ):
+        for rel in rels:
+            try:
+                st = os.stat(os.path.join(path, rel))
+            except FileNotFoundError:
+                continue
+            index.files[rel] = PulledFile(
+                st.st_ino,
+                st.st_size,
+                st.st_mtime_ns,
+                self._get_remote_signature(groups[rel]),
+            )
+
+    def _place_file(self, staged_file: str, local_file: str, conflict_file: str) -> bool:
+        # The game may already have created the region, if a player got there before
+        # it was pulled. Its file is open and in use, so it is kept as is, and the
+        # pulled one is moved to `conflict_file` to be merged by hand. Unlike a rename,
+        # a link never replaces an existing file.
+        os.makedirs(os.path.dirname(local_file), exist_ok=True)
+        try:
+            os.link(staged_file, local_file)
+        except FileExistsError:
+            logger.error(
+                f"Region '{local_file}' was created by the game before it was pulled, "
+                f"keeping the game's version and the remote one in '{conflict_file}'"
+            )
+            os.makedirs(os.path.dirname(conflict_file), exist_ok=True)
+            os.replace(staged_file, conflict_file)
+            return False
+        os.remove(staged_file)
+        return True
+
+    def _read_spawns(self, local_path: str) -> dict[str, tuple[int, int]]:
+        # spawn region of every world under the local path, keyed by the world directory
+        spawns = {}
+        for root, dirs, files in os.walk(local_path):
+            if "level.dat" not in files:
+                continue
+            rel_root = os.path.relpath(root, local_path)
+            try:
+                with open(os.path.join(root, "level.dat"), "rb") as f:
+                    data = nbt.load(f)["Data"]
+                spawns[rel_root] = (data["SpawnX"] >> 9, data["SpawnZ"] >> 9)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Cannot read the spawn of world '{rel_root}': {e}")
+                spawns[rel_root] = (0, 0)
+        return spawns
+
+    def _get_spawn_distance(
+        self, region_rel: str, spawns: dict[str, tuple[int, int]]
+    ) -> int:
+        m = REGION_COORDS_PATTERN.match(os.path.basename(region_rel))
+        if not m:
+            return 0
+        # the spawn of the innermost world holding the region
+        spawn_x, spawn_z = (0, 0)
+        world_prefix = ""
+        for rel_root, spawn in spawns.items():
+            prefix = "" if rel_root == "." else rel_root + os.sep
+            if region_rel.startswith(prefix) and len(prefix) >= len(world_prefix):
+                world_prefix = prefix
+                spawn_x, spawn_z = spawn
+        return max(abs(int(m[1]) - spawn_x), abs(int(m[2]) - spawn_z))
+
+    def _download_file(self, remote_file: str, remote_path: str, local_path: str):
+        remote_rel = PurePath(remote_file).relative_to(remote_path)
+        local_file = PurePath(local_path) / remote_rel
+        local_dir = local_file.parent
+        os.makedirs(str(local_dir), exist_ok=True)
+        logger.debug(
+            f"Downloading remote file '{remote_file}' to local file '{local_file}'"
+        )
+        self._client.download(remote_file, str(local_file))
+
+    def _get_remote_files(self, remote_path: str) -> list[RemoteEntry]:
+        logger.info(f"Fetching remote files from path '{remote_path}'")
+        try:
+            return self._client.walk(remote_path, workers=self._workers)
+        except NotFound:
+            logger.error(f"Remote path '{remote_path}' not found")
+            raise FileNotFoundError(f"Remote path '{remote_path}' not found")
+
+    def _apply_region_deltas(self, local_path: str) -> list[str]:
+        chains: dict[str, list[tuple[int, str]]] = {}
+        for root, dirs, files in os.walk(local_path):
+            for file in files:
+                m = REGION_DELTA_PATTERN.match(file)
+                if m:
+                    region_file = os.path.join(root, m[1])
+                    chains.setdefault(region_file, []).append(
+                        (int(m[2]), os.path.join(root, file))
+                    )
+                elif file.endswith(".mca"):
+                    chains.setdefault(os.path.join(root, file), [])
+        keyframes = []
+        for region_file, deltas in chains.items():
+            tmp_file = f"{region_file}.tmp"
+            if _is_lzma_file(region_file):
+                # keyframes hold the decompressed region, the deltas apply to that
+                with lzma.open(region_file, "rb") as src_f, open(tmp_file, "wb") as dst_f:
+                    shutil.copyfileobj(src_f, dst_f, TRANSFER_BLOCK_SIZE)
+                os.replace(tmp_file, region_file)
+                keyframes.append(os.path.relpath(region_file, local_path))
+            if not deltas:
+                continue
+            deltas.sort()
+            if [n for n, _ in deltas] != list(range(1, len(deltas) + 1)):
+                raise Exception(f"Incomplete delta chain for region '{region_file}'")
+            logger.info(f"Applying {len(deltas)} deltas to region '{region_file}'")
+            for _, delta_file in deltas:
+                with open(delta_file, "rb") as delta_f:
+                    delta = delta_f.read()
+                if delta.startswith(LZMA_MAGIC):
+                    delta = lzma.decompress(delta)
+                with (
+                    open(region_file, "rb") as base_f,
+                    open(tmp_file, "wb") as mca_f,
+                ):
+                    apply_delta(base_f, delta, mca_f)
+                os.replace(tmp_file, region_file)
+                os.remove(delta_file)
+        return keyframes
+
+    def _encode_regions(self, local_path: str, rels: list[str], keyframes: list[str]):
+        # regions stored transcoded are handed back to the game as zlib, or as the
+        # codec asked for on pull
+        if self._pull_codec is not None:
+            logger.info(f"Encoding pulled regions with compression type {self._pull_codec}")
+            transcode_in_place(local_path, self._pull_codec, rels=rels)
+        elif self._region_codec not in (None, 2):
+            transcode_in_place(local_path, 2, rels=rels)
+        elif keyframes:
+            logger.info(f"Compressing {len(keyframes)} reconstructed regions")
+            transcode_in_place(local_path, 2, rels=keyframes)
+
+    def _build_manifest_path(self, path: str):
+        return f"{path}.manifest.json"
+
+    def _build_pull_index_path(self, path: str):
+        return f"{path}.pull-index.json"
+
+    # Files are pulled into a staging directory, then swapped in by renaming the
+    # entries of the local path, see `migrater.workdirs`.
+    def _build_local_staging_path(self, path: str):
+        return build_work_path(path, "staging")
 
     def _build_local_backup_path(self, path: str):
-        return f"{path}.backup"
+        return build_work_path(path, "backup")
 
-    def _backup_local(self, local_path: str):
-        backup_path = self._build_local_backup_path(local_path)
-        logger.info(f"Backing up local path '{local_path}' to '{backup_path}'")
-        if os.path.exists(local_path):
-            if os.path.exists(backup_path):
-                logger.warning(f"Removing existing backup path '{backup_path}'")
-                shutil.rmtree(backup_path)
-            shutil.copytree(local_path, backup_path)
+    def _build_local_conflicts_path(self, path: str):
+        return build_work_path(path, "conflicts")
 
-            def rmtree_onexc(func, path, err):
-                logger.warning(f"An error occured when remove {path}: {err}")
-                if path == local_path:
-                    pass
-                else:
-                    raise err
+    def _list_local(self, local_path: str) -> list[str]:
+        return [name for name in os.listdir(local_path) if name not in WORK_DIRS]
 
-            shutil.rmtree(local_path, onexc=rmtree_onexc)
-            logger.info("Backup completed successfully")
+    def _prepare_local_staging(self, local_path: str) -> str:
+        os.makedirs(local_path, exist_ok=True)
+        staging_path = self._build_local_staging_path(local_path)
+        if os.path.exists(staging_path):
+            logger.warning(f"Removing existing staging path '{staging_path}'")
+            shutil.rmtree(staging_path)
+        os.makedirs(staging_path)
+        return staging_path
+
+    def _swap_local(self, local_path: str, staging_path: str):
+        # the previous local files are kept in the backup until the pulled ones are
+        # all in place, and moved back if that fails
+        backup_path = self._build_local_backup_path(local_path)
+        logger.info(f"Swapping '{staging_path}' into local path '{local_path}'")
+        if os.path.exists(backup_path):
+            logger.warning(f"Removing existing backup path '{backup_path}'")
+            shutil.rmtree(backup_path)
+        os.makedirs(backup_path)
+        try:
+            with BACKUP_SECONDS.time(location="local", op="move"):
+                for name in self._list_local(local_path):
+                    os.rename(
+                        os.path.join(local_path, name), os.path.join(backup_path, name)
+                    )
+                for name in os.listdir(staging_path):
+                    os.rename(
+                        os.path.join(staging_path, name), os.path.join(local_path, name)
+                    )
+        except Exception as e:
+            logger.error(f"Swap failed with exception: {e}")
+            self._restore_local(local_path)
+            raise
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+        self._delete_local_backup(local_path)
 
     def _restore_local(self, local_path: str):
         backup_path = self._build_local_backup_path(local_path)
         logger.info(f"Restoring local path '{local_path}' from backup '{backup_path}'")
-        if os.path.exists(backup_path):
-            if os.path.exists(local_path):
-                logger.warning(
-                    f"Removing existing local path '{local_path}' before restore"
-                )
-                shutil.rmtree(local_path)
-            shutil.copytree(backup_path, local_path)
-            logger.info("Restore completed successfully")
-        else:
+        if not os.path.exists(backup_path):
             logger.error(f"No local backup found at '{backup_path}'")
             raise FileNotFoundError("No local backup to restore")
+        with BACKUP_SECONDS.time(location="local", op="restore"):
+            for name in self._list_local(local_path):
+                path = os.path.join(local_path, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            for name in os.listdir(backup_path):
+                os.rename(os.path.join(backup_path, name), os.path.join(local_path, name))
+            os.rmdir(backup_path)
+        logger.info("Restore completed successfully")
 
     def _delete_local_backup(self, local_path: str):
         backup_path = self._build_local_backup_path(local_path)
         logger.info(f"Deleting local backup at '{backup_path}'")
         if os.path.exists(backup_path):
-            shutil.rmtree(backup_path)
+            with BACKUP_SECONDS.time(location="local", op="delete"):
+                shutil.rmtree(backup_path)
             logger.info("Backup deleted successfully")
 
 
 class SeaweedfsSyncer:
-    def __init__(self, client: SeaweedfsClient):
+    def __init__(
+        self,
+        client: SeaweedfsClient,
+        *,
+        incremental: bool = False,
+        region_delta: bool = False,
+        keyframe_interval: int = 17,
+        region_lzma: bool = False,
+        region_codec: int | None = None,
+        pull_codec: int | None = None,
+        pack_small_files: bool = False,
+        workers: int = 1,
+    ):
         self._client = client
+        self._incremental = incremental
+        self._region_delta = region_delta
+        self._keyframe_interval = keyframe_interval
+        self._region_lzma = region_lzma
+        self._region_codec = region_codec
+        self._pull_codec = pull_codec
+        self._pack_small_files = pack_small_files
+        self._workers = workers
 
     @classmethod
-    def from_url(cls, base_url: str):
-        client = SeaweedfsClient(base_url)
-        return cls(client)
+    def from_url(
+        cls,
+        base_url: str,
+        *,
+        pool_size: int = 16,
+        read_timeout: float = 60,
+        retries: int = 3,
+        rate_limit: float | None = None,
+        adaptive_rate: bool = False,
+        **kwargs,
+    ):
+        client = SeaweedfsClient(
+            base_url,
+            pool_size=pool_size,
+            read_timeout=read_timeout,
+            retries=retries,
+            rate_limit=rate_limit,
+            adaptive_rate=adaptive_rate,
+        )
+        return cls(client, **kwargs)
 
-    def local2remote(self, local_path: str, remote_path: str):
-        l2r = _SeaweedfsSyncerL2R(self._client)
-        l2r.sync(local_path, remote_path)
+    def local2remote(
+        self, local_path: str, remote_path: str, changes: set[str] | None = None
+    ):
+        l2r = _SeaweedfsSyncerL2R(
+            self._client,
+            incremental=self._incremental,
+            region_delta=self._region_delta,
+            # every region upload after a keyframe is a delta until the next keyframe
+            max_region_deltas=self._keyframe_interval - 1,
+            region_lzma=self._region_lzma,
+            region_codec=self._region_codec,
+            pack_small_files=self._pack_small_files,
+            workers=self._workers,
+        )
+        l2r.sync(local_path, remote_path, changes)
 
-    def remote2local(self, remote_path: str, local_path: str):
-        r2l = _SeaweedfsSyncerR2L(self._client)
-        r2l.sync(remote_path, local_path)
+    def remote2local(
+        self,
+        remote_path: str,
+        local_path: str,
+        on_ready: Callable[[], None] | None = None,
+    ):
+        r2l = _SeaweedfsSyncerR2L(
+            self._client,
+            region_codec=self._region_codec,
+            pull_codec=self._pull_codec,
+            workers=self._workers,
+        )
+        r2l.sync(remote_path, local_path, on_ready)
 
 
 if __name__ == "__main__":
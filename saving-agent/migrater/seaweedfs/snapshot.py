@@ -0,0 +1,381 @@
+from functools import partial
+from pathlib import PurePath
+import hashlib
+from time import gmtime, strftime
+from typing import Callable
+from uuid import uuid4
+import os
+import shutil
+
+from loguru import logger
+
+from migrater.base import Migrater
+from migrater.chunking import split_file
+from migrater.manifest import FileEntry, Manifest
+from migrater.metrics import FILES_SKIPPED, LAST_SUCCESS, SYNC_SECONDS
+from .api import NotFound, SeaweedfsClient, _SeaweedfsSyncerR2L, run_transfers
+
+# Remote layout under `remote_path`:
+#
+#   objects/<sha256[:2]>/<sha256>   file contents, or content-defined pieces of them
+#                                   in dedup mode, immutable and content-addressed
+#   snapshots/<snapshot_id>.json    manifest of one save
+#   HEAD                            id of the current snapshot
+#
+# A push only uploads objects the current snapshot does not already reference, then
+# its manifest, and publishes it by rewriting HEAD as the very last step. Until then
+# readers keep seeing the previous snapshot in full.
+
+# pushes of a running agent between sweeps of all objects, see `collect_garbage`
+GC_SWEEP_INTERVAL = 50
+
+
+class SnapshotStore:
+    def __init__(self, client: SeaweedfsClient, remote_path: str):
+        self._client = client
+        self._remote_path = remote_path
+
+    def build_object_path(self, sha256: str):
+        return f"{self._remote_path}/objects/{sha256[:2]}/{sha256}"
+
+    def _build_snapshots_path(self):
+        return f"{self._remote_path}/snapshots"
+
+    def _build_snapshot_path(self, snapshot_id: str):
+        return f"{self._build_snapshots_path()}/{snapshot_id}.json"
+
+    def _build_head_path(self):
+        return f"{self._remote_path}/HEAD"
+
+    def read_head(self) -> str | None:
+        try:
+            return self._client.read(self._build_head_path()).decode().strip()
+        except NotFound:
+            return None
+
+    def read_snapshot(self, snapshot_id: str) -> Manifest:
+        return Manifest.loads(self._client.read(self._build_snapshot_path(snapshot_id)))
+
+    def write_snapshot(self, manifest: Manifest) -> str:
+        snapshot_id = f"{strftime('%Y%m%dT%H%M%SZ', gmtime())}-{uuid4().hex[:8]}"
+        logger.info(f"Writing snapshot '{snapshot_id}' with {len(manifest.files)} files")
+        self._client.write(
+            manifest.dumps().encode(), self._build_snapshot_path(snapshot_id)
+        )
+        return snapshot_id
+
+    def publish(self, snapshot_id: str):
+        logger.info(f"Publishing snapshot '{snapshot_id}'")
+        self._client.write(snapshot_id.encode(), self._build_head_path())
+
+    def list_snapshots(self) -> list[str]:
+        try:
+            entries = self._client.walk(self._build_snapshots_path())
+        except NotFound:
+            return []
+        return sorted(
+            PurePath(entry.path).stem
+            for entry in entries
+            if entry.path.endswith(".json")
+        )
+
+    def collect_garbage(self, keep: int, workers: int = 1, sweep: bool = False):
+        # Objects of expired snapshots that no kept one references are deleted. That
+        # misses objects no snapshot ever referenced, such as those of a push that
+        # failed before publishing; `sweep` lists all objects to find those too.
+        head = self.read_head()
+        snapshot_ids = self.list_snapshots()
+        kept = set(snapshot_ids[-keep:]) if keep > 0 else set()
+        if head:
+            kept.add(head)
+        expired = [snapshot_id for snapshot_id in snapshot_ids if snapshot_id not in kept]
+        if not expired and not sweep:
+            return
+        logger.info(f"Expiring {len(expired)} snapshots, keeping {len(kept)}")
+        candidates: set[str] = set()
+        for snapshot_id in expired:
+            for entry in self.read_snapshot(snapshot_id).files.values():
+                candidates.update(sha256 for sha256, _ in entry.pieces())
+        for snapshot_id in expired:
+            self._client.delete(self._build_snapshot_path(snapshot_id))
+
+        referenced: set[str] = set()
+        for snapshot_id in kept:
+            for entry in self.read_snapshot(snapshot_id).files.values():
+                referenced.update(sha256 for sha256, _ in entry.pieces())
+        if sweep:
+            logger.info("Sweeping all objects for unreferenced ones")
+            try:
+                objects = self._client.walk(f"{self._remote_path}/objects", workers=workers)
+            except NotFound:
+                objects = []
+            candidates.update(PurePath(entry.path).name for entry in objects)
+        unreferenced = sorted(candidates - referenced)
+        logger.info(f"Deleting {len(unreferenced)} unreferenced objects")
+        run_transfers(
+            (
+                partial(self._client.delete, self.build_object_path(sha256))
+                for sha256 in unreferenced
+            ),
+            workers,
+        )
+
+
+class _SnapshotSyncerR2L(_SeaweedfsSyncerR2L):
+    def __init__(
+        self,
+        client: SeaweedfsClient,
+        *,
+        workers: int = 1,
+        cache: Manifest | None = None,
+    ):
+        super().__init__(client, workers=workers)
+        self._cache = cache
+
+    def sync(self, remote_path: str, local_path: str):
+        logger.info(
+            f"Starting snapshot pull from remote path '{remote_path}' to local path '{local_path}'"
+        )
+        with SYNC_SECONDS.time(direction="pull"):
+            self._sync_snapshot(remote_path, local_path)
+        LAST_SUCCESS.set_to_current_time(operation="pull")
+
+    def _sync_snapshot(self, remote_path: str, local_path: str):
+        store = SnapshotStore(self._client, remote_path)
+        snapshot_id = store.read_head()
+        if snapshot_id is None:
+            logger.error(f"No snapshot published under '{remote_path}'")
+            raise FileNotFoundError(f"No snapshot published under '{remote_path}'")
+        manifest = store.read_snapshot(snapshot_id)
+        logger.info(f"Pulling snapshot '{snapshot_id}' with {len(manifest.files)} files")
+        # pieces the previous local copy holds are read from it instead of being
+        # downloaded again, and files it holds unchanged are linked as they are
+        local_pieces = self._index_local_pieces(local_path)
+        staging_path = self._prepare_local_staging(local_path)
+        try:
+            run_transfers(
+                (
+                    partial(
+                        self._download_entry,
+                        store,
+                        rel,
+                        entry,
+                        local_path,
+                        staging_path,
+                        local_pieces,
+                    )
+                    for rel, entry in manifest.files.items()
+                ),
+                self._workers,
+            )
+        except Exception as e:
+            logger.error(f"Sync failed with exception: {e}")
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+        self._swap_local(local_path, staging_path)
+        self._dump_local_manifest(manifest, local_path)
+        logger.info("Sync completed successfully")
+
+    def _dump_local_manifest(self, manifest: Manifest, local_path: str):
+        # the hashes and pieces of the pulled files, with the size and mtime they have
+        # here, let the next push and pull reuse them without hashing the files again
+        local_manifest = Manifest()
+        for rel, entry in manifest.files.items():
+            try:
+                st = os.stat(os.path.join(local_path, rel))
+            except FileNotFoundError:
+                continue
+            local_manifest.files[rel] = entry._replace(
+                size=st.st_size, mtime_ns=st.st_mtime_ns
+            )
+        local_manifest.dump(self._build_manifest_path(local_path))
+
+    def _index_local_pieces(self, local_path: str) -> dict[str, tuple[str, int, int]]:
+        local_pieces = {}
+        if self._cache is None or not os.path.exists(local_path):
+            return local_pieces
+        for rel, entry in self._cache.files.items():
+            offset = 0
+            for sha256, size in entry.pieces():
+                local_pieces[sha256] = (os.path.join(local_path, rel), offset, size)
+                offset += size
+        return local_pieces
+
+    def _read_local_piece(
+        self, local_pieces: dict[str, tuple[str, int, int]], sha256: str
+    ) -> bytes | None:
+        if sha256 not in local_pieces:
+            return None
+        path, offset, size = local_pieces[sha256]
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read(size)
+        except OSError:
+            return None
+        # the cache may be stale, only trust bytes that still hash to the piece
+        if hashlib.sha256(data).hexdigest() != sha256:
+            return None
+        return data
+
+    def _download_entry(
+        self,
+        store: SnapshotStore,
+        rel: str,
+        entry: FileEntry,
+        local_path: str,
+        staging_path: str,
+        local_pieces: dict[str, tuple[str, int, int]],
+    ):
+        if self._link_unchanged_file(local_path, staging_path, rel, entry, self._cache):
+            FILES_SKIPPED.inc(direction="pull")
+            return
+        local_file = os.path.join(staging_path, rel)
+        os.makedirs(os.path.dirname(local_file), exist_ok=True)
+        pieces = entry.pieces()
+        if len(pieces) == 1 and pieces[0][0] not in local_pieces:
+            object_path = store.build_object_path(pieces[0][0])
+            logger.debug(f"Downloading object '{object_path}' to local file '{local_file}'")
+            self._client.download(object_path, local_file)
+            return
+        logger.debug(f"Assembling {len(pieces)} pieces into local file '{local_file}'")
+        part_path = f"{local_file}.part"
+        with open(part_path, "wb") as f:
+            for sha256, _ in pieces:
+                data = self._read_local_piece(local_pieces, sha256)
+                if data is None:
+                    data = self._client.read(store.build_object_path(sha256))
+                f.write(data)
+        os.replace(part_path, local_file)
+
+
+class SnapshotMigrater(Migrater):
+    def __init__(
+        self,
+        local_path: str,
+        remote_path: str,
+        filer_url: str,
+        *,
+        keep: int = 5,
+        chunking: bool = False,
+        workers: int = 1,
+        pool_size: int = 16,
+        read_timeout: float = 60,
+        retries: int = 3,
+        rate_limit: float | None = None,
+        adaptive_rate: bool = False,
+    ):
+        self._local_path = local_path
+        self._remote_path = remote_path
+        self._keep = keep
+        self._chunking = chunking
+        self._workers = workers
+        self._client = SeaweedfsClient(
+            filer_url,
+            pool_size=pool_size,
+            read_timeout=read_timeout,
+            retries=retries,
+            rate_limit=rate_limit,
+            adaptive_rate=adaptive_rate,
+        )
+        self._store = SnapshotStore(self._client, remote_path)
+        self._pushes = 0
+
+    def _build_manifest_path(self, local_path: str):
+        return f"{local_path}.manifest.json"
+
+    def _upload_object(
+        self, local_path: str, sha256: str, rel: str, offset: int, size: int
+    ):
+        local_file = os.path.join(local_path, rel)
+        object_path = self._store.build_object_path(sha256)
+        if offset == 0 and size == os.path.getsize(local_file):
+            # checked while streaming, like pieces are below, so that an object never
+            # holds other bytes than its name says
+            self._client.upload(
+                local_path=local_file, remote_path=object_path, sha256=sha256
+            )
+            return
+        with open(local_file, "rb") as f:
+            f.seek(offset)
+            data = f.read(size)
+        if hashlib.sha256(data).hexdigest() != sha256:
+            raise Exception(f"Local file '{local_file}' changed while being pushed")
+        self._client.write(data, object_path)
+
+    def pull(self, on_ready: Callable[[], None] | None = None):
+        r2l = _SnapshotSyncerR2L(
+            self._client,
+            workers=self._workers,
+            cache=Manifest.load(self._build_manifest_path(self._local_path)),
+        )
+        r2l.sync(self._remote_path, self._local_path)
+        # snapshots are restored as a whole
+        if on_ready is not None:
+            on_ready()
+
+    def push(
+        self, local_path: str | None = None, changes: set[str] | None = None
+    ):
+        local_path = local_path or self._local_path
+        logger.info(
+            f"Starting snapshot push from local path '{local_path}' to remote path '{self._remote_path}'"
+        )
+        with SYNC_SECONDS.time(direction="push"):
+            self._push(local_path, changes)
+        LAST_SUCCESS.set_to_current_time(operation="push")
+
+    def _push(self, local_path: str, changes: set[str] | None):
+        manifest_path = self._build_manifest_path(local_path)
+        manifest = Manifest.scan(
+            local_path, cache=Manifest.load(manifest_path), changes=changes
+        )
+
+        for rel, entry in manifest.files.items():
+            if not self._chunking:
+                manifest.files[rel] = entry._replace(chunks=None)
+            elif entry.chunks is None:
+                chunks = split_file(os.path.join(local_path, rel))
+                manifest.files[rel] = entry._replace(chunks=chunks)
+
+        head = self._store.read_head()
+        uploaded: set[str] = set()
+        if head:
+            head_manifest = self._store.read_snapshot(head)
+            if head_manifest.diff(manifest).is_empty():
+                logger.info(f"Nothing changed since snapshot '{head}'")
+                manifest.dump(manifest_path)
+                return
+            for entry in head_manifest.files.values():
+                uploaded.update(sha256 for sha256, _ in entry.pieces())
+
+        # sha256 -> (relative path, offset, size) of one place holding the object
+        missing: dict[str, tuple[str, int, int]] = {}
+        skipped = 0
+        for rel, entry in manifest.files.items():
+            offset = 0
+            unchanged = True
+            for sha256, size in entry.pieces():
+                if sha256 not in uploaded:
+                    missing.setdefault(sha256, (rel, offset, size))
+                    unchanged = False
+                offset += size
+            skipped += unchanged
+        FILES_SKIPPED.inc(skipped, direction="push")
+        logger.info(f"Uploading {len(missing)} new objects")
+        run_transfers(
+            (
+                partial(self._upload_object, local_path, sha256, *source)
+                for sha256, source in missing.items()
+            ),
+            self._workers,
+        )
+
+        snapshot_id = self._store.write_snapshot(manifest)
+        self._store.publish(snapshot_id)
+        manifest.dump(manifest_path)
+        self._pushes += 1
+        self._store.collect_garbage(
+            self._keep, self._workers, sweep=self._pushes % GC_SWEEP_INTERVAL == 0
+        )
+        logger.info("Sync completed successfully")
@@ -1,3 +1,5 @@
+from typing import Callable
+
 from migrater.base import Migrater
 from .api import SeaweedfsSyncer
 
@@ -8,13 +10,46 @@ class TrivialMigrater(Migrater):
         local_path: str,
         remote_path: str,
         filer_url: str,
+        *,
+        incremental: bool = False,
+        region_delta: bool = False,
+        keyframe_interval: int = 17,
+        region_lzma: bool = False,
+        region_codec: int | None = None,
+        pull_codec: int | None = None,
+        pack_small_files: bool = False,
+        workers: int = 1,
+        pool_size: int = 16,
+        read_timeout: float = 60,
+        retries: int = 3,
+        rate_limit: float | None = None,
+        adaptive_rate: bool = False,
     ):
         self._local_path = local_path
         self._remote_path = remote_path
-        self._syncer = SeaweedfsSyncer.from_url(filer_url)
+        self._syncer = SeaweedfsSyncer.from_url(
+            filer_url,
+            incremental=incremental,
+            region_delta=region_delta,
+            keyframe_interval=keyframe_interval,
+            region_lzma=region_lzma,
+            region_codec=region_codec,
+            pull_codec=pull_codec,
+            pack_small_files=pack_small_files,
+            workers=workers,
+            pool_size=pool_size,
+            read_timeout=read_timeout,
+            retries=retries,
+            rate_limit=rate_limit,
+            adaptive_rate=adaptive_rate,
+        )
 
-    def pull(self):
-        self._syncer.remote2local(self._remote_path, self._local_path)
+    def pull(self, on_ready: Callable[[], None] | None = None):
+        self._syncer.remote2local(self._remote_path, self._local_path, on_ready)
 
-    def push(self):
-        self._syncer.local2remote(self._local_path, self._remote_path)
+    def push(
+        self, local_path: str | None = None, changes: set[str] | None = None
+    ):
+        self._syncer.local2remote(
+            local_path or self._local_path, self._remote_path, changes
+        )
@@ -0,0 +1,126 @@
+import threading
+from collections import deque
+from time import monotonic, sleep
+from typing import Callable
+
+from loguru import logger
+
+from migrater.metrics import FILER_RTT_SECONDS, RATE_LIMIT
+
+# seconds of the rate a bucket can spend at once after being idle
+BURST_SECONDS = 0.5
+# RTT above the lowest recent one taken for data queued on the link, in seconds
+TARGET_QUEUEING_DELAY = 0.05
+# probes the lowest RTT is taken from
+RTT_WINDOW = 300
+# seconds between probes while no transfers run, which keep the lowest RTT current
+IDLE_PROBE_INTERVAL = 30
+
+
+class TokenBucket:
+    # Caps the bytes moved per second by all threads together. A transfer larger than
+    # what is left in the bucket goes into debt, which the next ones wait out.
+    def __init__(self, rate: float):
+        self._lock = threading.Lock()
+        self._rate = rate
+        self._tokens = rate * BURST_SECONDS
+        self._updated = monotonic()
+        self.last_used = 0.0
+        RATE_LIMIT.set(rate)
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def set_rate(self, rate: float):
+        with self._lock:
+            self._refill()
+            self._rate = rate
+        RATE_LIMIT.set(rate)
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(
+            self._rate * BURST_SECONDS, self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+
+    def consume(self, amount: int):
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            self.last_used = self._updated
+            delay = -self._tokens / self._rate if self._tokens < 0 else 0
+        if delay:
+            sleep(delay)
+
+
+class RttAdapter:
+    # Adapts the rate of `bucket` to the delay transfers add on the link to the filer,
+    # which game traffic sharing the uplink suffers too. While transfers run, `probe`
+    # makes a small request every `interval` seconds. When its RTT exceeds the lowest
+    # recent one by more than TARGET_QUEUEING_DELAY, data is queueing on the link and
+    # the rate is halved, down to `min_rate`; otherwise it grows back by a tenth of
+    # `max_rate` per probe. Probes made while idle only provide the lowest RTT.
+    def __init__(
+        self,
+        bucket: TokenBucket,
+        probe: Callable[[], None],
+        *,
+        max_rate: float,
+        min_rate: float | None = None,
+        interval: float = 1,
+    ):
+        self._bucket = bucket
+        self._probe = probe
+        self._max_rate = max_rate
+        self._min_rate = min_rate or max_rate / 16
+        self._interval = interval
+        self._rtts: deque[float] = deque(maxlen=RTT_WINDOW)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="rtt", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        next_idle_probe = 0.0
+        while True:
+            now = monotonic()
+            active = now - self._bucket.last_used <= self._interval
+            if active or now >= next_idle_probe:
+                try:
+                    rtt = self._measure()
+                    if active:
+                        self._adapt(rtt)
+                    else:
+                        self._rtts.append(rtt)
+                except Exception as e:
+                    logger.warning(f"Cannot adapt the transfer rate: {e}")
+                next_idle_probe = now + IDLE_PROBE_INTERVAL
+            if self._stop.wait(self._interval):
+                return
+
+    def _measure(self) -> float:
+        start = monotonic()
+        self._probe()
+        rtt = monotonic() - start
+        FILER_RTT_SECONDS.observe(rtt)
+        return rtt
+
+    def _adapt(self, rtt: float):
+        self._rtts.append(rtt)
+        rate = self._bucket.rate
+        if rtt - min(self._rtts) > TARGET_QUEUEING_DELAY:
+            new_rate = max(rate / 2, self._min_rate)
+        else:
+            new_rate = min(rate + self._max_rate / 10, self._max_rate)
+        if new_rate != rate:
+            logger.debug(f"RTT {rtt * 1000:.1f}ms, transfer rate now {new_rate:.0f} B/s")
+            self._bucket.set_rate(new_rate)
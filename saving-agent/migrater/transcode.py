@@ -0,0 +1,120 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import PurePosixPath
+from typing import Iterator, NamedTuple
+import os
+
+from loguru import logger
+
+from migrater.mca import MCACompressor
+
+# directories holding region format files, in the overworld and in every dimension
+REGION_DIRS = ("region", "entities", "poi")
+
+
+class TranscodeResult(NamedTuple):
+    rel: str
+    path: str
+    size: int
+
+
+def is_region_file(rel: str) -> bool:
+    path = PurePosixPath(rel)
+    return path.suffix == ".mca" and path.parent.name in REGION_DIRS
+
+
+def find_region_files(local_path: str) -> list[str]:
+    rels = []
+    for root, dirs, names in os.walk(local_path):
+        for name in names:
+            rel = os.path.relpath(os.path.join(root, name), local_path).replace(os.sep, "/")
+            if is_region_file(rel):
+                rels.append(rel)
+    return sorted(rels)
+
+
+def get_available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def transcode_file(src: str, dst: str, compression_type: int) -> int:
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f"{dst}.tmp"
+    with open(src, "rb") as src_f, open(tmp, "wb") as dst_f:
+        MCACompressor(src_f).convert_to(compression_type, dst_f)
+    os.replace(tmp, dst)
+    return os.path.getsize(dst)
+
+
+class BatchTranscoder:
+    # Converts region files of `src_path` into `dst_path` on a process pool, zlib being
+    # CPU bound. Every file is queued as soon as the batch is entered, and `results`
+    # yields them in completion order so that callers can start uploading the first
+    # converted regions while the others are still being worked on.
+    def __init__(
+        self,
+        src_path: str,
+        dst_path: str,
+        rels: list[str],
+        compression_type: int,
+        *,
+        workers: int | None = None,
+    ):
+        self._src_path = src_path
+        self._dst_path = dst_path
+        self._rels = rels
+        self._compression_type = compression_type
+        self._workers = workers or get_available_cores()
+        self._executor: ProcessPoolExecutor | None = None
+        self._pending: dict[Future, str] = {}
+
+    def __enter__(self):
+        if self._rels:
+            logger.info(
+                f"Transcoding {len(self._rels)} region files to compression type "
+                f"{self._compression_type} with {self._workers} processes"
+            )
+            self._executor = ProcessPoolExecutor(max_workers=self._workers)
+            for rel in self._rels:
+                future = self._executor.submit(
+                    transcode_file,
+                    os.path.join(self._src_path, rel),
+                    os.path.join(self._dst_path, rel),
+                    self._compression_type,
+                )
+                self._pending[future] = rel
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self._pending.clear()
+
+    def results(self) -> Iterator[TranscodeResult]:
+        while self._pending:
+            done, _ = wait(self._pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel = self._pending.pop(future)
+                size = future.result()
+                logger.debug(f"Transcoded region file '{rel}' to {size} bytes")
+                yield TranscodeResult(rel, os.path.join(self._dst_path, rel), size)
+
+
+def transcode_in_place(
+    local_path: str,
+    compression_type: int,
+    *,
+    rels: list[str] | None = None,
+    workers: int | None = None,
+):
+    # the converted files replace the originals one by one as they finish
+    if rels is None:
+        rels = find_region_files(local_path)
+    with BatchTranscoder(
+        local_path, local_path, rels, compression_type, workers=workers
+    ) as transcoder:
+        for _ in transcoder.results():
+            pass
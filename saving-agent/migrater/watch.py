@@ -0,0 +1,219 @@
+import ctypes
+import errno
+import os
+import select
+import struct
+import threading
+from time import monotonic
+
+from loguru import logger
+
+from migrater.workdirs import is_work_path, prune_work_dirs
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_ONLYDIR
+)
+INOTIFY_EVENT = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+# changed paths kept before giving up on them and falling back to a full scan
+MAX_CHANGES = 65536
+
+
+def _load_libc():
+    # the symbols already loaded into the interpreter, which include those of the C
+    # library whether it is glibc or musl, where find_library("c") finds nothing
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError) as e:
+        logger.warning(f"Cannot load inotify from the C library: {e}")
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+class ChangeTracker:
+    # Keeps the set of paths under `local_path` changed since the last `take`, as
+    # reported by inotify. It starts out unknown, and becomes unknown again whenever
+    # events may have been missed, such as on a queue overflow or when the kernel
+    # runs out of watches; `take` then returns None and the caller has to fall back
+    # to comparing every file by size and mtime. Without inotify it always does.
+    def __init__(self, local_path: str, *, max_changes: int = MAX_CHANGES):
+        self._local_path = os.path.abspath(local_path)
+        self._max_changes = max_changes
+        self._lock = threading.Lock()
+        # changed path to the time of its last event
+        self._changes: dict[str, float] | None = None
+        self._fd = -1
+        self._watches: dict[int, str] = {}
+        self._broken = False
+        self._thread: threading.Thread | None = None
+        self._stop_r, self._stop_w = os.pipe()
+
+    def start(self):
+        libc = _load_libc()
+        if libc is None:
+            logger.warning("inotify is not available, every push scans the whole save")
+            return
+        self._libc = libc
+        os.makedirs(self._local_path, exist_ok=True)
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            e = ctypes.get_errno()
+            logger.warning(f"Cannot initialize inotify: {os.strerror(e)}")
+            return
+        with self._lock:
+            self._watch_tree("")
+        logger.info(f"Watching {len(self._watches)} directories under '{self._local_path}'")
+        self._thread = threading.Thread(target=self._run, name="watch", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        os.write(self._stop_w, b"\0")
+        if self._thread is not None:
+            self._thread.join()
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        os.close(self._stop_r)
+        os.close(self._stop_w)
+
+    def take(self) -> set[str] | None:
+        # events of writes that completed before this call are already queued by the
+        # kernel, so they are read now instead of waiting for the watch thread
+        with self._lock:
+            if self._fd >= 0:
+                self._read_events()
+            changes = None if self._broken else self._changes
+            self._changes = {}
+        if changes is None:
+            logger.info("Changes since the last push are unknown")
+            return None
+        logger.info(f"{len(changes)} paths changed since the last push")
+        return set(changes)
+
+    def take_settled(self, quiet: float, limit: int) -> set[str] | None:
+        # Like `take`, but only up to `limit` paths without events for `quiet` seconds,
+        # which the game is done writing for now; the others are kept for later.
+        with self._lock:
+            if self._fd >= 0:
+                self._read_events()
+            if self._broken or self._changes is None:
+                self._changes = {}
+                logger.info("Changes since the last push are unknown")
+                return None
+            # paths are kept in the order of their last event, oldest first
+            now = monotonic()
+            settled = []
+            for rel, at in self._changes.items():
+                if now - at < quiet or len(settled) >= limit:
+                    break
+                settled.append(rel)
+            for rel in settled:
+                del self._changes[rel]
+        return set(settled)
+
+    def invalidate(self):
+        # the changes taken last were not pushed after all
+        with self._lock:
+            self._changes = None
+
+    def _run(self):
+        while True:
+            readable, _, _ = select.select([self._fd, self._stop_r], [], [])
+            if self._stop_r in readable:
+                return
+            with self._lock:
+                self._read_events()
+
+    def _mark(self, rel: str):
+        if self._changes is None:
+            return
+        # moved to the end, so that the dict stays ordered by the time of the event
+        self._changes.pop(rel, None)
+        self._changes[rel] = monotonic()
+        if len(self._changes) > self._max_changes:
+            logger.warning(
+                f"More than {self._max_changes} paths changed, "
+                "the next push scans the whole save"
+            )
+            self._changes = None
+
+    def _watch_tree(self, rel: str):
+        for root, dirs, files in os.walk(os.path.join(self._local_path, rel)):
+            prune_work_dirs(root, self._local_path, dirs)
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                e = ctypes.get_errno()
+                if e in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                # most likely out of watches, see fs.inotify.max_user_watches
+                logger.error(
+                    f"Cannot watch '{root}', tracking changes is disabled: {os.strerror(e)}"
+                )
+                self._broken = True
+                return
+            self._watches[wd] = os.path.relpath(root, self._local_path)
+
+    def _read_events(self):
+        while True:
+            try:
+                data = os.read(self._fd, READ_SIZE)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("inotify queue overflowed, the next push scans the whole save")
+            self._changes = None
+            return
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+        root = self._watches.get(wd)
+        if root is None or not name:
+            return
+        rel = os.path.normpath(os.path.join(root, name)).replace(os.sep, "/")
+        if is_work_path(rel):
+            # held in the save when it is a mount point, see `migrater.workdirs`
+            return
+        if mask & IN_ISDIR and mask & IN_MOVED_FROM:
+            # the watches below it now report paths that no longer exist
+            logger.warning(f"Directory '{rel}' moved, the next push scans the whole save")
+            self._changes = None
+            return
+        self._mark(rel)
+        # a directory created or moved in has no watch yet, and may already hold files
+        # the events of which were missed; marking it has its whole tree rescanned
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            self._watch_tree(rel)
@@ -0,0 +1,27 @@
+import os
+
+# Work directories of a save: the copy it is frozen into before a push, the
+# directories a pull is staged in and keeps the previous files in, and the one it
+# sets aside pulled regions the game had already created in. They are renamed
+# into or linked from the save, so they have to be on its filesystem, and are kept
+# next to it. A save that is a mount point, such as a volume shared with the game
+# container, holds them itself under these names, which walks and watches of the save
+# leave out.
+WORK_DIRS = (".frozen", ".staging", ".backup", ".conflicts")
+
+
+def build_work_path(local_path: str, name: str) -> str:
+    if os.path.ismount(local_path):
+        return os.path.join(local_path, f".{name}")
+    return f"{local_path}.{name}"
+
+
+def is_work_path(rel: str) -> bool:
+    # `rel` is "/" separated and relative to the save
+    return rel.split("/", 1)[0] in WORK_DIRS
+
+
+def prune_work_dirs(root: str, local_path: str, dirs: list[str]):
+    # for os.walk of a save, to skip the work directories held in it
+    if os.path.normpath(root) == os.path.normpath(local_path):
+        dirs[:] = [d for d in dirs if d not in WORK_DIRS]
@@ -0,0 +1,132 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+import socket
+import struct
+import threading
+
+from loguru import logger
+
+RCON_TYPE_COMMAND = 2
+RCON_TYPE_AUTH_RESPONSE = 2
+RCON_TYPE_AUTH = 3
+# any other type is answered with an "Unknown request" packet carrying its id, which
+# marks the end of a response the server split over several packets
+RCON_TYPE_SENTINEL = 200
+RCON_HEADER = struct.Struct("<iii")
+
+
+class RconError(Exception):
+    pass
+
+
+class RconClient:
+    # One RCON connection kept open for the whole life of the agent. It is opened on the
+    # first command, and reopened once per command when the server went away meanwhile.
+    # Blocking commands are serialised by a lock; the async ones run in order on a
+    # dedicated thread, so the event loop never waits on the game server.
+    def __init__(self, host: str, port: int, password: str, *, timeout: float = 30):
+        self._host = host
+        self._port = port
+        self._password = password
+        self._timeout = timeout
+        self._socket: socket.socket | None = None
+        self._request_id = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rcon")
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _disconnect(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+            self._socket = None
+
+    def _connect(self):
+        logger.info(f"Connecting to RCON at {self._host}:{self._port}")
+        self._socket = socket.create_connection((self._host, self._port), self._timeout)
+        self._socket.settimeout(self._timeout)
+        request_id = self._send(RCON_TYPE_AUTH, self._password)
+        while True:
+            response_id, response_type, _ = self._receive()
+            if response_type == RCON_TYPE_AUTH_RESPONSE:
+                break
+        if response_id == -1 or response_id != request_id:
+            self._disconnect()
+            raise RconError("RCON authentication failed")
+
+    def _send(self, packet_type: int, body: str) -> int:
+        self._request_id = self._request_id % 0x7FFFFFFF + 1
+        payload = (
+            RCON_HEADER.pack(
+                RCON_HEADER.size - 4 + len(body.encode()) + 2,
+                self._request_id,
+                packet_type,
+            )
+            + body.encode()
+            + b"\0\0"
+        )
+        self._socket.sendall(payload)
+        return self._request_id
+
+    def _read_exactly(self, size: int) -> bytes:
+        buffer = bytearray()
+        while len(buffer) < size:
+            data = self._socket.recv(size - len(buffer))
+            if not data:
+                raise RconError("RCON connection closed by the server")
+            buffer.extend(data)
+        return bytes(buffer)
+
+    def _receive(self) -> tuple[int, int, str]:
+        (length,) = struct.unpack("<i", self._read_exactly(4))
+        packet = self._read_exactly(length)
+        response_id, response_type = struct.unpack("<ii", packet[:8])
+        return response_id, response_type, packet[8:-2].decode(errors="replace")
+
+    def _execute(self, command: str) -> str:
+        request_id = self._send(RCON_TYPE_COMMAND, command)
+        sentinel_id = self._send(RCON_TYPE_SENTINEL, "")
+        parts = []
+        while True:
+            response_id, _, body = self._receive()
+            if response_id == sentinel_id:
+                return "".join(parts)
+            if response_id == request_id:
+                parts.append(body)
+
+    def command(self, command: str) -> str:
+        with self._lock:
+            while True:
+                # only a connection left over from earlier commands is worth retrying on,
+                # a fresh one failing means the server is really unreachable or stuck
+                fresh = self._socket is None
+                try:
+                    if fresh:
+                        self._connect()
+                    return self._execute(command)
+                except (OSError, RconError) as e:
+                    self._disconnect()
+                    if fresh:
+                        raise RconError(f"RCON command '{command}' failed: {e}") from e
+                    logger.warning(f"RCON command '{command}' failed, reconnecting: {e}")
+
+    async def acommand(self, command: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.command, command)
+
+    def broadcast(self, message: str) -> Future:
+        # queued behind earlier commands and not waited for; a failure is only logged
+        future = self._executor.submit(self.command, f"say {message}")
+        future.add_done_callback(_log_broadcast_failure)
+        return future
+
+
+def _log_broadcast_failure(future: Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"RCON broadcast failed: {future.exception()}")
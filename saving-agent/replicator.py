@@ -0,0 +1,85 @@
+import threading
+from time import monotonic
+
+from loguru import logger
+
+from migrater.base import Migrater
+from migrater.watch import ChangeTracker
+
+# longest wait between two attempts after failed pushes, in seconds
+MAX_BACKOFF = 60
+
+
+class Replicator:
+    # Write-behind replication of the local save. Files are pushed once the game has
+    # not written them for `debounce` seconds, at most `batch` paths per push and one
+    # push every `interval` seconds, or back to back while a backlog is drained. The
+    # backlog itself is bounded by the change tracker, which falls back to a full
+    # scan when too many paths are pending. Pushes never overlap: a checkpoint waits
+    # for the running one, then pushes everything still pending right away.
+    def __init__(
+        self,
+        migrater: Migrater,
+        tracker: ChangeTracker,
+        local_path: str,
+        *,
+        interval: float = 5,
+        debounce: float = 2,
+        batch: int = 256,
+    ):
+        self._migrater = migrater
+        self._tracker = tracker
+        self._local_path = local_path
+        self._interval = interval
+        self._debounce = debounce
+        self._batch = batch
+        self._push_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        logger.info(
+            f"Replicating '{self._local_path}' every {self._interval}s, "
+            f"{self._debounce}s after the last write"
+        )
+        self._thread = threading.Thread(target=self._run, name="replicate", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def checkpoint(self):
+        with self._push_lock:
+            self._push(self._tracker.take())
+
+    def _run(self):
+        delay = self._interval
+        failures = 0
+        while not self._stop.wait(delay):
+            try:
+                with self._push_lock:
+                    changes = self._tracker.take_settled(self._debounce, self._batch)
+                    if changes is None or changes:
+                        self._push(changes)
+                failures = 0
+                # a full batch means more are waiting
+                delay = 0 if changes and len(changes) >= self._batch else self._interval
+            except Exception as e:
+                failures += 1
+                delay = min(self._interval * 2**failures, MAX_BACKOFF)
+                logger.error(f"Replication failed with error, retrying in {delay}s: {e}")
+
+    def _push(self, changes: set[str] | None):
+        time0 = monotonic()
+        try:
+            self._migrater.push(self._local_path, changes)
+        except Exception:
+            # what was taken may be partly unpushed, the next push checks everything
+            self._tracker.invalidate()
+            raise
+        logger.info(
+            f"Replicated {'all' if changes is None else len(changes)} changed paths "
+            f"in {monotonic() - time0:.3f}s"
+        )
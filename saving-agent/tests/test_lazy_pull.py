@@ -0,0 +1,123 @@
+import asyncio
+import filecmp
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+from loguru import logger  # noqa: E402
+
+from fake_filer import FakeFiler  # noqa: E402
+import main  # noqa: E402
+from migrater.manifest import PullIndex  # noqa: E402
+from migrater.seaweedfs import TrivialMigrater  # noqa: E402
+from migrater.seaweedfs.api import PullConflictError  # noqa: E402
+from migrater.transcode import is_region_file  # noqa: E402
+
+
+class LazyPullConflictTest(unittest.TestCase):
+    # A region the game creates while the lazy pull is still streaming regions in
+    # must neither be overwritten nor pushed over the remote one.
+    def setUp(self):
+        logger.disable("migrater")
+        logger.disable("main")
+        self._tmp = tempfile.TemporaryDirectory()
+        self.save_path = os.path.join(self._tmp.name, "save")
+        self.pull_path = os.path.join(self._tmp.name, "pulled")
+        # without a level.dat the spawn is at region 0, 0, so regions from x = 2 on
+        # are pulled after the game starts
+        for x in range(6):
+            self._write(f"world/region/r.{x}.0.mca", os.urandom(64 * 1024))
+        self._write("world/playerdata/player.dat", os.urandom(1024))
+        self.filer = FakeFiler()
+        self.filer.start()
+        TrivialMigrater(self.save_path, "/save", self.filer.url).push()
+
+    def tearDown(self):
+        self.filer.close()
+        self._tmp.cleanup()
+        logger.enable("migrater")
+        logger.enable("main")
+
+    def _write(self, rel: str, bs: bytes):
+        path = os.path.join(self.save_path, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(bs)
+
+    def _create_deferred_region(self) -> str:
+        # called once the game may start: regions not pulled yet are the deferred ones
+        remote = sorted(
+            path[len("/save/") :]
+            for path in self.filer.files()
+            if is_region_file(path)
+        )
+        rel = next(
+            rel
+            for rel in remote
+            if not os.path.exists(os.path.join(self.pull_path, rel))
+        )
+        with open(os.path.join(self.pull_path, rel), "wb") as f:
+            f.write(b"written by the game")
+        return rel
+
+    def test_keeps_game_region_and_sets_remote_aside(self):
+        created = []
+        puller = TrivialMigrater(self.pull_path, "/save", self.filer.url)
+        with self.assertRaises(PullConflictError) as cm:
+            puller.pull(on_ready=lambda: created.append(self._create_deferred_region()))
+        rel = created[0]
+        self.assertEqual(cm.exception.rels, [rel])
+
+        with open(os.path.join(self.pull_path, rel), "rb") as f:
+            self.assertEqual(f.read(), b"written by the game")
+        conflict_file = os.path.join(cm.exception.conflicts_path, rel)
+        self.assertTrue(
+            filecmp.cmp(os.path.join(self.save_path, rel), conflict_file, shallow=False)
+        )
+        index = PullIndex.load(f"{self.pull_path}.pull-index.json")
+        self.assertNotIn(rel, index.files)
+        # every other region is pulled as usual
+        for path in self.filer.files():
+            other = path[len("/save/") :]
+            if is_region_file(path) and other != rel:
+                self.assertTrue(
+                    filecmp.cmp(
+                        os.path.join(self.save_path, other),
+                        os.path.join(self.pull_path, other),
+                        shallow=False,
+                    )
+                )
+
+    def test_save_refuses_to_push_after_conflict(self):
+        puller = TrivialMigrater(self.pull_path, "/save", self.filer.url)
+
+        class StartingGame:
+            # the game creates a region as soon as the agent reports ready
+            def pull(_, on_ready):
+                def start():
+                    on_ready()
+                    self._create_deferred_region()
+
+                puller.pull(on_ready=start)
+
+        main.migrater_instance = StartingGame()
+        main.ready.clear()
+        try:
+            main.pull(lazy=True)
+            self.assertIsInstance(main.pull_error, PullConflictError)
+            self.filer.reset_stats()
+            with self.assertRaisesRegex(Exception, "Not pushing"):
+                asyncio.run(main.save())
+            self.assertEqual(self.filer.stats()["upload"], 0)
+        finally:
+            main.migrater_instance = None
+            main.pull_error = None
+            main.ready.clear()
+
+
+if __name__ == "__main__":
+    unittest.main()
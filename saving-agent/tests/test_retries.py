@@ -0,0 +1,97 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from loguru import logger  # noqa: E402
+
+from migrater.seaweedfs.api import SeaweedfsClient, SeaweedfsClientError  # noqa: E402
+
+
+class _FlakyFiler:
+    # Answers every request but listings of "/" with one 503 before it succeeds, and
+    # counts the requests per method and path.
+    def __init__(self):
+        self.requests: Counter[tuple[str, str]] = Counter()
+        filer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                path = urlsplit(self.path).path
+                filer.requests[(self.command, path)] += 1
+                if path == "/":
+                    code, j = 200, {"Path": "/", "Entries": None}
+                elif filer.requests[(self.command, path)] == 1:
+                    code, j = 503, {"error": "unavailable"}
+                else:
+                    code, j = 201, {"name": path.rsplit("/", 1)[1], "size": 0}
+                body = json.dumps(j).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        host, port = self._server.server_address[:2]
+        self.url = f"http://{host}:{port}"
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        logger.disable("migrater")
+        self.filer = _FlakyFiler()
+        self.client = SeaweedfsClient(self.filer.url, retries=2, backoff_factor=0)
+        self._tmp = tempfile.TemporaryDirectory()
+        self.local_file = os.path.join(self._tmp.name, "level.dat")
+        with open(self.local_file, "wb") as f:
+            f.write(b"level")
+
+    def tearDown(self):
+        self.client.close()
+        self.filer.close()
+        self._tmp.cleanup()
+        logger.enable("migrater")
+
+    def test_overwrites_are_retried(self):
+        self.client.upload(self.local_file, "/save/level.dat")
+        self.client.upload(self.local_file, "/save/level.put", use_put=True)
+        self.client.write(b"data", "/save/data.bin")
+        self.client.delete("/save/old.dat")
+        self.assertEqual(self.filer.requests[("POST", "/save/level.dat")], 2)
+        self.assertEqual(self.filer.requests[("PUT", "/save/level.put")], 2)
+        self.assertEqual(self.filer.requests[("POST", "/save/data.bin")], 2)
+        self.assertEqual(self.filer.requests[("DELETE", "/save/old.dat")], 2)
+
+    def test_appends_and_moves_are_not_repeated(self):
+        with self.assertRaises(SeaweedfsClientError):
+            self.client.upload(self.local_file, "/save/log.txt", append=True)
+        with self.assertRaises(SeaweedfsClientError):
+            self.client.move("/save", "/save.backup")
+        self.assertEqual(self.filer.requests[("POST", "/save/log.txt")], 1)
+        self.assertEqual(self.filer.requests[("POST", "/save.backup")], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+from loguru import logger  # noqa: E402
+
+from fake_filer import FakeFiler  # noqa: E402
+from migrater.manifest import hash_file  # noqa: E402
+from migrater.seaweedfs.api import TRANSFER_BLOCK_SIZE, SeaweedfsClient  # noqa: E402
+from streaming_memory import MIB, measure, write_file  # noqa: E402
+
+SMALL_SIZE = 4 * MIB
+LARGE_SIZE = 64 * MIB
+# what a transfer may peak at over the smaller file, a few blocks and their copies
+GROWTH_ALLOWANCE = 8 * TRANSFER_BLOCK_SIZE
+
+
+class StreamingMemoryTest(unittest.TestCase):
+    # The Python allocations of a transfer must not follow the size of the file.
+    @classmethod
+    def setUpClass(cls):
+        logger.disable("migrater")
+        cls._tmp = tempfile.TemporaryDirectory()
+        cls.filer = FakeFiler()
+        cls.filer.start()
+        cls.client = SeaweedfsClient(cls.filer.url, pool_size=1)
+        cls.files = {}
+        for size in (SMALL_SIZE, LARGE_SIZE):
+            path = os.path.join(cls._tmp.name, f"{size}.bin")
+            write_file(path, size)
+            cls.files[size] = path
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.close()
+        cls.filer.close()
+        cls._tmp.cleanup()
+        logger.enable("migrater")
+
+    def _assert_flat(self, transfer):
+        peaks = {}
+        for size, path in self.files.items():
+            _, peaks[size], _ = measure(lambda: transfer(size, path))
+        self.assertLess(peaks[LARGE_SIZE], peaks[SMALL_SIZE] + GROWTH_ALLOWANCE, peaks)
+
+    def test_upload_post(self):
+        self._assert_flat(
+            lambda size, path: self.client.upload(
+                path, f"/post/{size}.bin", sha256=hash_file(path)
+            )
+        )
+        self.assertEqual(self.filer.files()[f"/post/{LARGE_SIZE}.bin"], LARGE_SIZE)
+
+    def test_upload_put(self):
+        self._assert_flat(
+            lambda size, path: self.client.upload(path, f"/put/{size}.bin", use_put=True)
+        )
+        self.assertEqual(self.filer.files()[f"/put/{LARGE_SIZE}.bin"], LARGE_SIZE)
+
+    def test_download(self):
+        for size, path in self.files.items():
+            self.client.upload(path, f"/download/{size}.bin")
+        pulled = os.path.join(self._tmp.name, "pulled.bin")
+        self._assert_flat(
+            lambda size, _: self.client.download(f"/download/{size}.bin", pulled)
+        )
+        self.assertEqual(os.path.getsize(pulled), LARGE_SIZE)
+
+
+if __name__ == "__main__":
+    unittest.main()